@@ -2,6 +2,7 @@
 -- Storico Prenotazioni Cliente (Vista Lista)
 -- Query ottimizzata per visualizzazione in lista dello storico.
 -- Mostra solo le informazioni essenziali per l'overview.
+-- Usa le viste all_* per includere anche le prenotazioni archiviate.
 -- I parametri di input sono:
 -- - user_id: ID dell'utente di cui recuperare lo storico
 -- ========================================
@@ -33,35 +34,35 @@ SELECT
         ELSE 'SCHEDULED'
     END AS trip_status
 
-FROM bookings b
+FROM all_bookings b
 JOIN stations st_origin ON b.origin_station_id = st_origin.id
 JOIN stations st_dest ON b.destination_station_id = st_dest.id
 
 -- Primo segmento per partenza
-JOIN booking_segments bs_first ON b.id = bs_first.booking_id AND bs_first.sequence = 1
+JOIN all_booking_segments bs_first ON b.id = bs_first.booking_id AND bs_first.sequence = 1
 -- Ultimo segmento per arrivo
-JOIN booking_segments bs_last ON b.id = bs_last.booking_id 
+JOIN all_booking_segments bs_last ON b.id = bs_last.booking_id 
     AND bs_last.sequence = (
         SELECT MAX(sequence) 
-        FROM booking_segments 
+        FROM all_booking_segments 
         WHERE booking_id = b.id
     )
-JOIN trips tr_first ON bs_first.trip_id = tr_first.id
+JOIN all_trips tr_first ON bs_first.trip_id = tr_first.id
 JOIN train_services ts_first ON tr_first.train_service_id = ts_first.id
 
--- Aggregazione stati dei trip
-JOIN (
+-- Aggregazione stati dei trip (LATERAL: solo i segmenti delle prenotazioni dell'utente,
+-- senza aggregare l'intero storico attivo e archiviato)
+JOIN LATERAL (
     SELECT 
-        bs.booking_id,
         COUNT(*) as total_count,
         COUNT(CASE WHEN tr.status = 'CANCELED' THEN 1 END) as canceled_count,
         COUNT(CASE WHEN tr.status = 'COMPLETED' THEN 1 END) as completed_count,
         COUNT(CASE WHEN tr.status = 'RUNNING' THEN 1 END) as running_count,
         COUNT(CASE WHEN tr.status = 'DELAYED' THEN 1 END) as delayed_count
-    FROM booking_segments bs
-    JOIN trips tr ON bs.trip_id = tr.id
-    GROUP BY bs.booking_id
-) trip_stats ON b.id = trip_stats.booking_id
+    FROM all_booking_segments bs
+    JOIN all_trips tr ON bs.trip_id = tr.id
+    WHERE bs.booking_id = b.id
+) trip_stats ON true
 
 WHERE b.user_id = '5aebba09-33bb-4e3b-9aae-1329bff84349' -- Parametro: user_id
 
@@ -128,8 +128,8 @@ SELECT
     sd.is_international,
     
     -- Dettagli orari della tratta
-    tsu_from.planned_departure AS departure_time,
-    tsu_to.planned_arrival AS arrival_time,
+    planned.departure_time,
+    planned.arrival_time,
     
     -- Calcolo del prezzo per la tratta specifica
     bf.base_fare,
@@ -187,10 +187,15 @@ JOIN route_stations rs_from ON rs_from.route_id = ts.route_id
     AND rs_from.station_id = sd.origin_station_id
 JOIN route_stations rs_to ON rs_to.route_id = ts.route_id 
     AND rs_to.station_id = sd.destination_station_id
-JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id 
+-- Orari pianificati dagli offset della rotta, salvo variazioni in trip_station_updates
+LEFT JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id 
     AND tsu_from.route_station_id = rs_from.id
-JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id 
+LEFT JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id 
     AND tsu_to.route_station_id = rs_to.id
+CROSS JOIN LATERAL (SELECT
+    COALESCE(tsu_from.planned_departure, t.planned_departure_time + rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+    COALESCE(tsu_to.planned_arrival, t.planned_departure_time + rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+) planned
 
 -- Join con la tariffa migliore
 CROSS JOIN best_fare bf;
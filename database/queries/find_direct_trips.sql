@@ -11,8 +11,8 @@
 
 SELECT
     t.id AS trip_id,
-    tsu_from.planned_departure AS departure_time,
-    tsu_to.planned_arrival AS arrival_time,
+    planned.departure_time,
+    planned.arrival_time,
     st_from.name AS origin_station,
     st_to.name AS destination_station,
     ts.service_name,
@@ -30,8 +30,14 @@ JOIN route_stations rs_to ON ts.route_id = rs_to.route_id
     AND rs_from.sequence < rs_to.sequence
 JOIN stations st_from ON rs_from.station_id = st_from.id
 JOIN stations st_to ON rs_to.station_id = st_to.id
-JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id AND tsu_from.route_station_id = rs_from.id
-JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id AND tsu_to.route_station_id = rs_to.id
+-- Gli orari pianificati derivano dagli offset della rotta: trip_station_updates ha righe
+-- solo per le fermate con variazioni d'orario, che prevalgono sull'orario calcolato.
+LEFT JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id AND tsu_from.route_station_id = rs_from.id
+LEFT JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id AND tsu_to.route_station_id = rs_to.id
+CROSS JOIN LATERAL (SELECT
+    COALESCE(tsu_from.planned_departure, t.planned_departure_time + rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+    COALESCE(tsu_to.planned_arrival, t.planned_departure_time + rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+) planned
 WHERE
     rs_from.station_id = 'fcd785f6-0d6d-4978-9c3e-48871240ea80' -- Parametro: ID Stazione di Origine (es. Firenze)
     AND rs_to.station_id = '6797b5e8-71c6-4aa7-8fe4-20bf54cc91e8'   -- Parametro: ID Stazione di Destinazione (es. Roma)
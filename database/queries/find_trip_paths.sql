@@ -22,14 +22,14 @@ WITH RECURSIVE trip_paths AS (
         ARRAY[t.id] AS trip_ids,
         ARRAY[rs_to.station_id] AS visited_station_ids, -- Array di ID stazioni per evitare cicli
         rs_to.station_id AS last_station_id,            -- Ultima stazione raggiunta nel percorso
-        tsu_to.planned_arrival AS last_arrival_time,    -- Orario di arrivo all'ultima stazione
+        planned.arrival_time AS last_arrival_time,      -- Orario di arrivo all'ultima stazione
         0 AS changes,                                   -- Contatore dei cambi, 0 per i diretti
 
         -- Dettagli dei segmenti che compongono l'itinerario
         ARRAY[st_from.name] AS segment_origins,
         ARRAY[st_to.name] AS segment_destinations,
-        ARRAY[tsu_from.planned_departure] AS segment_departures,
-        ARRAY[tsu_to.planned_arrival] AS segment_arrivals,
+        ARRAY[planned.departure_time] AS segment_departures,
+        ARRAY[planned.arrival_time] AS segment_arrivals,
         ARRAY[ro.name] AS segment_operators,
         ARRAY[stype.name] AS segment_service_types
 
@@ -41,8 +41,13 @@ WITH RECURSIVE trip_paths AS (
     JOIN route_stations rs_to ON ts.route_id = rs_to.route_id AND rs_from.sequence < rs_to.sequence
     JOIN stations st_from ON rs_from.station_id = st_from.id
     JOIN stations st_to ON rs_to.station_id = st_to.id
-    JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id AND tsu_from.route_station_id = rs_from.id
-    JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id AND tsu_to.route_station_id = rs_to.id
+    -- Orari pianificati dagli offset della rotta, salvo variazioni in trip_station_updates
+    LEFT JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id AND tsu_from.route_station_id = rs_from.id
+    LEFT JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id AND tsu_to.route_station_id = rs_to.id
+    CROSS JOIN LATERAL (SELECT
+        COALESCE(tsu_from.planned_departure, t.planned_departure_time + rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+        COALESCE(tsu_to.planned_arrival, t.planned_departure_time + rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+    ) planned
     WHERE
         rs_from.station_id = 'e4cb671d-12ce-47c7-be03-8f94cb2ffb6c' -- Parametro: ID Stazione di Origine (Milano)
         AND t.service_date = '2025-09-03' -- Parametro: Data del viaggio
@@ -60,14 +65,14 @@ WITH RECURSIVE trip_paths AS (
         tp.trip_ids || next_trip.id,
         tp.visited_station_ids || next_rs_to.station_id,
         next_rs_to.station_id,
-        next_tsu_to.planned_arrival,
+        next_planned.arrival_time,
         tp.changes + 1,
 
         -- Estensione dei dettagli dei segmenti con il nuovo viaggio
         tp.segment_origins || next_st_from.name,
         tp.segment_destinations || next_st_to.name,
-        tp.segment_departures || next_tsu_from.planned_departure,
-        tp.segment_arrivals || next_tsu_to.planned_arrival,
+        tp.segment_departures || next_planned.departure_time,
+        tp.segment_arrivals || next_planned.arrival_time,
         tp.segment_operators || next_ro.name,
         tp.segment_service_types || next_stype.name
 
@@ -81,13 +86,17 @@ WITH RECURSIVE trip_paths AS (
     JOIN route_stations next_rs_to ON next_ts.route_id = next_rs_to.route_id AND next_rs_from.sequence < next_rs_to.sequence
     JOIN stations next_st_from ON next_rs_from.station_id = next_st_from.id
     JOIN stations next_st_to ON next_rs_to.station_id = next_st_to.id
-    JOIN trip_station_updates next_tsu_from ON next_tsu_from.trip_id = next_trip.id AND next_tsu_from.route_station_id = next_rs_from.id
-    JOIN trip_station_updates next_tsu_to ON next_tsu_to.trip_id = next_trip.id AND next_tsu_to.route_station_id = next_rs_to.id
+    LEFT JOIN trip_station_updates next_tsu_from ON next_tsu_from.trip_id = next_trip.id AND next_tsu_from.route_station_id = next_rs_from.id
+    LEFT JOIN trip_station_updates next_tsu_to ON next_tsu_to.trip_id = next_trip.id AND next_tsu_to.route_station_id = next_rs_to.id
+    CROSS JOIN LATERAL (SELECT
+        COALESCE(next_tsu_from.planned_departure, next_trip.planned_departure_time + next_rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+        COALESCE(next_tsu_to.planned_arrival, next_trip.planned_departure_time + next_rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+    ) next_planned
     WHERE
         -- Vincolo di connessione: la nuova partenza deve avvenire dalla stazione di arrivo precedente.
         next_rs_from.station_id = tp.last_station_id
         -- Vincolo temporale: garantisce un tempo minimo per il cambio (es. 20 minuti).
-        AND next_tsu_from.planned_departure > tp.last_arrival_time + INTERVAL '20 minutes'
+        AND next_planned.departure_time > tp.last_arrival_time + INTERVAL '20 minutes'
 
         -- Vincoli di terminazione e ottimizzazione della ricerca
         -- Limita il numero massimo di cambi (in questo caso, max 2 cambio, quindi 3 segmenti).
@@ -95,7 +104,7 @@ WITH RECURSIVE trip_paths AS (
         -- Evita i cicli: non visitare una stazione in cui si è già passati.
         AND NOT (next_rs_to.station_id = ANY(tp.visited_station_ids))
         -- Limita la finestra di ricerca per le partenze (es. entro 6 ore dalla partenza originale).
-        AND next_tsu_from.planned_departure < tp.segment_departures[1] + INTERVAL '6 hours'
+        AND next_planned.departure_time < tp.segment_departures[1] + INTERVAL '6 hours'
 )
 -- ===================================================================
 -- SELEZIONE FINALE: Filtra e ordina i risultati
@@ -69,8 +69,9 @@ JOIN route_stations rs_dest ON bs.destination_route_station_id = rs_dest.id
 
 -- Join per posto e categoria
 LEFT JOIN seat_reservations sr ON t.seat_reservation_id = sr.id
-LEFT JOIN wagon_seats ws ON sr.wagon_seat_id = ws.id
-LEFT JOIN wagons w ON ws.wagon_id = w.id
+LEFT JOIN wagons w ON sr.wagon_id = w.id
+LEFT JOIN seat_map_seats ws ON ws.template_id = w.seat_map_template_id
+    AND ws.seat_row = sr.seat_row AND ws.seat_column = sr.seat_column
 LEFT JOIN wagon_categories wc ON w.category_id = wc.id
 
 -- Parametro: ticket_number (il numero del biglietto da validare)
@@ -1,5 +1,7 @@
 -- Enable UUID generation
 CREATE EXTENSION IF NOT EXISTS pgcrypto;
+-- Operatori di uguaglianza GiST per UUID (vincolo di esclusione su seat_reservations)
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 
 -- =========================
 -- ENUM TYPES
@@ -113,10 +115,39 @@ CREATE TABLE wagon_categories (
   updated_at TIMESTAMPTZ NOT NULL
 );
 
+-- Mappa posti condivisa da tutti i vagoni con la stessa disposizione (righe, posti per riga,
+-- layout): i posti esistono una volta per template invece che una volta per vagone
+CREATE TABLE seat_map_templates (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  layout_key TEXT UNIQUE NOT NULL,
+  total_rows INTEGER NOT NULL,
+  seats_per_row INTEGER NOT NULL,
+  layout_pattern TEXT,
+  seat_count INTEGER NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL
+);
+
+-- Posti del template indicizzati da (riga, colonna); righe immutabili, senza timestamp
+CREATE TABLE seat_map_seats (
+  template_id UUID REFERENCES seat_map_templates(id),
+  seat_row SMALLINT NOT NULL,
+  seat_column SMALLINT NOT NULL,
+  seat_number TEXT NOT NULL,
+  column_letter TEXT NOT NULL,
+  seat_type seat_type NOT NULL,
+  seat_orientation seat_orientation DEFAULT 'FORWARD' NOT NULL,
+  is_accessible BOOLEAN DEFAULT FALSE NOT NULL,
+  cabin_number TEXT,
+  PRIMARY KEY (template_id, seat_row, seat_column),
+  UNIQUE (template_id, seat_number)
+);
+
 CREATE TABLE wagons (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
   code VARCHAR(20) UNIQUE NOT NULL,
   category_id UUID REFERENCES wagon_categories(id),
+  seat_map_template_id UUID REFERENCES seat_map_templates(id),
   total_seats INTEGER,
   total_rows INTEGER,
   seats_per_row INTEGER,
@@ -125,6 +156,7 @@ CREATE TABLE wagons (
   created_at TIMESTAMPTZ NOT NULL,
   updated_at TIMESTAMPTZ NOT NULL
 );
+CREATE INDEX idx_wagons_seat_map_template_id ON wagons(seat_map_template_id);
 
 CREATE TABLE cabins (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -138,22 +170,13 @@ CREATE TABLE cabins (
   UNIQUE(wagon_id, cabin_number)
 );
 
-CREATE TABLE wagon_seats (
-  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-  wagon_id UUID REFERENCES wagons(id),
-  cabin_id UUID REFERENCES cabins(id),
-  seat_number TEXT NOT NULL,
-  seat_type seat_type NOT NULL,
-  seat_orientation seat_orientation DEFAULT 'FORWARD' NOT NULL,
-  row_number INTEGER,
-  column_letter TEXT,
-  is_accessible BOOLEAN DEFAULT FALSE NOT NULL,
-  created_at TIMESTAMPTZ NOT NULL,
-  updated_at TIMESTAMPTZ NOT NULL,
-  UNIQUE(wagon_id, seat_number)
-);
-CREATE INDEX idx_wagon_seats_wagon_seat_type ON wagon_seats(wagon_id, seat_type);
-CREATE INDEX idx_wagon_seats_cabin_id ON wagon_seats(cabin_id);
+-- Posti di ogni vagone espansi dal suo template: un posto è identificato da (wagon_id, seat_row, seat_column)
+CREATE VIEW wagon_seats AS
+SELECT w.id AS wagon_id, s.seat_row, s.seat_column, s.seat_number, s.seat_type, s.seat_orientation,
+       s.seat_row + w.row_numbering_start - 1 AS row_number, s.column_letter, s.is_accessible, c.id AS cabin_id
+FROM wagons w
+JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
+LEFT JOIN cabins c ON c.wagon_id = w.id AND c.cabin_number = s.cabin_number;
 
 -- =========================
 -- TRAINS & ROUTES
@@ -255,6 +278,9 @@ CREATE INDEX idx_trips_service_date_delay ON trips(service_date, delay_minutes);
 CREATE INDEX idx_trips_planned_departure_time ON trips(planned_departure_time);
 CREATE INDEX idx_trips_status_departure_time ON trips(status, planned_departure_time);
 
+-- Solo le fermate con orari effettivi, ritardi o variazioni d'orario: gli orari pianificati
+-- derivano da trips.planned_departure_time + offset di route_stations (vista trip_stop_times).
+-- planned_arrival/planned_departure valorizzati solo per variare l'orario di una singola corsa
 CREATE TABLE trip_station_updates (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
   trip_id UUID REFERENCES trips(id),
@@ -273,6 +299,17 @@ CREATE INDEX idx_trip_station_updates_updated ON trip_station_updates(updated_at
 CREATE INDEX idx_trip_station_updates_trip_updated ON trip_station_updates(trip_id, updated_at);
 CREATE INDEX idx_trip_station_updates_delay_updated ON trip_station_updates(delay_minutes, updated_at);
 
+-- Orari di ogni fermata di ogni viaggio: pianificati dagli offset (salvo variazioni) e dati in tempo reale
+CREATE VIEW trip_stop_times AS
+SELECT t.id AS trip_id, rs.id AS route_station_id, rs.station_id, rs.sequence,
+       COALESCE(u.planned_arrival, t.planned_departure_time + rs.arrival_offset_min * INTERVAL '1 minute') AS planned_arrival,
+       COALESCE(u.planned_departure, t.planned_departure_time + rs.departure_offset_min * INTERVAL '1 minute') AS planned_departure,
+       u.actual_arrival, u.actual_departure, u.delay_minutes
+FROM trips t
+JOIN train_services ts ON t.train_service_id = ts.id
+JOIN route_stations rs ON rs.route_id = ts.route_id
+LEFT JOIN trip_station_updates u ON u.trip_id = t.id AND u.route_station_id = rs.id;
+
 -- =========================
 -- BOOKINGS, SEGMENTS & FARES
 -- =========================
@@ -358,18 +395,29 @@ CREATE TABLE seat_reservations (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
   booking_segment_id UUID REFERENCES booking_segments(id) UNIQUE,
   trip_id UUID REFERENCES trips(id),
-  wagon_seat_id UUID REFERENCES wagon_seats(id),
+  wagon_id UUID REFERENCES wagons(id),
+  -- Posto nel template del vagone (seat_map_seats), verificato da trigger
+  seat_row SMALLINT,
+  seat_column SMALLINT,
   passenger_id UUID REFERENCES passengers(id),
   origin_route_station_id UUID REFERENCES route_stations(id),
   destination_route_station_id UUID REFERENCES route_stations(id),
   expires_at TIMESTAMPTZ NOT NULL,
+  released_at TIMESTAMPTZ,
+  -- Leg occupati [origin.sequence, destination.sequence), valorizzato da trigger
+  leg_range INT4RANGE,
   created_at TIMESTAMPTZ NOT NULL,
-  updated_at TIMESTAMPTZ NOT NULL
+  updated_at TIMESTAMPTZ NOT NULL,
+  -- Lo stesso posto non può essere occupato due volte su leg sovrapposti dello stesso viaggio
+  CONSTRAINT seat_reservations_no_overlap EXCLUDE USING gist (
+    trip_id WITH =, wagon_id WITH =, seat_row WITH =, seat_column WITH =, leg_range WITH &&
+  ) WHERE (released_at IS NULL)
 );
-CREATE INDEX idx_seat_reservations_trip_wagon_seat ON seat_reservations(trip_id, wagon_seat_id);
+CREATE INDEX idx_seat_reservations_trip_wagon_seat ON seat_reservations(trip_id, wagon_id, seat_row, seat_column);
 CREATE INDEX idx_seat_reservations_passenger ON seat_reservations(passenger_id);
 CREATE INDEX idx_seat_reservations_expires_at ON seat_reservations(expires_at);
 CREATE INDEX idx_seat_reservations_trip_expires ON seat_reservations(trip_id, expires_at);
+CREATE INDEX idx_seat_reservations_unreleased_expires ON seat_reservations(expires_at) WHERE released_at IS NULL;
 
 CREATE TABLE tickets (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -397,6 +445,8 @@ CREATE INDEX idx_tickets_service_date ON tickets(service_date);
 CREATE INDEX idx_tickets_service_date_trip ON tickets(service_date, trip_id);
 CREATE INDEX idx_tickets_passenger_date ON tickets(passenger_id, service_date);
 CREATE INDEX idx_tickets_status_date ON tickets(status, service_date);
+-- Letture incrementali dei rollup oltre il watermark (anche payments e trip_leg_availability)
+CREATE INDEX idx_tickets_updated_at ON tickets(updated_at);
 
 CREATE TABLE payments (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -411,3 +461,547 @@ CREATE TABLE payments (
   updated_at TIMESTAMPTZ NOT NULL
 );
 CREATE INDEX idx_payments_booking_id ON payments(booking_id);
+CREATE INDEX idx_payments_updated_at ON payments(updated_at);
+
+-- =========================
+-- SEARCH CACHE INVALIDATION
+-- =========================
+
+-- Notifica sul canale trip_search_invalidation ogni modifica che può cambiare
+-- i risultati di ricerca (find_direct_trips.sql, find_trip_paths.sql).
+-- Il payload usa now() così PostgreSQL deduplica le notifiche uguali della stessa transazione.
+CREATE OR REPLACE FUNCTION notify_trip_search_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM pg_notify('trip_search_invalidation', json_build_object(
+      'trip_id', OLD.id, 'route_id', ts.route_id,
+      'service_date', OLD.service_date, 'changed_at', now())::text)
+    FROM train_services ts WHERE ts.id = OLD.train_service_id;
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    PERFORM pg_notify('trip_search_invalidation', json_build_object(
+      'trip_id', NEW.id, 'route_id', ts.route_id,
+      'service_date', NEW.service_date, 'changed_at', now())::text)
+    FROM train_services ts WHERE ts.id = NEW.train_service_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_stop_update_search_change() RETURNS trigger AS $$
+DECLARE
+  changed_trip_id UUID;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    changed_trip_id := OLD.trip_id;
+  ELSE
+    changed_trip_id := NEW.trip_id;
+  END IF;
+  PERFORM pg_notify('trip_search_invalidation', json_build_object(
+    'trip_id', t.id, 'route_id', ts.route_id,
+    'service_date', t.service_date, 'changed_at', now())::text)
+  FROM trips t JOIN train_services ts ON t.train_service_id = ts.id
+  WHERE t.id = changed_trip_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_trips_search_insert_delete
+AFTER INSERT OR DELETE ON trips
+FOR EACH ROW EXECUTE FUNCTION notify_trip_search_change();
+
+CREATE TRIGGER trg_trips_search_update
+AFTER UPDATE ON trips
+FOR EACH ROW WHEN (
+  OLD.status IS DISTINCT FROM NEW.status
+  OR OLD.service_date IS DISTINCT FROM NEW.service_date
+  OR OLD.train_service_id IS DISTINCT FROM NEW.train_service_id
+  OR OLD.planned_departure_time IS DISTINCT FROM NEW.planned_departure_time
+) EXECUTE FUNCTION notify_trip_search_change();
+
+-- Le righe con soli orari effettivi/ritardi non cambiano i risultati di ricerca:
+-- notificano solo inserimenti e cancellazioni di variazioni d'orario
+CREATE TRIGGER trg_trip_station_updates_search_insert
+AFTER INSERT ON trip_station_updates
+FOR EACH ROW WHEN (NEW.planned_arrival IS NOT NULL OR NEW.planned_departure IS NOT NULL)
+EXECUTE FUNCTION notify_stop_update_search_change();
+
+CREATE TRIGGER trg_trip_station_updates_search_delete
+AFTER DELETE ON trip_station_updates
+FOR EACH ROW WHEN (OLD.planned_arrival IS NOT NULL OR OLD.planned_departure IS NOT NULL)
+EXECUTE FUNCTION notify_stop_update_search_change();
+
+-- I soli orari effettivi/ritardi non cambiano i risultati di ricerca (usano gli orari pianificati)
+CREATE TRIGGER trg_trip_station_updates_search_update
+AFTER UPDATE ON trip_station_updates
+FOR EACH ROW WHEN (
+  OLD.planned_arrival IS DISTINCT FROM NEW.planned_arrival
+  OR OLD.planned_departure IS DISTINCT FROM NEW.planned_departure
+  OR OLD.route_station_id IS DISTINCT FROM NEW.route_station_id
+) EXECUTE FUNCTION notify_stop_update_search_change();
+
+-- Gli offset della rotta spostano gli orari pianificati di tutti i viaggi non ancora conclusi
+CREATE OR REPLACE FUNCTION notify_route_timetable_search_change() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('trip_search_invalidation', json_build_object(
+    'trip_id', NULL, 'route_id', NEW.route_id,
+    'service_date', d.service_date, 'changed_at', now())::text)
+  FROM (
+    SELECT DISTINCT t.service_date
+    FROM trips t JOIN train_services ts ON t.train_service_id = ts.id
+    WHERE ts.route_id = NEW.route_id AND t.service_date >= CURRENT_DATE
+  ) d;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_route_stations_search_update
+AFTER UPDATE ON route_stations
+FOR EACH ROW WHEN (
+  OLD.arrival_offset_min IS DISTINCT FROM NEW.arrival_offset_min
+  OR OLD.departure_offset_min IS DISTINCT FROM NEW.departure_offset_min
+) EXECUTE FUNCTION notify_route_timetable_search_change();
+
+-- =========================
+-- SEAT AVAILABILITY COUNTERS
+-- =========================
+
+-- Posti liberi per viaggio, tratta elementare (leg) e categoria vagone.
+-- Il leg N va dalla fermata con sequence N alla successiva: una prenotazione da A a B
+-- occupa i leg con A.sequence <= N < B.sequence, e la disponibilità di un segmento
+-- è il minimo sui suoi leg. Le righe nascono con il viaggio e sono aggiornate nella
+-- stessa transazione delle prenotazioni posto (database/seeds/seat_availability.py
+-- riconcilia i contatori con i dati reali).
+CREATE TABLE trip_leg_availability (
+  trip_id UUID REFERENCES trips(id),
+  leg_sequence INTEGER NOT NULL,
+  wagon_category_id UUID REFERENCES wagon_categories(id),
+  total_seats INTEGER NOT NULL,
+  available_seats INTEGER NOT NULL CHECK (available_seats >= 0),
+  updated_at TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (trip_id, leg_sequence, wagon_category_id)
+);
+CREATE INDEX idx_trip_leg_availability_updated_at ON trip_leg_availability(updated_at);
+
+CREATE OR REPLACE FUNCTION init_trip_leg_availability() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO trip_leg_availability (trip_id, leg_sequence, wagon_category_id, total_seats, available_seats, updated_at)
+  SELECT NEW.id, rs.sequence, seats.category_id, seats.total, seats.total, now()
+  FROM train_services ts
+  JOIN route_stations rs ON rs.route_id = ts.route_id
+  CROSS JOIN LATERAL (
+    SELECT w.category_id, SUM(smt.seat_count)::INTEGER AS total
+    FROM train_wagons tw
+    JOIN wagons w ON tw.wagon_id = w.id
+    JOIN seat_map_templates smt ON w.seat_map_template_id = smt.id
+    WHERE tw.train_id = ts.train_id AND w.category_id IS NOT NULL
+    GROUP BY w.category_id
+  ) seats
+  WHERE ts.id = NEW.train_service_id
+    AND rs.sequence < (SELECT MAX(last_rs.sequence) FROM route_stations last_rs WHERE last_rs.route_id = ts.route_id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_trips_init_availability
+AFTER INSERT ON trips
+FOR EACH ROW EXECUTE FUNCTION init_trip_leg_availability();
+
+-- Aggiunge delta ai leg della tratta origin -> destination nella categoria del vagone
+CREATE OR REPLACE FUNCTION adjust_trip_leg_availability(
+  p_trip_id UUID, p_wagon_id UUID, p_origin_rs UUID, p_destination_rs UUID, p_delta INTEGER
+) RETURNS void AS $$
+  UPDATE trip_leg_availability a
+  SET available_seats = a.available_seats + p_delta, updated_at = now()
+  FROM wagons w, route_stations o, route_stations d
+  WHERE w.id = p_wagon_id AND o.id = p_origin_rs AND d.id = p_destination_rs
+    AND a.trip_id = p_trip_id
+    AND a.wagon_category_id = w.category_id
+    AND a.leg_sequence >= o.sequence AND a.leg_sequence < d.sequence;
+$$ LANGUAGE sql;
+
+-- Una prenotazione occupa il posto finché released_at è NULL; le prenotazioni già scadute
+-- all'inserimento nascono rilasciate, le altre vengono rilasciate dallo sweep di scadenza
+CREATE OR REPLACE FUNCTION mark_expired_seat_reservation() RETURNS trigger AS $$
+BEGIN
+  IF NEW.released_at IS NULL AND NEW.expires_at <= now() THEN
+    NEW.released_at := now();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_seat_reservation_availability() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' AND OLD.released_at IS NULL AND OLD.wagon_id IS NOT NULL THEN
+    PERFORM adjust_trip_leg_availability(OLD.trip_id, OLD.wagon_id,
+      OLD.origin_route_station_id, OLD.destination_route_station_id, 1);
+  END IF;
+  IF TG_OP <> 'DELETE' AND NEW.released_at IS NULL AND NEW.wagon_id IS NOT NULL THEN
+    PERFORM adjust_trip_leg_availability(NEW.trip_id, NEW.wagon_id,
+      NEW.origin_route_station_id, NEW.destination_route_station_id, -1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_seat_reservations_mark_expired
+BEFORE INSERT ON seat_reservations
+FOR EACH ROW EXECUTE FUNCTION mark_expired_seat_reservation();
+
+CREATE TRIGGER trg_seat_reservations_availability_insert_delete
+AFTER INSERT OR DELETE ON seat_reservations
+FOR EACH ROW EXECUTE FUNCTION track_seat_reservation_availability();
+
+CREATE TRIGGER trg_seat_reservations_availability_update
+AFTER UPDATE ON seat_reservations
+FOR EACH ROW WHEN (
+  OLD.released_at IS DISTINCT FROM NEW.released_at
+  OR OLD.trip_id IS DISTINCT FROM NEW.trip_id
+  OR OLD.wagon_id IS DISTINCT FROM NEW.wagon_id
+  OR OLD.origin_route_station_id IS DISTINCT FROM NEW.origin_route_station_id
+  OR OLD.destination_route_station_id IS DISTINCT FROM NEW.destination_route_station_id
+) EXECUTE FUNCTION track_seat_reservation_availability();
+
+-- =========================
+-- SEAT ALLOCATION
+-- =========================
+
+-- I leg di una prenotazione come intervallo di sequence: la sovrapposizione tra tratte diventa
+-- l'operatore && e il vincolo seat_reservations_no_overlap la esclude anche tra venditori concorrenti
+CREATE OR REPLACE FUNCTION set_seat_reservation_leg_range() RETURNS trigger AS $$
+BEGIN
+  SELECT int4range(o.sequence, d.sequence) INTO NEW.leg_range
+  FROM route_stations o, route_stations d
+  WHERE o.id = NEW.origin_route_station_id AND d.id = NEW.destination_route_station_id;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_seat_reservations_leg_range
+BEFORE INSERT OR UPDATE OF origin_route_station_id, destination_route_station_id ON seat_reservations
+FOR EACH ROW EXECUTE FUNCTION set_seat_reservation_leg_range();
+
+-- Sostituisce la FK verso i posti: (seat_row, seat_column) deve esistere nel template del vagone
+CREATE OR REPLACE FUNCTION check_seat_reservation_seat() RETURNS trigger AS $$
+BEGIN
+  IF NEW.wagon_id IS NOT NULL AND NOT EXISTS (
+    SELECT 1 FROM wagons w
+    JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
+    WHERE w.id = NEW.wagon_id AND s.seat_row = NEW.seat_row AND s.seat_column = NEW.seat_column
+  ) THEN
+    RAISE EXCEPTION 'seat (%, %) does not exist in wagon %', NEW.seat_row, NEW.seat_column, NEW.wagon_id
+      USING ERRCODE = 'foreign_key_violation';
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_seat_reservations_check_seat
+BEFORE INSERT OR UPDATE OF wagon_id, seat_row, seat_column ON seat_reservations
+FOR EACH ROW EXECUTE FUNCTION check_seat_reservation_seat();
+
+-- Sceglie e occupa un posto libero in un solo round trip (database/seeds/seat_booking.py).
+-- La scansione dei posti liberi parte da una posizione casuale e prosegue in ordine circolare,
+-- così venditori concorrenti non si contendono gli stessi primi posti del treno.
+-- I posti che un altro venditore sta prenotando hanno un advisory lock e vengono saltati
+-- (semantica SKIP LOCKED: i posti del template sono condivisi tra vagoni e non si possono
+-- bloccare come righe); se un venditore concorrente conferma lo stesso posto dopo lo snapshot
+-- della ricerca, il vincolo di esclusione rifiuta l'inserimento e si riprova con il posto successivo.
+-- Restituisce NULL se non ci sono posti liberi sulla tratta.
+CREATE OR REPLACE FUNCTION allocate_seat(
+  p_trip_id UUID,
+  p_origin_rs UUID,
+  p_destination_rs UUID,
+  p_expires_at TIMESTAMPTZ,
+  p_wagon_category_id UUID DEFAULT NULL,
+  p_passenger_id UUID DEFAULT NULL,
+  p_booking_segment_id UUID DEFAULT NULL,
+  p_max_attempts INTEGER DEFAULT 3
+) RETURNS seat_reservations AS $$
+DECLARE
+  v_legs INT4RANGE;
+  v_seat RECORD;
+  v_found BOOLEAN;
+  v_offset BIGINT;
+  v_reservation seat_reservations;
+BEGIN
+  SELECT int4range(o.sequence, d.sequence) INTO v_legs
+  FROM route_stations o, route_stations d
+  WHERE o.id = p_origin_rs AND d.id = p_destination_rs;
+  IF v_legs IS NULL OR isempty(v_legs) THEN
+    RAISE EXCEPTION 'invalid segment % -> %', p_origin_rs, p_destination_rs;
+  END IF;
+
+  FOR attempt IN 1..p_max_attempts LOOP
+    v_found := FALSE;
+    v_offset := floor(random() * 2147483647)::BIGINT;
+    -- Il cursore legge i posti liberi in ordine a partire dalla posizione casuale:
+    -- il lock si prova solo fino al primo ottenuto
+    FOR v_seat IN
+      SELECT tw.wagon_id, s.seat_row, s.seat_column,
+             (ROW_NUMBER() OVER (ORDER BY tw.position, s.seat_row, s.seat_column) + v_offset)
+               % COUNT(*) OVER () AS slot
+      FROM trips t
+      JOIN train_services ts ON t.train_service_id = ts.id
+      JOIN train_wagons tw ON tw.train_id = ts.train_id
+      JOIN wagons w ON tw.wagon_id = w.id
+      JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
+      WHERE t.id = p_trip_id
+        AND (p_wagon_category_id IS NULL OR w.category_id = p_wagon_category_id)
+        AND NOT EXISTS (
+          SELECT 1 FROM seat_reservations sr
+          WHERE sr.trip_id = p_trip_id AND sr.wagon_id = tw.wagon_id
+            AND sr.seat_row = s.seat_row AND sr.seat_column = s.seat_column
+            AND sr.released_at IS NULL AND sr.expires_at > now()
+            AND sr.leg_range && v_legs
+        )
+      ORDER BY slot
+    LOOP
+      IF pg_try_advisory_xact_lock(hashtextextended(
+           p_trip_id::text || v_seat.wagon_id::text || v_seat.seat_row || '/' || v_seat.seat_column, 0)) THEN
+        v_found := TRUE;
+        EXIT;
+      END IF;
+    END LOOP;
+
+    IF NOT v_found THEN
+      RETURN NULL;
+    END IF;
+
+    -- Le prenotazioni scadute non ancora rilasciate dallo sweep liberano il posto adesso
+    UPDATE seat_reservations sr SET released_at = now(), updated_at = now()
+    WHERE sr.trip_id = p_trip_id AND sr.wagon_id = v_seat.wagon_id
+      AND sr.seat_row = v_seat.seat_row AND sr.seat_column = v_seat.seat_column
+      AND sr.released_at IS NULL AND sr.expires_at <= now() AND sr.leg_range && v_legs;
+
+    BEGIN
+      INSERT INTO seat_reservations (booking_segment_id, trip_id, wagon_id, seat_row, seat_column,
+                                     passenger_id, origin_route_station_id, destination_route_station_id,
+                                     expires_at, created_at, updated_at)
+      VALUES (p_booking_segment_id, p_trip_id, v_seat.wagon_id, v_seat.seat_row, v_seat.seat_column,
+              p_passenger_id, p_origin_rs, p_destination_rs, p_expires_at, now(), now())
+      RETURNING * INTO v_reservation;
+      RETURN v_reservation;
+    EXCEPTION WHEN exclusion_violation THEN
+      NULL;
+    END;
+  END LOOP;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =========================
+-- ARCHIVE (HOT/COLD)
+-- =========================
+
+-- Viaggi conclusi e prenotazioni oltre l'orizzonte di retention vengono spostati
+-- nello schema archive (database/seeds/archival.py), lasciando snelle le tabelle
+-- interrogate da ricerca e validazione. Le tabelle archivio hanno le stesse colonne
+-- delle originali; i vincoli FK della catena prenotazione sono DEFERRABLE perché
+-- ogni batch sposta le righe figlie prima delle madri nella stessa transazione.
+CREATE SCHEMA archive;
+
+CREATE TABLE archive.trips (LIKE trips INCLUDING DEFAULTS INCLUDING CONSTRAINTS, PRIMARY KEY (id));
+CREATE INDEX idx_archive_trips_service_date ON archive.trips(service_date);
+
+CREATE TABLE archive.trip_station_updates (
+  LIKE trip_station_updates INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+  PRIMARY KEY (id),
+  FOREIGN KEY (trip_id) REFERENCES archive.trips(id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX idx_archive_trip_station_updates_trip ON archive.trip_station_updates(trip_id);
+
+CREATE TABLE archive.bookings (LIKE bookings INCLUDING DEFAULTS INCLUDING CONSTRAINTS, PRIMARY KEY (id));
+CREATE INDEX idx_archive_bookings_user_created ON archive.bookings(user_id, created_at);
+
+-- trip_id può riferire un viaggio ancora attivo (condiviso con prenotazioni non archiviate): nessun FK
+CREATE TABLE archive.booking_segments (
+  LIKE booking_segments INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+  PRIMARY KEY (id),
+  FOREIGN KEY (booking_id) REFERENCES archive.bookings(id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX idx_archive_booking_segments_booking_id ON archive.booking_segments(booking_id);
+CREATE INDEX idx_archive_booking_segments_trip_id ON archive.booking_segments(trip_id);
+
+CREATE TABLE archive.seat_reservations (
+  LIKE seat_reservations INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+  PRIMARY KEY (id),
+  FOREIGN KEY (booking_segment_id) REFERENCES archive.booking_segments(id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX idx_archive_seat_reservations_segment ON archive.seat_reservations(booking_segment_id);
+
+CREATE TABLE archive.tickets (
+  LIKE tickets INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+  PRIMARY KEY (id),
+  FOREIGN KEY (booking_id) REFERENCES archive.bookings(id) DEFERRABLE INITIALLY DEFERRED,
+  FOREIGN KEY (booking_segment_id) REFERENCES archive.booking_segments(id) DEFERRABLE INITIALLY DEFERRED,
+  FOREIGN KEY (seat_reservation_id) REFERENCES archive.seat_reservations(id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX idx_archive_tickets_booking_id ON archive.tickets(booking_id);
+
+CREATE TABLE archive.payments (
+  LIKE payments INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+  PRIMARY KEY (id),
+  FOREIGN KEY (booking_id) REFERENCES archive.bookings(id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX idx_archive_payments_booking_id ON archive.payments(booking_id);
+
+-- Esecuzioni dell'archiviazione: righe spostate, spazio e tempi delle query prima/dopo
+CREATE TABLE archive.archive_runs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  retention_days INTEGER NOT NULL,
+  horizon DATE NOT NULL,
+  batches INTEGER NOT NULL,
+  report JSONB NOT NULL,
+  started_at TIMESTAMPTZ NOT NULL,
+  finished_at TIMESTAMPTZ NOT NULL
+);
+
+-- Viste che uniscono dati attivi e archiviati (usate da booking_history.sql)
+CREATE VIEW all_trips AS
+  SELECT * FROM trips UNION ALL SELECT * FROM archive.trips;
+CREATE VIEW all_bookings AS
+  SELECT * FROM bookings UNION ALL SELECT * FROM archive.bookings;
+CREATE VIEW all_booking_segments AS
+  SELECT * FROM booking_segments UNION ALL SELECT * FROM archive.booking_segments;
+CREATE VIEW all_tickets AS
+  SELECT * FROM tickets UNION ALL SELECT * FROM archive.tickets;
+CREATE VIEW all_payments AS
+  SELECT * FROM payments UNION ALL SELECT * FROM archive.payments;
+CREATE VIEW all_trip_station_updates AS
+  SELECT * FROM trip_station_updates UNION ALL SELECT * FROM archive.trip_station_updates;
+
+-- =========================
+-- ANALYTICS ROLLUPS
+-- =========================
+
+-- Aggregati giornalieri per le dashboard, mantenuti in modo incrementale da
+-- database/seeds/rollups.py: a ogni refresh vengono ricalcolati solo i gruppi toccati
+-- da righe con updated_at oltre il watermark. Nessuna FK: i rollup sopravvivono
+-- all'archiviazione e alla cancellazione dei dati sorgente.
+CREATE TABLE rollup_watermarks (
+  rollup_name TEXT PRIMARY KEY,
+  high_water TIMESTAMPTZ NOT NULL,
+  groups_refreshed INTEGER NOT NULL,
+  refreshed_at TIMESTAMPTZ NOT NULL
+);
+
+-- Ricavi per rotta e giorno di servizio (importi dei segmenti delle prenotazioni pagate)
+CREATE TABLE rollup_route_revenue_daily (
+  route_id UUID NOT NULL,
+  service_date DATE NOT NULL,
+  currency currency_code NOT NULL,
+  paid_segments INTEGER NOT NULL,
+  revenue NUMERIC NOT NULL,
+  refunded_amount NUMERIC NOT NULL,
+  tickets_issued INTEGER NOT NULL,
+  tickets_canceled INTEGER NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (route_id, service_date, currency)
+);
+CREATE INDEX idx_rollup_route_revenue_daily_date ON rollup_route_revenue_daily(service_date);
+
+-- Riempimento per viaggio e categoria: posti-leg occupati su posti-leg offerti
+CREATE TABLE rollup_trip_load_factor (
+  trip_id UUID NOT NULL,
+  wagon_category_id UUID NOT NULL,
+  service_date DATE NOT NULL,
+  route_id UUID NOT NULL,
+  operator_id UUID,
+  seat_legs_total INTEGER NOT NULL,
+  seat_legs_reserved INTEGER NOT NULL,
+  tickets_valid INTEGER NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (trip_id, wagon_category_id)
+);
+CREATE INDEX idx_rollup_trip_load_factor_date_route ON rollup_trip_load_factor(service_date, route_id);
+
+-- Puntualità per operatore e giorno di servizio (fermate con orari effettivi)
+CREATE TABLE rollup_operator_punctuality_daily (
+  operator_id UUID NOT NULL,
+  service_date DATE NOT NULL,
+  trips_observed INTEGER NOT NULL,
+  stops_observed INTEGER NOT NULL,
+  stops_on_time INTEGER NOT NULL,
+  total_delay_minutes BIGINT NOT NULL,
+  max_delay_minutes INTEGER NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (operator_id, service_date)
+);
+CREATE INDEX idx_rollup_operator_punctuality_daily_date ON rollup_operator_punctuality_daily(service_date);
+
+-- =========================
+-- OUTBOX
+-- =========================
+
+-- Cambi di stato di prenotazioni, biglietti e pagamenti per i sistemi a valle (notifiche,
+-- contabilità, validatori), scritti da trigger nella stessa transazione della modifica.
+-- Tabella append-only: database/seeds/outbox.py la consegna in ordine (txid, id) e
+-- cancella solo le righe già consegnate a tutti i relay.
+CREATE TABLE outbox_events (
+  id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  txid XID8 DEFAULT pg_current_xact_id() NOT NULL,
+  aggregate_type TEXT NOT NULL,
+  aggregate_id UUID NOT NULL,
+  event_type TEXT NOT NULL,
+  payload JSONB NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT clock_timestamp() NOT NULL
+);
+CREATE INDEX idx_outbox_events_txid_id ON outbox_events(txid, id);
+
+-- Posizione consegnata da ogni relay: avanza solo dopo la conferma del sink (almeno una volta)
+CREATE TABLE outbox_checkpoints (
+  relay_name TEXT PRIMARY KEY,
+  last_txid XID8 NOT NULL,
+  last_id BIGINT NOT NULL,
+  delivered BIGINT NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL
+);
+
+-- TG_ARGV[0]: tipo di aggregato (booking, ticket, payment). Le cancellazioni non generano
+-- eventi: le fa solo l'archiviazione, che non è un cambio di stato.
+-- Le sessioni con raylix.outbox_disabled = on (le connessioni del generatore di seed) non
+-- scrivono eventi: i dati sintetici non sono modifiche da consegnare ai sistemi a valle
+CREATE OR REPLACE FUNCTION enqueue_outbox_event() RETURNS trigger AS $$
+BEGIN
+  IF current_setting('raylix.outbox_disabled', true) = 'on' THEN
+    RETURN NULL;
+  END IF;
+  INSERT INTO outbox_events (aggregate_type, aggregate_id, event_type, payload)
+  VALUES (
+    TG_ARGV[0], NEW.id,
+    TG_ARGV[0] || CASE WHEN TG_OP = 'INSERT' THEN '.created' ELSE '.status_changed' END,
+    to_jsonb(NEW) || jsonb_build_object(
+      'previous_status', CASE WHEN TG_OP = 'UPDATE' THEN OLD.status::text END)
+  );
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bookings_outbox_insert
+AFTER INSERT ON bookings
+FOR EACH ROW EXECUTE FUNCTION enqueue_outbox_event('booking');
+
+CREATE TRIGGER trg_bookings_outbox_status
+AFTER UPDATE ON bookings
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION enqueue_outbox_event('booking');
+
+CREATE TRIGGER trg_tickets_outbox_insert
+AFTER INSERT ON tickets
+FOR EACH ROW EXECUTE FUNCTION enqueue_outbox_event('ticket');
+
+CREATE TRIGGER trg_tickets_outbox_status
+AFTER UPDATE ON tickets
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION enqueue_outbox_event('ticket');
+
+CREATE TRIGGER trg_payments_outbox_insert
+AFTER INSERT ON payments
+FOR EACH ROW EXECUTE FUNCTION enqueue_outbox_event('payment');
+
+CREATE TRIGGER trg_payments_outbox_status
+AFTER UPDATE ON payments
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION enqueue_outbox_event('payment');
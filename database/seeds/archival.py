@@ -0,0 +1,297 @@
+import argparse
+import json
+import re
+import statistics
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from psycopg2 import sql
+
+from generate_seed_data import DatabaseManager, load_db_config
+from search_cache import run_search
+
+ARCHIVE_SCHEMA = 'archive'
+# Tabelle con una copia nello schema archive
+HOT_TABLES = ('trips', 'trip_station_updates', 'bookings', 'booking_segments',
+              'seat_reservations', 'tickets', 'payments')
+
+# database/queries nel repository, /app/queries nel container del generatore
+QUERY_DIRS = (Path(__file__).resolve().parent.parent / 'queries', Path(__file__).resolve().parent / 'queries')
+UUID_LITERAL = re.compile(r"'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'")
+
+
+def load_booking_history_query():
+    """booking_history.sql con lo user_id di esempio sostituito da un parametro"""
+    path = next(d / 'booking_history.sql' for d in QUERY_DIRS if (d / 'booking_history.sql').exists())
+    return UUID_LITERAL.sub('%(user_id)s', path.read_text(encoding='utf-8'), count=1)
+
+
+class Archiver:
+    """Sposta nello schema archive viaggi conclusi e prenotazioni oltre l'orizzonte di retention,
+    a batch brevi e indipendenti per poter girare con il sistema in linea"""
+
+    def __init__(self, db_config, retention_days=30, batch_size=500, max_batches=None, pause=0.0):
+        self.db_manager = DatabaseManager(db_config)
+        self.retention_days = retention_days
+        self.horizon = date.today() - timedelta(days=retention_days)
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause
+        self.moved = {}
+        self.batches = 0
+
+    def __enter__(self):
+        self.db_manager.connect()
+        self.cursor = self.db_manager.get_cursor()
+        self.columns = {table: self._sync_columns(table) for table in HOT_TABLES}
+        return self
+
+    def __exit__(self, *exc):
+        self.db_manager.close()
+
+    def _sync_columns(self, table):
+        """Colonne della tabella attiva; quelle mancanti nell'archivio vengono aggiunte"""
+        self.cursor.execute("""
+            SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum
+        """, (f"public.{table}",))
+        columns = self.cursor.fetchall()
+        self.cursor.execute("""
+            SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s
+        """, (ARCHIVE_SCHEMA, table))
+        archived = {row[0] for row in self.cursor.fetchall()}
+        for name, column_type in columns:
+            if name in archived:
+                continue
+            self.cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN {} {}").format(
+                sql.Identifier(ARCHIVE_SCHEMA, table), sql.Identifier(name), sql.SQL(column_type)
+            ))
+        return [name for name, _ in columns]
+
+    def _move(self, table, condition, params):
+        """Sposta nell'archivio le righe della tabella che soddisfano la condizione, in un solo statement"""
+        columns = sql.SQL(', ').join(map(sql.Identifier, self.columns[table]))
+        self.cursor.execute(sql.SQL("""
+            WITH moved AS (
+                DELETE FROM {hot} WHERE {condition} RETURNING {columns}
+            )
+            INSERT INTO {cold} ({columns}) SELECT {columns} FROM moved
+        """).format(
+            hot=sql.Identifier('public', table), cold=sql.Identifier(ARCHIVE_SCHEMA, table),
+            condition=sql.SQL(condition), columns=columns
+        ), params)
+        self.moved[table] = self.moved.get(table, 0) + self.cursor.rowcount
+
+    def _run_batches(self, select_ids, move_batch):
+        """Batch in transazioni separate finché ci sono righe idonee o si raggiunge max_batches"""
+        while self.max_batches is None or self.batches < self.max_batches:
+            self.cursor.execute("BEGIN")
+            try:
+                # SKIP LOCKED: le righe in modifica da altre transazioni restano al prossimo giro
+                self.cursor.execute(select_ids, {'horizon': self.horizon, 'limit': self.batch_size})
+                ids = [row[0] for row in self.cursor.fetchall()]
+                if ids:
+                    move_batch(ids)
+                self.cursor.execute("COMMIT")
+            except Exception:
+                self.cursor.execute("ROLLBACK")
+                raise
+            if not ids:
+                return
+            self.batches += 1
+            if self.pause:
+                time.sleep(self.pause)
+
+    def archive_bookings(self):
+        """Prenotazioni i cui segmenti sono tutti su viaggi conclusi o cancellati prima dell'orizzonte"""
+        def move_batch(ids):
+            params = {'ids': ids}
+            self._move('tickets', "booking_id = ANY(%(ids)s::uuid[])", params)
+            self._move('payments', "booking_id = ANY(%(ids)s::uuid[])", params)
+            self._move('seat_reservations', """booking_segment_id IN (
+                SELECT id FROM booking_segments WHERE booking_id = ANY(%(ids)s::uuid[]))""", params)
+            self._move('booking_segments', "booking_id = ANY(%(ids)s::uuid[])", params)
+            self._move('bookings', "id = ANY(%(ids)s::uuid[])", params)
+
+        self._run_batches("""
+            SELECT b.id FROM bookings b
+            WHERE b.departure_date < %(horizon)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM booking_segments bs JOIN trips t ON bs.trip_id = t.id
+                  WHERE bs.booking_id = b.id
+                    AND (t.service_date >= %(horizon)s OR t.status NOT IN ('COMPLETED', 'CANCELED'))
+              )
+            ORDER BY b.departure_date
+            LIMIT %(limit)s
+            FOR UPDATE OF b SKIP LOCKED
+        """, move_batch)
+
+    def archive_trips(self):
+        """Viaggi conclusi prima dell'orizzonte non più riferiti da prenotazioni attive"""
+        def move_batch(ids):
+            params = {'ids': ids}
+            # I contatori di disponibilità sono dati derivati: non si archiviano, e vanno via prima
+            # delle prenotazioni posto perché il trigger non li aggiorni inutilmente
+            self.cursor.execute("DELETE FROM trip_leg_availability WHERE trip_id = ANY(%(ids)s::uuid[])", params)
+            # Restano solo prenotazioni posto senza segmento (blocchi scaduti) sui viaggi idonei
+            self._move('seat_reservations', "trip_id = ANY(%(ids)s::uuid[])", params)
+            self._move('trip_station_updates', "trip_id = ANY(%(ids)s::uuid[])", params)
+            self._move('trips', "id = ANY(%(ids)s::uuid[])", params)
+
+        self._run_batches("""
+            SELECT t.id FROM trips t
+            WHERE t.service_date < %(horizon)s
+              AND t.status IN ('COMPLETED', 'CANCELED')
+              AND NOT EXISTS (SELECT 1 FROM booking_segments bs WHERE bs.trip_id = t.id)
+              AND NOT EXISTS (SELECT 1 FROM tickets tk WHERE tk.trip_id = t.id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM seat_reservations sr
+                  WHERE sr.trip_id = t.id AND sr.booking_segment_id IS NOT NULL
+              )
+            ORDER BY t.service_date
+            LIMIT %(limit)s
+            FOR UPDATE OF t SKIP LOCKED
+        """, move_batch)
+
+    def table_stats(self):
+        """Righe e dimensione (dati + indici) delle tabelle attive"""
+        stats = {}
+        for table in HOT_TABLES:
+            self.cursor.execute(sql.SQL("SELECT COUNT(*), pg_total_relation_size(%s) FROM {}").format(
+                sql.Identifier('public', table)
+            ), (f"public.{table}",))
+            rows, size = self.cursor.fetchone()
+            stats[table] = {'rows': rows, 'bytes': size}
+        return stats
+
+    def vacuum(self, full=False):
+        """VACUUM delle tabelle attive: rende riutilizzabile lo spazio (FULL lo restituisce al sistema, bloccando)"""
+        for table in HOT_TABLES:
+            self.cursor.execute(sql.SQL("VACUUM {} ANALYZE {}").format(
+                sql.SQL("FULL") if full else sql.SQL(""), sql.Identifier('public', table)
+            ))
+
+    def run(self):
+        self.archive_bookings()
+        self.archive_trips()
+        return self.moved
+
+
+class QueryProbe:
+    """Latenze mediane delle query calde (ricerca diretta, storico prenotazioni) su campioni fissi"""
+
+    def __init__(self, cursor, samples=50):
+        self.cursor = cursor
+        cursor.execute("""
+            SELECT DISTINCT rs_from.station_id, rs_to.station_id, t.service_date
+            FROM trips t
+            JOIN train_services ts ON t.train_service_id = ts.id
+            JOIN route_stations rs_from ON rs_from.route_id = ts.route_id
+            JOIN route_stations rs_to ON rs_to.route_id = ts.route_id AND rs_from.sequence < rs_to.sequence
+            WHERE t.service_date BETWEEN CURRENT_DATE AND CURRENT_DATE + 6
+            ORDER BY 1, 2, 3
+            LIMIT %s
+        """, (samples,))
+        self.searches = cursor.fetchall()
+        cursor.execute("SELECT id FROM users ORDER BY id LIMIT %s", (samples,))
+        self.users = [row[0] for row in cursor.fetchall()]
+        self.booking_history = load_booking_history_query()
+
+    def measure(self, repeats=3):
+        timings = {'direct_search_ms': [], 'booking_history_ms': []}
+        for _ in range(repeats):
+            for origin, destination, service_date in self.searches:
+                start = time.perf_counter()
+                run_search(self.cursor, origin, destination, service_date)
+                timings['direct_search_ms'].append(time.perf_counter() - start)
+            for user_id in self.users:
+                start = time.perf_counter()
+                self.cursor.execute(self.booking_history, {'user_id': user_id})
+                self.cursor.fetchall()
+                timings['booking_history_ms'].append(time.perf_counter() - start)
+        return {key: round(statistics.median(values) * 1000, 3) if values else None
+                for key, values in timings.items()}
+
+
+def run_archival(db_config, retention_days, batch_size, max_batches=None, pause=0.0,
+                 vacuum=True, vacuum_full=False, probe=True):
+    """Archiviazione completa con report di righe spostate, spazio recuperato e tempi delle query"""
+    started_at = datetime.now().astimezone()
+    with Archiver(db_config, retention_days, batch_size, max_batches, pause) as archiver:
+        print(f"🗄️ Archiving data older than {archiver.horizon} (retention {retention_days} days)...")
+        before = archiver.table_stats()
+        probe_runner = QueryProbe(archiver.cursor) if probe else None
+        queries_before = probe_runner.measure() if probe else {}
+
+        start = time.perf_counter()
+        moved = archiver.run()
+        elapsed = time.perf_counter() - start
+
+        if vacuum or vacuum_full:
+            archiver.vacuum(full=vacuum_full)
+        after = archiver.table_stats()
+        queries_after = probe_runner.measure() if probe else {}
+
+        tables = {}
+        for table in HOT_TABLES:
+            rows_moved = moved.get(table, 0)
+            share = rows_moved / before[table]['rows'] if before[table]['rows'] else 0.0
+            tables[table] = {
+                'rows_before': before[table]['rows'],
+                'rows_moved': rows_moved,
+                'bytes_before': before[table]['bytes'],
+                'bytes_after': after[table]['bytes'],
+                # Senza VACUUM FULL il file non si riduce, ma lo spazio delle righe spostate torna riutilizzabile
+                'reusable_bytes': int(before[table]['bytes'] * share)
+            }
+
+        report = {
+            'horizon': archiver.horizon.isoformat(),
+            'batches': archiver.batches,
+            'elapsed_s': round(elapsed, 3),
+            'tables': tables,
+            'queries_before': queries_before,
+            'queries_after': queries_after
+        }
+        archiver.cursor.execute("""
+            INSERT INTO archive.archive_runs (retention_days, horizon, batches, report, started_at, finished_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (retention_days, archiver.horizon, archiver.batches, json.dumps(report),
+              started_at, datetime.now().astimezone()))
+
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    print(f"✅ {report['batches']} batches in {report['elapsed_s']:.2f}s (horizon {report['horizon']})")
+    print(f"   {'table':<22}{'rows':>10}{'moved':>10}{'MB before':>11}{'MB after':>10}{'MB reusable':>13}")
+    for table, t in report['tables'].items():
+        print(f"   {table:<22}{t['rows_before']:>10}{t['rows_moved']:>10}{t['bytes_before'] / 1024 ** 2:>11.2f}"
+              f"{t['bytes_after'] / 1024 ** 2:>10.2f}{t['reusable_bytes'] / 1024 ** 2:>13.2f}")
+    for query, before in report['queries_before'].items():
+        after = report['queries_after'].get(query)
+        if before and after:
+            print(f"   ⏱️ {query}: {before:.3f} → {after:.3f} ({before / after:.2f}x)")
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix hot/cold archival of completed trips and bookings")
+    parser.add_argument('--retention-days', type=int, default=30, help="keep this many days of history hot")
+    parser.add_argument('--batch-size', type=int, default=500, help="bookings/trips moved per transaction")
+    parser.add_argument('--max-batches', type=int, help="stop after N batches (bounded online run)")
+    parser.add_argument('--pause', type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument('--no-vacuum', action='store_true', help="skip VACUUM ANALYZE of the hot tables")
+    parser.add_argument('--vacuum-full', action='store_true', help="VACUUM FULL (locks the tables) to shrink files")
+    parser.add_argument('--no-probe', action='store_true', help="skip before/after query timings")
+    args = parser.parse_args()
+
+    run_archival(load_db_config(), args.retention_days, args.batch_size, args.max_batches, args.pause,
+                 vacuum=not args.no_vacuum, vacuum_full=args.vacuum_full, probe=not args.no_probe)
+
+
+if __name__ == "__main__":
+    main()
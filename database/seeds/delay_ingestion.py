@@ -0,0 +1,504 @@
+import argparse
+import json
+import random
+import socket
+import time
+from datetime import datetime, timedelta
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from generate_seed_data import DatabaseManager, load_db_config
+
+# Ritardo minimo (minuti) oltre il quale un viaggio in corsa passa a DELAYED
+DELAYED_THRESHOLD_MIN = 5
+
+
+class FileEventSource:
+    """Sorgente eventi da file JSON Lines (un evento per riga)"""
+
+    def __init__(self, path, follow=False, idle_interval=0.2):
+        self.path = path
+        self.follow = follow
+        self.idle_interval = idle_interval
+
+    def __iter__(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            while True:
+                line = f.readline()
+                if line:
+                    if line.strip():
+                        yield parse_event(line)
+                elif self.follow:
+                    # Come `tail -f`: None permette al consumer di svuotare la finestra
+                    time.sleep(self.idle_interval)
+                    yield None
+                else:
+                    return
+
+
+class SocketEventSource:
+    """Sorgente eventi da socket TCP locale (stand-in del feed operativo)"""
+
+    def __init__(self, host, port, idle_interval=0.2):
+        self.host = host
+        self.port = port
+        self.idle_interval = idle_interval
+
+    def __iter__(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(1)
+        server.settimeout(self.idle_interval)
+        print(f"🔌 Listening for delay events on {self.host}:{self.port}")
+
+        try:
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    yield None
+                    continue
+
+                conn.settimeout(self.idle_interval)
+                buffer = b''
+                with conn:
+                    while True:
+                        try:
+                            chunk = conn.recv(65536)
+                        except socket.timeout:
+                            yield None
+                            continue
+                        if not chunk:
+                            break
+                        buffer += chunk
+                        *lines, buffer = buffer.split(b'\n')
+                        for line in lines:
+                            if line.strip():
+                                yield parse_event(line.decode('utf-8'))
+        finally:
+            server.close()
+
+
+class SyntheticEventSource:
+    """Sorgente eventi sintetica per benchmark: treni che avanzano fermata per fermata"""
+
+    def __init__(self, timetables, num_events, seed=42):
+        self.timetables = timetables
+        self.num_events = num_events
+        self.random = random.Random(seed)
+
+    def __iter__(self):
+        # Posizione corrente (indice fermata) e ritardo accumulato per ogni viaggio
+        progress = {trip_id: [0, 0] for trip_id in self.timetables}
+        trip_ids = list(progress)
+
+        for _ in range(self.num_events):
+            trip_id = trip_ids[self.random.randrange(len(trip_ids))]
+            state = progress[trip_id]
+            stops = self.timetables[trip_id]['stops']
+            stop = stops[state[0]]
+
+            state[1] = max(0, state[1] + self.random.choice([-1, 0, 0, 1, 2, 5]))
+            delay = timedelta(minutes=state[1])
+
+            yield {
+                'trip_id': trip_id,
+                'route_station_id': stop['route_station_id'],
+                'actual_arrival': stop['planned_arrival'] + delay if stop['planned_arrival'] else None,
+                'actual_departure': stop['planned_departure'] + delay if stop['planned_departure'] else None,
+                'received_at': time.perf_counter()
+            }
+
+            # A fine corsa il viaggio riparte da capo, così il flusso è sostenibile per qualsiasi N
+            state[0] += 1
+            if state[0] == len(stops):
+                state[0], state[1] = 0, 0
+
+
+def parse_event(line):
+    """Converte una riga JSON in evento normalizzato"""
+    raw = json.loads(line)
+    return {
+        'trip_id': raw['trip_id'],
+        'route_station_id': raw['route_station_id'],
+        'actual_arrival': _parse_timestamp(raw.get('actual_arrival')),
+        'actual_departure': _parse_timestamp(raw.get('actual_departure')),
+        'received_at': time.perf_counter()
+    }
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class DelayEventCoalescer:
+    """Accorpa gli eventi per viaggio/fermata all'interno di una finestra temporale"""
+
+    def __init__(self, window_seconds=2.0, max_events=5000):
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+        self.pending = {}
+        self.received = []
+        self.window_start = None
+
+    def add(self, event):
+        """Aggiunge un evento: per la stessa fermata vince l'ultimo valore non nullo"""
+        key = (event['trip_id'], event['route_station_id'])
+        current = self.pending.get(key)
+        if current is None:
+            self.pending[key] = dict(event)
+        else:
+            for field in ('actual_arrival', 'actual_departure'):
+                if event[field] is not None:
+                    current[field] = event[field]
+
+        self.received.append(event['received_at'])
+        if self.window_start is None:
+            self.window_start = event['received_at']
+
+    def is_due(self):
+        """True se la finestra è scaduta o il buffer è pieno"""
+        if self.window_start is None:
+            return False
+        return (len(self.received) >= self.max_events or
+                time.perf_counter() - self.window_start >= self.window_seconds)
+
+    def drain(self):
+        """Restituisce gli eventi accorpati per viaggio e svuota il buffer"""
+        by_trip = {}
+        for (trip_id, route_station_id), event in self.pending.items():
+            by_trip.setdefault(trip_id, {})[route_station_id] = event
+
+        received = self.received
+        self.pending = {}
+        self.received = []
+        self.window_start = None
+        return by_trip, received
+
+
+class TripTimetableCache:
+    """Cache degli orari pianificati (fermate e offset) per viaggio"""
+
+    def __init__(self, cursor, max_trips=50000):
+        self.cursor = cursor
+        self.max_trips = max_trips
+        self.timetables = {}
+
+    def get_many(self, trip_ids):
+        """Restituisce gli orari dei viaggi richiesti caricando in un'unica query i mancanti"""
+        missing = [trip_id for trip_id in trip_ids if trip_id not in self.timetables]
+        if missing:
+            if len(self.timetables) + len(missing) > self.max_trips:
+                self.timetables.clear()
+            self.timetables.update(load_timetables(self.cursor, missing))
+        return {trip_id: self.timetables[trip_id] for trip_id in trip_ids if trip_id in self.timetables}
+
+
+def load_timetables(cursor, trip_ids=None, service_date=None):
+    """Carica fermate e orari pianificati dei viaggi (per id o per data), con le variazioni d'orario"""
+    query = """
+        SELECT t.id, rs.id, rs.sequence,
+               COALESCE(u.planned_arrival, t.planned_departure_time + rs.arrival_offset_min * INTERVAL '1 minute'),
+               COALESCE(u.planned_departure, t.planned_departure_time + rs.departure_offset_min * INTERVAL '1 minute')
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations rs ON rs.route_id = ts.route_id
+        LEFT JOIN trip_station_updates u ON u.trip_id = t.id AND u.route_station_id = rs.id
+    """
+    if trip_ids is not None:
+        cursor.execute(query + " WHERE t.id = ANY(%s::uuid[]) ORDER BY t.id, rs.sequence", (list(trip_ids),))
+    else:
+        cursor.execute(query + " WHERE t.service_date = %s ORDER BY t.id, rs.sequence", (service_date,))
+
+    timetables = {}
+    for trip_id, rs_id, sequence, planned_arrival, planned_departure in cursor.fetchall():
+        trip_id = str(trip_id)
+        timetable = timetables.setdefault(trip_id, {'stops': [], 'index': {}})
+        timetable['index'][str(rs_id)] = len(timetable['stops'])
+        timetable['stops'].append({
+            'route_station_id': str(rs_id),
+            'sequence': sequence,
+            'planned_arrival': planned_arrival,
+            'planned_departure': planned_departure
+        })
+    return timetables
+
+
+class IngestionMetrics:
+    """Metriche di ingestione: throughput e lag end-to-end"""
+
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.rows_upserted = 0
+        self.trips_updated = 0
+        self.lags = []
+        self.started_at = time.perf_counter()
+
+    def record_batch(self, received, rows, trips, committed_at):
+        self.events += len(received)
+        self.batches += 1
+        self.rows_upserted += rows
+        self.trips_updated += trips
+        self.lags.extend(committed_at - r for r in received)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started_at
+        lags = sorted(self.lags)
+
+        def percentile(p):
+            return lags[min(len(lags) - 1, int(len(lags) * p))] * 1000 if lags else 0.0
+
+        return {
+            'events': self.events,
+            'batches': self.batches,
+            'rows_upserted': self.rows_upserted,
+            'trips_updated': self.trips_updated,
+            'elapsed_s': round(elapsed, 3),
+            'events_per_sec': round(self.events / elapsed, 1) if elapsed > 0 else 0.0,
+            'lag_p50_ms': round(percentile(0.50), 1),
+            'lag_p95_ms': round(percentile(0.95), 1),
+            'lag_max_ms': round(lags[-1] * 1000, 1) if lags else 0.0
+        }
+
+
+class DelayIngestor:
+    """Applica gli eventi di ritardo con upsert set-based e propagazione a valle"""
+
+    def __init__(self, db_manager, window_seconds=2.0, max_events=5000):
+        self.conn = db_manager.conn
+        self.cursor = db_manager.get_cursor()
+        self.coalescer = DelayEventCoalescer(window_seconds, max_events)
+        self.timetables = TripTimetableCache(self.cursor)
+        self.metrics = IngestionMetrics()
+
+    def run(self, source):
+        """Consuma la sorgente fino all'esaurimento, svuotando il buffer a ogni finestra"""
+        try:
+            for event in source:
+                if event is not None:
+                    self.coalescer.add(event)
+                if self.coalescer.is_due():
+                    self.flush()
+        finally:
+            self.flush()
+        return self.metrics.summary()
+
+    def flush(self):
+        """Applica il batch corrente in un'unica transazione"""
+        by_trip, received = self.coalescer.drain()
+        if not by_trip:
+            return
+
+        timetables = self.timetables.get_many(list(by_trip))
+        observed_rows, propagated_rows, trip_rows = [], [], []
+        now = datetime.now()
+
+        self.cursor.execute("BEGIN")
+        try:
+            furthest = self._furthest_observed(list(by_trip))
+            for trip_id, events in by_trip.items():
+                timetable = timetables.get(trip_id)
+                if timetable is None:
+                    continue
+                observed, propagated, trip_row = self._plan_trip(
+                    trip_id, timetable, events, now, furthest.get(trip_id)
+                )
+                observed_rows.extend(observed)
+                propagated_rows.extend(propagated)
+                if trip_row:
+                    trip_rows.append(trip_row)
+
+            self._upsert_observed(observed_rows)
+            self._upsert_propagated(propagated_rows)
+            self._update_trips(trip_rows)
+            self.cursor.execute("COMMIT")
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+
+        self.metrics.record_batch(
+            received, len(observed_rows) + len(propagated_rows), len(trip_rows), time.perf_counter()
+        )
+
+    def _furthest_observed(self, trip_ids):
+        """Ultima fermata con orari effettivi già salvata per ogni viaggio: (route_station_id, ritardo)"""
+        self.cursor.execute("""
+            SELECT DISTINCT ON (u.trip_id) u.trip_id::text, u.route_station_id::text, u.delay_minutes
+            FROM trip_station_updates u
+            JOIN route_stations rs ON rs.id = u.route_station_id
+            WHERE u.trip_id = ANY(%s::uuid[])
+              AND (u.actual_arrival IS NOT NULL OR u.actual_departure IS NOT NULL)
+            ORDER BY u.trip_id, rs.sequence DESC
+        """, (trip_ids,))
+        return {trip_id: (route_station_id, delay) for trip_id, route_station_id, delay in self.cursor.fetchall()}
+
+    def _plan_trip(self, trip_id, timetable, events, now, furthest=None):
+        """Calcola righe osservate, righe propagate a valle e stato del viaggio (None se nessun evento
+        corrisponde a una fermata del viaggio, o se il batch è indietro rispetto all'ultima fermata già
+        osservata: un evento tardivo non annulla i più recenti)"""
+        stops = timetable['stops']
+        observed = []
+        last_index, last_delay = -1, 0
+
+        for route_station_id, event in events.items():
+            index = timetable['index'].get(route_station_id)
+            if index is None:
+                continue
+            stop = stops[index]
+            delay = _stop_delay(stop, event['actual_arrival'], event['actual_departure'])
+            observed.append((
+                trip_id, route_station_id,
+                _as_aware(event['actual_arrival'], stop), _as_aware(event['actual_departure'], stop),
+                delay, now, now
+            ))
+            if index > last_index:
+                last_index, last_delay = index, delay
+
+        if not observed:
+            return observed, [], None
+        stored_index = timetable['index'].get(furthest[0], -1) if furthest else -1
+        if last_index < stored_index:
+            return observed, [], None
+
+        # Le fermate successiva all'ultima osservata ereditano il ritardo previsto
+        propagated = [(trip_id, stop['route_station_id'], last_delay, now, now) for stop in stops[last_index + 1:]]
+
+        last_stop_event = events.get(stops[-1]['route_station_id'])
+        arrived = last_stop_event is not None and last_stop_event['actual_arrival'] is not None
+        return observed, propagated, (trip_id, last_delay, arrived)
+
+    def _upsert_observed(self, rows):
+        if not rows:
+            return
+        execute_values(self.cursor, """
+            INSERT INTO trip_station_updates AS tsu (
+                trip_id, route_station_id, actual_arrival, actual_departure, delay_minutes, updated_at, created_at
+            ) VALUES %s
+            ON CONFLICT (trip_id, route_station_id) DO UPDATE SET
+                actual_arrival = COALESCE(EXCLUDED.actual_arrival, tsu.actual_arrival),
+                actual_departure = COALESCE(EXCLUDED.actual_departure, tsu.actual_departure),
+                delay_minutes = EXCLUDED.delay_minutes,
+                updated_at = EXCLUDED.updated_at
+        """, rows, template="(%s::uuid, %s::uuid, %s, %s, %s, %s, %s)", page_size=1000)
+
+    def _upsert_propagated(self, rows):
+        if not rows:
+            return
+        # Il ritardo propagato non sovrascrive fermate che hanno già orari effettivi.
+        # Le fermate in orario non hanno righe: un ritardo nullo aggiorna solo quelle esistenti
+        delayed = [row for row in rows if row[2] > 0]
+        on_time = [row for row in rows if row[2] == 0]
+        if delayed:
+            execute_values(self.cursor, """
+                INSERT INTO trip_station_updates AS tsu (
+                    trip_id, route_station_id, delay_minutes, updated_at, created_at
+                ) VALUES %s
+                ON CONFLICT (trip_id, route_station_id) DO UPDATE SET
+                    delay_minutes = EXCLUDED.delay_minutes,
+                    updated_at = EXCLUDED.updated_at
+                WHERE tsu.actual_arrival IS NULL AND tsu.actual_departure IS NULL
+            """, delayed, template="(%s::uuid, %s::uuid, %s, %s, %s)", page_size=1000)
+        if on_time:
+            execute_values(self.cursor, """
+                UPDATE trip_station_updates tsu SET delay_minutes = 0, updated_at = v.updated_at
+                FROM (VALUES %s) AS v(trip_id, route_station_id, delay, updated_at, created_at)
+                WHERE tsu.trip_id = v.trip_id AND tsu.route_station_id = v.route_station_id
+                  AND tsu.actual_arrival IS NULL AND tsu.actual_departure IS NULL
+                  AND tsu.delay_minutes IS DISTINCT FROM 0
+            """, on_time, template="(%s::uuid, %s::uuid, %s, %s::timestamp, %s::timestamp)", page_size=1000)
+
+    def _update_trips(self, rows):
+        if not rows:
+            return
+        execute_values(self.cursor, sql.SQL("""
+            UPDATE trips t SET
+                delay_minutes = v.delay,
+                status = (CASE
+                    WHEN t.status = 'CANCELED' THEN t.status
+                    WHEN v.arrived THEN 'COMPLETED'
+                    WHEN t.status = 'COMPLETED' THEN t.status
+                    WHEN v.delay >= {threshold} THEN 'DELAYED'
+                    ELSE 'RUNNING'
+                END)::trip_status,
+                updated_at = NOW()
+            FROM (VALUES %s) AS v(id, delay, arrived)
+            WHERE t.id = v.id
+        """).format(threshold=sql.Literal(DELAYED_THRESHOLD_MIN)),
+            rows, template="(%s::uuid, %s::integer, %s::boolean)", page_size=1000)
+
+
+def _as_aware(value, stop):
+    """Allinea il fuso di un orario effettivo a quello degli orari pianificati"""
+    if value is None or value.tzinfo is not None:
+        return value
+    reference = stop['planned_departure'] or stop['planned_arrival']
+    return value.replace(tzinfo=reference.tzinfo)
+
+
+def _stop_delay(stop, actual_arrival, actual_departure):
+    """Ritardo in minuti (mai negativo), preferendo la partenza all'arrivo"""
+    if actual_departure is not None and stop['planned_departure'] is not None:
+        diff = _as_aware(actual_departure, stop) - stop['planned_departure']
+    elif actual_arrival is not None and stop['planned_arrival'] is not None:
+        diff = _as_aware(actual_arrival, stop) - stop['planned_arrival']
+    else:
+        return 0
+    return max(0, int(diff.total_seconds() // 60))
+
+
+def run_benchmark(db_manager, num_events, window_seconds, max_events):
+    """Benchmark: eventi sintetici sui viaggi odierni"""
+    cursor = db_manager.get_cursor()
+    timetables = load_timetables(cursor, service_date=datetime.now().date())
+    if not timetables:
+        print("⚠️ No trips found for today, run generate_seed_data.py first")
+        return None
+
+    print(f"⏱️ Benchmarking {num_events} events over {len(timetables)} trips...")
+    ingestor = DelayIngestor(db_manager, window_seconds, max_events)
+    ingestor.timetables.timetables.update(timetables)
+    return ingestor.run(SyntheticEventSource(timetables, num_events))
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix real-time delay ingestion")
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--file', help="JSON Lines file with delay events")
+    source_group.add_argument('--socket', help="host:port of the local event socket")
+    source_group.add_argument('--benchmark', type=int, metavar='N', help="ingest N synthetic events")
+    parser.add_argument('--follow', action='store_true', help="keep reading the file as it grows")
+    parser.add_argument('--window', type=float, default=2.0, help="coalescing window in seconds")
+    parser.add_argument('--batch', type=int, default=5000, help="max events per batch")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(load_db_config())
+    db_manager.connect()
+
+    try:
+        if args.benchmark is not None:
+            summary = run_benchmark(db_manager, args.benchmark, args.window, args.batch)
+        else:
+            if args.file:
+                source = FileEventSource(args.file, follow=args.follow)
+            else:
+                host, port = args.socket.rsplit(':', 1)
+                source = SocketEventSource(host, int(port))
+            ingestor = DelayIngestor(db_manager, args.window, args.batch)
+            try:
+                summary = ingestor.run(source)
+            except KeyboardInterrupt:
+                summary = ingestor.metrics.summary()
+    finally:
+        db_manager.close()
+
+    if summary:
+        print("📈 Ingestion summary")
+        for key, value in summary.items():
+            print(f"   {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
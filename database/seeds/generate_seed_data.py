@@ -6,9 +6,15 @@ import sys
 from datetime import datetime, date, time, timedelta
 from decimal import Decimal
 import psycopg2
-from faker import Faker
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 
-fake = Faker('it_IT')
+from instrumentation import InstrumentedCursor, PhaseInstrumentation
+from person_pool import PersonPool
+from phase_scheduler import GenerationPhase, PhaseGraph, PhaseScheduler
+from rollups import RollupRefresher
+from seat_availability import reconcile
+from trip_catalog import BookingBatch, FareTable, TripCatalog, build_booking_batch, unused_run_tag
 
 class DatabaseManager:
     """Gestione connessione e operazioni database"""
@@ -27,9 +33,9 @@ class DatabaseManager:
             print(f"❌ Database connection failed: {e}")
             raise
             
-    def get_cursor(self):
+    def get_cursor(self, cursor_factory=None):
         """Restituisce cursor per query"""
-        return self.conn.cursor()
+        return self.conn.cursor(cursor_factory=cursor_factory)
         
     def close(self):
         """Chiude connessione"""
@@ -67,95 +73,6 @@ class UniqueValueGenerator:
     @staticmethod
     def uuid():
         return str(uuid.uuid4())
-    
-    @staticmethod
-    def booking_reference(cursor):
-        """Genera booking reference unico"""
-        for _ in range(10):
-            timestamp = int(datetime.now().timestamp() * 1000) % 1000000
-            random_part = random.randint(100, 999)
-            ref = f"BK{timestamp}{random_part}"
-            
-            cursor.execute("SELECT COUNT(*) FROM bookings WHERE booking_reference = %s", (ref,))
-            if cursor.fetchone()[0] == 0:
-                return ref
-                
-        return f"BK{random.randint(10000000, 99999999)}"
-    
-    @staticmethod
-    def ticket_number(cursor):
-        """Genera ticket number unico"""
-        for _ in range(10):
-            timestamp = int(datetime.now().timestamp() * 1000) % 1000000
-            random_part = random.randint(100, 999)
-            ticket = f"TK{timestamp}{random_part}"
-            
-            cursor.execute("SELECT COUNT(*) FROM tickets WHERE ticket_number = %s", (ticket,))
-            if cursor.fetchone()[0] == 0:
-                return ticket
-                
-        return f"TK{random.randint(10000000, 99999999)}"
-
-class FareCalculator:
-    """Calcolo tariffe intelligente"""
-    
-    def __init__(self, cursor):
-        self.cursor = cursor
-    
-    def calculate(self, origin_country, dest_country, distance_km, service_type_id, wagon_category_id):
-        """Calcola tariffa con sistema di priorità"""
-        
-        query = """
-            SELECT f.id, f.base_fare, f.fare_per_km, f.international_supplement,
-                   (CASE 
-                       WHEN f.origin_country_id = %s AND f.destination_country_id = %s 
-                            AND f.service_type_id = %s AND f.wagon_category_id = %s THEN 100
-                       WHEN f.origin_country_id = %s AND f.destination_country_id = %s 
-                            AND f.service_type_id = %s THEN 80
-                       WHEN f.origin_country_id = %s AND f.destination_country_id = %s 
-                            AND f.wagon_category_id = %s THEN 75
-                       WHEN f.origin_country_id = %s AND f.destination_country_id = %s THEN 60
-                       WHEN f.service_type_id = %s AND f.origin_country_id IS NULL THEN 40
-                       WHEN f.wagon_category_id = %s AND f.origin_country_id IS NULL THEN 35
-                       WHEN f.origin_country_id IS NULL AND f.destination_country_id IS NULL 
-                            AND f.service_type_id IS NULL AND f.wagon_category_id IS NULL THEN 10
-                       ELSE 0
-                   END) as priority_score
-            FROM fares f
-            WHERE %s BETWEEN f.distance_min_km AND f.distance_max_km
-            AND (
-                (f.origin_country_id = %s AND f.destination_country_id = %s) OR
-                (f.service_type_id = %s AND f.origin_country_id IS NULL) OR
-                (f.wagon_category_id = %s AND f.origin_country_id IS NULL) OR
-                (f.origin_country_id IS NULL AND f.destination_country_id IS NULL 
-                 AND f.service_type_id IS NULL AND f.wagon_category_id IS NULL)
-            )
-            ORDER BY priority_score DESC, f.base_fare ASC
-            LIMIT 1
-        """
-        
-        params = [
-            origin_country, dest_country, service_type_id, wagon_category_id,
-            origin_country, dest_country, service_type_id,
-            origin_country, dest_country, wagon_category_id,
-            origin_country, dest_country,
-            service_type_id, wagon_category_id,
-            distance_km,
-            origin_country, dest_country,
-            service_type_id, wagon_category_id
-        ]
-        
-        self.cursor.execute(query, params)
-        result = self.cursor.fetchone()
-        
-        if result:
-            fare_id, base_fare, fare_per_km, supplement = result[:4]
-            supplement = supplement or 0
-            total = float(base_fare) + (float(fare_per_km) * distance_km) + float(supplement)
-            return [fare_id, Decimal(str(round(total, 2)))]
-        else:
-            # Fallback
-            return [None, Decimal(str(round(15.00 + (0.15 * distance_km), 2)))]
 
 class StaticDataInserter:
     """Inserimento dati statici nel database"""
@@ -246,11 +163,13 @@ class StaticDataInserter:
             self.cursor.execute(query, (cat['id'], cat['name'], datetime.now(), datetime.now()))
 
 class TrainGenerator:
-    """Generazione treni, vagoni e posti"""
+    """Generazione treni, vagoni e mappe posti"""
     
     def __init__(self, cursor, static_data):
         self.cursor = cursor
         self.data = static_data
+        # Template già creati per layout_key: i vagoni con la stessa disposizione li condividono
+        self.templates = {}
     
     def generate_all(self):
         """Genera treni completi con vagoni e posti"""
@@ -276,14 +195,17 @@ class TrainGenerator:
         for position, wagon_config in enumerate(train_config['wagon_configs'], 1):
             wagon_id = UniqueValueGenerator.uuid()
             wagon_code = f"{train_config['id'][:8]}_W{position:02d}"
+            template_id = (
+                self._seat_map_template(wagon_config, train_config['is_ship']) if wagon_config['seats'] > 0 else None
+            )
             
             # Crea vagone
             self.cursor.execute("""
-                INSERT INTO wagons (id, code, category_id, total_seats, total_rows, 
+                INSERT INTO wagons (id, code, category_id, seat_map_template_id, total_seats, total_rows, 
                                   seats_per_row, layout_pattern, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
-                wagon_id, wagon_code, wagon_config['category_id'], wagon_config['seats'], 
+                wagon_id, wagon_code, wagon_config['category_id'], template_id, wagon_config['seats'], 
                 wagon_config['rows'], wagon_config['seats_per_row'], 
                 wagon_config.get('layout_pattern', '2+2'), datetime.now(), datetime.now()
             ))
@@ -293,40 +215,71 @@ class TrainGenerator:
                 INSERT INTO train_wagons (train_id, wagon_id, position, created_at, updated_at)
                 VALUES (%s, %s, %s, %s, %s)
             """, (train_config['id'], wagon_id, position, datetime.now(), datetime.now()))
-            
-            # Genera posti
-            if wagon_config['seats'] > 0:
-                self._create_seats_for_wagon(wagon_id, wagon_config, train_config['is_ship'])
-    
-    def _create_seats_for_wagon(self, wagon_id, config, is_ship):
-        """Crea posti per un vagone"""
-        seat_types = ['WINDOW', 'AISLE'] if not is_ship else ['WINDOW', 'AISLE', 'COUCHETTE_LOWER', 'COUCHETTE_UPPER']
-        orientations = ['FORWARD', 'BACKWARD']
-        
-        seat_number = 1
-        for row in range(1, config['rows'] + 1):
-            for col_idx in range(config['seats_per_row']):
-                col_letter = chr(65 + col_idx)
-                
-                self.cursor.execute("""
-                    INSERT INTO wagon_seats (id, wagon_id, seat_number, seat_type, 
-                                           seat_orientation, row_number, column_letter, 
-                                           is_accessible, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    UniqueValueGenerator.uuid(), wagon_id, str(seat_number), 
-                    random.choice(seat_types), random.choice(orientations), 
-                    row, col_letter, seat_number % 20 == 0,
-                    datetime.now(), datetime.now()
+    
+    def _seat_map_template(self, config, is_ship):
+        """Template della mappa posti per la disposizione del vagone, creato alla prima occorrenza"""
+        layout_pattern = config.get('layout_pattern', '2+2')
+        rows, seats_per_row = config['rows'], config['seats_per_row']
+        layout_key = f"{rows}x{seats_per_row}:{layout_pattern}:{'ship' if is_ship else 'train'}"
+        if layout_key in self.templates:
+            return self.templates[layout_key]
+        
+        template_id = UniqueValueGenerator.uuid()
+        self.cursor.execute("""
+            INSERT INTO seat_map_templates (id, layout_key, total_rows, seats_per_row, layout_pattern,
+                                          seat_count, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            template_id, layout_key, rows, seats_per_row, layout_pattern,
+            rows * seats_per_row, datetime.now(), datetime.now()
+        ))
+        
+        seats = []
+        for row in range(1, rows + 1):
+            for col_idx in range(seats_per_row):
+                seat_number = (row - 1) * seats_per_row + col_idx + 1
+                seats.append((
+                    template_id, row, col_idx, str(seat_number), chr(65 + col_idx),
+                    self._seat_type(col_idx, seats_per_row, layout_pattern, is_ship),
+                    'BACKWARD' if row <= rows // 2 else 'FORWARD', seat_number % 20 == 0
                 ))
-                seat_number += 1
+        execute_values(self.cursor, """
+            INSERT INTO seat_map_seats (template_id, seat_row, seat_column, seat_number, column_letter,
+                                      seat_type, seat_orientation, is_accessible)
+            VALUES %s
+        """, seats, page_size=1000)
+        
+        self.templates[layout_key] = template_id
+        return template_id
+    
+    @staticmethod
+    def _seat_type(col_idx, seats_per_row, layout_pattern, is_ship):
+        """Tipo di posto dalla posizione nella fila: finestrino ai lati, corridoio accanto ai corridoi"""
+        if is_ship:
+            return 'COUCHETTE_LOWER' if col_idx % 2 == 0 else 'COUCHETTE_UPPER'
+        if col_idx in (0, seats_per_row - 1):
+            return 'WINDOW'
+        
+        groups = [int(size) for size in layout_pattern.split('+') if size.isdigit()]
+        if sum(groups) != seats_per_row:
+            return 'AISLE'
+        # Colonne adiacenti a un corridoio: ultima di ogni gruppo e prima del successivo
+        aisle_columns = set()
+        boundary = 0
+        for size in groups[:-1]:
+            boundary += size
+            aisle_columns.update((boundary - 1, boundary))
+        return 'AISLE' if col_idx in aisle_columns else 'MIDDLE'
 
 class RouteGenerator:
     """Generazione rotte e servizi"""
     
-    def __init__(self, cursor, static_data):
+    def __init__(self, cursor, static_data, history_days=0, rng=None):
         self.cursor = cursor
         self.data = static_data
+        # Giorni di storico (viaggi conclusi) generati prima di oggi
+        self.history_days = history_days
+        self.random = rng or random.Random()
     
     def generate_all(self):
         """Genera rotte complete con servizi"""
@@ -416,7 +369,7 @@ class RouteGenerator:
         else:
             preferred = available[:8] if len(available) > 8 else available[:4]
         
-        return random.choice(preferred if preferred else available)
+        return self.random.choice(preferred if preferred else available)
     
     def _create_services_for_route(self, route_data):
         """Crea servizi per una rotta"""
@@ -437,16 +390,16 @@ class RouteGenerator:
                 self._create_trips_for_service(service_id, dep_time)
     
     def _get_random_operator(self):
-        """Ottieni operatore casuale"""
-        self.cursor.execute("SELECT id FROM railway_operators ORDER BY RANDOM() LIMIT 1")
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        """Ottieni operatore casuale (scelto dall'RNG della fase in ordine di codice, riproducibile)"""
+        self.cursor.execute("SELECT id FROM railway_operators ORDER BY code")
+        result = [row[0] for row in self.cursor.fetchall()]
+        return self.random.choice(result) if result else None
     
     def _get_random_train(self):
-        """Ottieni treno casuale"""
-        self.cursor.execute("SELECT id FROM trains ORDER BY RANDOM() LIMIT 1")
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        """Ottieni treno casuale (scelto dall'RNG della fase in ordine di codice, riproducibile)"""
+        self.cursor.execute("SELECT id FROM trains ORDER BY code")
+        result = [row[0] for row in self.cursor.fetchall()]
+        return self.random.choice(result) if result else None
     
     def _create_train_service(self, route_id, service_type_id, operator_id, train_id, dep_time):
         """Crea servizio treno"""
@@ -469,7 +422,7 @@ class RouteGenerator:
         """, (
             service_id, train_id, route_id, service_type_id, operator_id,
             dep_time, f"{service_code} {dep_time.strftime('%H:%M')}",
-            json.dumps(operates_days), date.today(), 
+            json.dumps(operates_days), date.today() - timedelta(days=self.history_days), 
             date.today() + timedelta(days=365),
             service_code in ['FER_N'], datetime.now(), datetime.now()
         ))
@@ -478,15 +431,20 @@ class RouteGenerator:
     
     def _create_trips_for_service(self, service_id, departure_time):
         """Crea viaggi per un servizio"""
-        start_date = date.today()
-        for i in range(30):
+        start_date = date.today() - timedelta(days=self.history_days)
+        for i in range(self.history_days + 30):
             service_date = start_date + timedelta(days=i)
             
             planned_departure = datetime.combine(service_date, departure_time)
-            planned_arrival = planned_departure + timedelta(hours=random.randint(2, 8))
+            planned_arrival = planned_departure + timedelta(hours=self.random.randint(2, 8))
             
-            delay = random.choices([0, 5, 10, 15, 30, 60], weights=[70, 15, 8, 4, 2, 1])[0]
-            status = 'SCHEDULED' if service_date > date.today() else random.choice(['COMPLETED', 'RUNNING'])
+            delay = self.random.choices([0, 5, 10, 15, 30, 60], weights=[70, 15, 8, 4, 2, 1])[0]
+            if service_date > date.today():
+                status = 'SCHEDULED'
+            elif service_date < date.today():
+                status = 'COMPLETED'
+            else:
+                status = self.random.choice(['COMPLETED', 'RUNNING'])
             
             self.cursor.execute("""
                 INSERT INTO trips (id, train_service_id, service_date, 
@@ -500,240 +458,84 @@ class RouteGenerator:
             ))
 
 class BookingGenerator:
-    """Generazione prenotazioni complete"""
+    """Generazione prenotazioni complete: utenti, prenotazioni, ticket, pagamenti e posti
+    sono fasi separate della generazione"""
     
-    def __init__(self, cursor):
+    def __init__(self, cursor, person_pool=None, rng=None):
         self.cursor = cursor
-        self.fare_calculator = FareCalculator(cursor)
-    
-    def generate_users_and_bookings(self, num_users=500, num_bookings=1500):
-        """Genera utenti, prenotazioni, ticket e pagamenti"""
-        print(f"👥 Creating {num_users} users and {num_bookings} bookings...")
-        
-        user_ids = self._create_users(num_users)
-        booking_ids = self._create_bookings(user_ids, num_bookings)
-        
-        print("🎫 Creating tickets...")
-        self._create_tickets(booking_ids)
-        
-        print("💳 Creating payments...")
-        self._create_payments(booking_ids)
-        
-        print("🪑 Creating seat reservations...")
-        self._create_seat_reservations(booking_ids)
-    
-    def _create_users(self, num_users):
-        """Crea utenti"""
-        user_ids = []
-        used_emails = set()
-        
-        for i in range(num_users):
-            user_id = UniqueValueGenerator.uuid()
-            
-            # Email unica
-            for _ in range(10):
-                email = fake.email()
-                if email not in used_emails:
-                    used_emails.add(email)
-                    break
-            else:
-                email = f"user{i}_{int(datetime.now().timestamp())}@example.com"
-            
-            self.cursor.execute("""
-                INSERT INTO users (id, first_name, last_name, email, password, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
-                user_id, fake.first_name(), fake.last_name(), 
-                email, fake.password(), datetime.now(), datetime.now()
-            ))
-            user_ids.append(user_id)
+        self.person_pool = person_pool or PersonPool()
+        self.random = rng or random.Random()
+    
+    def create_users(self, num_users=500):
+        """Crea utenti (email uniche per costruzione dal person pool)"""
+        print(f"👥 Creating {num_users} users...")
+        first_names, last_names, emails, passwords = self.person_pool.users(num_users)
+        user_ids = [UniqueValueGenerator.uuid() for _ in range(num_users)]
+        now = datetime.now()
+        
+        execute_values(self.cursor, """
+            INSERT INTO users (id, first_name, last_name, email, password, created_at, updated_at)
+            VALUES %s
+        """, [
+            (user_id, first_name, last_name, email, password, now, now)
+            for user_id, first_name, last_name, email, password
+            in zip(user_ids, first_names, last_names, emails, passwords)
+        ], page_size=1000)
         
         return user_ids
     
-    def _create_bookings(self, user_ids, num_bookings):
-        """Crea prenotazioni"""
-        booking_ids = []
-        
-        for i in range(num_bookings):
-            user_id = random.choice(user_ids)
-            
-            # Crea passeggero
-            passenger_id = UniqueValueGenerator.uuid()
-            self.cursor.execute("""
-                INSERT INTO passengers (id, user_id, first_name, last_name, email, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
-                passenger_id, user_id, fake.first_name(), fake.last_name(),
-                fake.email(), datetime.now(), datetime.now()
-            ))
-            
-            # Crea prenotazione
-            booking_id = self._create_single_booking(passenger_id, user_id)
-            if booking_id:
-                booking_ids.append(booking_id)
-            
-            if (i + 1) % 100 == 0:
-                print(f"   📋 {i + 1}/{num_bookings} bookings processed...")
-        
-        return booking_ids
-    
-    def _create_single_booking(self, passenger_id, user_id):
-        """Crea singola prenotazione con calcolo tariffa"""
-        # Seleziona trip casuale
-        self.cursor.execute("""
-            SELECT t.id, rs_orig.station_id as origin, rs_dest.station_id as dest,
-                   t.planned_departure_time, t.planned_arrival_time,
-                   ts.service_type_id, ts.train_id,
-                   c_orig.country_id as origin_country, c_dest.country_id as dest_country
-            FROM trips t
-            JOIN train_services ts ON t.train_service_id = ts.id
-            JOIN route_stations rs_orig ON ts.route_id = rs_orig.route_id AND rs_orig.sequence = 1
-            JOIN route_stations rs_dest ON ts.route_id = rs_dest.route_id AND rs_dest.sequence = (
-                SELECT MAX(sequence) FROM route_stations WHERE route_id = ts.route_id
-            )
-            JOIN stations s_orig ON rs_orig.station_id = s_orig.id
-            JOIN stations s_dest ON rs_dest.station_id = s_dest.id
-            JOIN cities c_orig ON s_orig.city_id = c_orig.id
-            JOIN cities c_dest ON s_dest.city_id = c_dest.id
-            ORDER BY RANDOM() LIMIT 1
-        """)
-        
-        trip_data = self.cursor.fetchone()
-        if not trip_data:
-            return None
-        
-        (trip_id, origin_station, dest_station, dep_time, arr_time, 
-         service_type_id, train_id, origin_country, dest_country) = trip_data
-        
-        # Ottieni categoria vagone
-        self.cursor.execute("""
-            SELECT w.category_id FROM wagons w
-            JOIN train_wagons tw ON w.id = tw.wagon_id
-            WHERE tw.train_id = %s ORDER BY RANDOM() LIMIT 1
-        """, (train_id,))
-        
-        result = self.cursor.fetchone()
-        if not result:
-            return None
-        
-        wagon_category_id = result[0]
-        distance = random.randint(50, 800)
+    def create_bookings(self, user_ids, num_bookings=1500, route_skew=1.1, time_skew=0.8):
+        """Crea passeggeri, prenotazioni e segmenti campionando dal catalogo viaggi in memoria"""
+        print(f"📋 Creating {num_bookings} bookings...")
+        catalog = TripCatalog.load(
+            self.cursor, seed=self.person_pool.seed, route_skew=route_skew, time_skew=time_skew
+        )
+        if not catalog.trips:
+            print("⚠️ No bookable trips found")
+            return BookingBatch()
         
-        # Calcola tariffa
-        (fare_id, fare) = self.fare_calculator.calculate(
-            origin_country, dest_country, distance, service_type_id, wagon_category_id
+        batch = build_booking_batch(
+            catalog, FareTable.load(self.cursor), user_ids,
+            self.person_pool.passengers(num_bookings), num_bookings, run_tag=unused_run_tag(self.cursor)
         )
         
-        # Crea prenotazione
-        booking_id = UniqueValueGenerator.uuid()
-        booking_ref = UniqueValueGenerator.booking_reference(self.cursor)
+        execute_values(self.cursor, """
+            INSERT INTO passengers (id, user_id, first_name, last_name, email, created_at, updated_at)
+            VALUES %s
+        """, batch.passengers, page_size=1000)
         
-        self.cursor.execute("""
+        execute_values(self.cursor, """
             INSERT INTO bookings (id, booking_reference, user_id, passenger_id,
                                 origin_station_id, destination_station_id, departure_date,
                                 total_amount, currency, status, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            booking_id, booking_ref, user_id, passenger_id,
-            origin_station, dest_station, dep_time.date(),
-            fare, 'EUR', 'CONFIRMED', datetime.now(), datetime.now()
-        ))
+            VALUES %s
+        """, batch.bookings, page_size=1000)
         
-        # Crea segmento
-        self._create_booking_segment(booking_id, trip_data, distance, fare, fare_id)
-        
-        return booking_id
-    
-    def _create_booking_segment(self, booking_id, trip_data, distance, fare, fare_id):
-        """Crea segmento prenotazione"""
-        trip_id, origin_station, dest_station = trip_data[0], trip_data[1], trip_data[2]
-        dep_time, arr_time = trip_data[3], trip_data[4]
-        
-        # Ottieni route stations
-        self.cursor.execute("""
-            SELECT rs.id FROM route_stations rs
-            JOIN train_services ts ON rs.route_id = ts.route_id
-            JOIN trips t ON ts.id = t.train_service_id
-            WHERE t.id = %s AND rs.station_id = %s
-        """, (trip_id, origin_station))
-        origin_rs = self.cursor.fetchone()
-        
-        self.cursor.execute("""
-            SELECT rs.id FROM route_stations rs
-            JOIN train_services ts ON rs.route_id = ts.route_id
-            JOIN trips t ON ts.id = t.train_service_id
-            WHERE t.id = %s AND rs.station_id = %s
-        """, (trip_id, dest_station))
-        dest_rs = self.cursor.fetchone()
-        
-        if not origin_rs or not dest_rs:
-            return
-        
-        self.cursor.execute("""
+        execute_values(self.cursor, """
             INSERT INTO booking_segments (id, booking_id, trip_id, sequence,
                                         origin_station_id, destination_station_id,
                                         origin_route_station_id, destination_route_station_id,
                                         planned_departure_time, planned_arrival_time,
                                         distance_km, segment_amount, fare_id, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            UniqueValueGenerator.uuid(), booking_id, trip_id, 1,
-            origin_station, dest_station, origin_rs[0], dest_rs[0],
-            dep_time, arr_time, distance, fare, fare_id, datetime.now(), datetime.now()
-        ))
+            VALUES %s
+        """, batch.segments, page_size=1000)
+        
+        return batch
     
-    def _create_tickets(self, booking_ids):
+    def create_tickets(self, batch):
         """Crea ticket per prenotazioni"""
-        for booking_id in booking_ids:
-            self.cursor.execute("""
-                SELECT b.id, b.passenger_id, bs.id as segment_id, bs.trip_id,
-                       bs.origin_station_id, bs.destination_station_id,
-                       bs.segment_amount, b.departure_date
-                FROM bookings b
-                JOIN booking_segments bs ON b.id = bs.booking_id
-                WHERE b.id = %s LIMIT 1
-            """, (booking_id,))
-            
-            data = self.cursor.fetchone()
-            if not data or len(data) < 8:
-                continue
-            
-            # Ottieni categoria vagone separatamente
-            self.cursor.execute("""
-                SELECT w.category_id FROM wagons w
-                JOIN train_wagons tw ON w.id = tw.wagon_id
-                JOIN train_services ts ON tw.train_id = ts.train_id
-                JOIN trips t ON ts.id = t.train_service_id
-                WHERE t.id = %s LIMIT 1
-            """, (data[3],))  # data[3] = trip_id
-            
-            wagon_result = self.cursor.fetchone()
-            if not wagon_result:
-                continue
-                
-            wagon_category_id = wagon_result[0]
-            ticket_number = UniqueValueGenerator.ticket_number(self.cursor)
-            
-            # Estrai i valori dalla tupla esplicitamente
-            (booking_id_result, passenger_id, segment_id, trip_id,
-             origin_station_id, destination_station_id, fare_amount, 
-             service_date) = data
-            
-            self.cursor.execute("""
-                INSERT INTO tickets (id, ticket_number, booking_id, booking_segment_id,
-                                   passenger_id, trip_id, origin_station_id, destination_station_id,
-                                   wagon_category_id, fare_amount, currency, status,
-                                   issued_at, service_date, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                UniqueValueGenerator.uuid(), ticket_number, booking_id_result, segment_id,
-                passenger_id, trip_id, origin_station_id, destination_station_id,
-                wagon_category_id, fare_amount, 'EUR', 'VALID',
-                datetime.now(), service_date, datetime.now(), datetime.now()
-            ))
-    
-    def _create_payments(self, booking_ids):
+        print("🎫 Creating tickets...")
+        execute_values(self.cursor, """
+            INSERT INTO tickets (id, ticket_number, booking_id, booking_segment_id,
+                               passenger_id, trip_id, origin_station_id, destination_station_id,
+                               wagon_category_id, fare_amount, currency, status,
+                               issued_at, service_date, created_at, updated_at)
+            VALUES %s
+        """, batch.tickets, page_size=1000)
+    
+    def create_payments(self, booking_ids):
         """Crea pagamenti"""
+        print("💳 Creating payments...")
         methods = ['CREDIT_CARD', 'DEBIT_CARD', 'PAYPAL', 'SEPA_DIRECT_DEBIT']
         
         for booking_id in booking_ids:
@@ -743,9 +545,9 @@ class BookingGenerator:
                 continue
             
             amount = result[0]
-            status = random.choices(['COMPLETED', 'PENDING', 'FAILED'], weights=[95, 3, 2])[0]
+            status = self.random.choices(['COMPLETED', 'PENDING', 'FAILED'], weights=[95, 3, 2])[0]
             paid_at = datetime.now() if status == 'COMPLETED' else None
-            transaction_ref = f"TXN{random.randint(100000000, 999999999)}" if status == 'COMPLETED' else None
+            transaction_ref = f"TXN{self.random.randint(100000000, 999999999)}" if status == 'COMPLETED' else None
             
             self.cursor.execute("""
                 INSERT INTO payments (id, booking_id, amount, currency, payment_method,
@@ -753,13 +555,14 @@ class BookingGenerator:
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
                 UniqueValueGenerator.uuid(), booking_id, amount, 'EUR', 
-                random.choice(methods), status, transaction_ref, paid_at,
+                self.random.choice(methods), status, transaction_ref, paid_at,
                 datetime.now(), datetime.now()
             ))
     
-    def _create_seat_reservations(self, booking_ids):
+    def create_seat_reservations(self, booking_ids):
         """Crea prenotazioni posti (60% delle prenotazioni)"""
-        selected_bookings = random.sample(booking_ids, min(len(booking_ids), int(len(booking_ids) * 0.6)))
+        print("🪑 Creating seat reservations...")
+        selected_bookings = self.random.sample(booking_ids, min(len(booking_ids), int(len(booking_ids) * 0.6)))
         
         for booking_id in selected_bookings:
             self.cursor.execute("""
@@ -778,33 +581,37 @@ class BookingGenerator:
             
             segment_id, trip_id, origin_rs, dest_rs, passenger_id, train_id = data
             
-            # Trova posto disponibile
+            # Trova posto disponibile: i posti liberi in ordine fisso, la scelta all'RNG della fase
             self.cursor.execute("""
-                SELECT ws.id FROM wagon_seats ws
-                JOIN train_wagons tw ON ws.wagon_id = tw.wagon_id
+                SELECT tw.wagon_id, s.seat_row, s.seat_column
+                FROM train_wagons tw
+                JOIN wagons w ON tw.wagon_id = w.id
+                JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
                 WHERE tw.train_id = %s
-                AND ws.id NOT IN (
-                    SELECT wagon_seat_id FROM seat_reservations 
-                    WHERE trip_id = %s AND wagon_seat_id IS NOT NULL
+                AND NOT EXISTS (
+                    SELECT 1 FROM seat_reservations sr
+                    WHERE sr.trip_id = %s AND sr.wagon_id = tw.wagon_id
+                      AND sr.seat_row = s.seat_row AND sr.seat_column = s.seat_column
                 )
-                ORDER BY RANDOM() LIMIT 1
+                ORDER BY tw.position, s.seat_row, s.seat_column
             """, (train_id, trip_id))
             
-            seat_result = self.cursor.fetchone()
-            if not seat_result:
+            free_seats = self.cursor.fetchall()
+            if not free_seats:
                 continue
+            seat_result = self.random.choice(free_seats)
             
             self.cursor.execute("SELECT planned_departure_time FROM trips WHERE id = %s", (trip_id,))
             dep_result = self.cursor.fetchone()
             expires_at = dep_result[0] + timedelta(hours=2) if dep_result else datetime.now() + timedelta(hours=2)
             
             self.cursor.execute("""
-                INSERT INTO seat_reservations (id, booking_segment_id, trip_id, wagon_seat_id,
+                INSERT INTO seat_reservations (id, booking_segment_id, trip_id, wagon_id, seat_row, seat_column,
                                              passenger_id, origin_route_station_id, destination_route_station_id,
                                              expires_at, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
-                UniqueValueGenerator.uuid(), segment_id, trip_id, seat_result[0], 
+                UniqueValueGenerator.uuid(), segment_id, trip_id, *seat_result, 
                 passenger_id, origin_rs, dest_rs, expires_at,
                 datetime.now(), datetime.now()
             ))
@@ -821,12 +628,25 @@ class DatabaseCleaner:
         
         # Ordine di cancellazione per rispettare vincoli FK
         tables = [
+            'outbox_checkpoints',
+            'outbox_events',
+            'rollup_watermarks',
+            'rollup_route_revenue_daily',
+            'rollup_trip_load_factor',
+            'rollup_operator_punctuality_daily',
+            'archive.payments',
+            'archive.tickets',
+            'archive.seat_reservations',
+            'archive.booking_segments',
+            'archive.bookings',
+            'archive.trip_station_updates',
+            'archive.trips',
             'payments', 
             'tickets', 
             'seat_reservations',
             'trip_station_updates',
+            'trip_leg_availability',
             'booking_segments',
-            'wagon_seats',
             'cabins',
             'bookings', 
             'passengers', 
@@ -837,6 +657,8 @@ class DatabaseCleaner:
             'train_services', 
             'route_stations', 
             'wagons',
+            'seat_map_seats',
+            'seat_map_templates',
             'fares', 
             'routes', 
             'trains', 
@@ -858,41 +680,120 @@ class DatabaseCleaner:
 class RaylixDataGenerator:
     """Generatore principale per il database Raylix"""
     
-    def __init__(self, db_config):
+    def __init__(self, db_config, instrumentation=None, seed=None, history_days=0, rollups=False, jobs=4):
+        self.db_config = db_config
         self.db_manager = DatabaseManager(db_config)
         self.static_data = StaticDataLoader.load_all()
-    
-    def run_full_generation(self, clear_data=True):
-        """Esegue la generazione completa"""
+        self.instrumentation = instrumentation or PhaseInstrumentation(enabled=False)
+        # Con un seed esplicito la generazione è riproducibile (un RNG per fase, vedi PhaseScheduler)
+        self.seed = seed
+        self.history_days = history_days
+        self.rollups = rollups
+        self.jobs = jobs
+        self.person_pool = PersonPool(seed if seed is not None else random.randrange(2 ** 32))
+    
+    def phase_graph(self):
+        """Fasi della generazione con le tabelle lette e scritte: l'ordine deriva dalle dipendenze"""
+        return PhaseGraph([
+            GenerationPhase(
+                'static_insert', lambda cursor, rng, state: StaticDataInserter(cursor, self.static_data).insert_all(),
+                writes=('countries', 'cities', 'stations', 'railway_operators', 'service_types', 'wagon_categories')
+            ),
+            GenerationPhase(
+                'trains', lambda cursor, rng, state: TrainGenerator(cursor, self.static_data).generate_all(),
+                requires=('wagon_categories',),
+                writes=('trains', 'wagons', 'train_wagons', 'seat_map_templates', 'seat_map_seats')
+            ),
+            GenerationPhase(
+                'routes',
+                lambda cursor, rng, state: RouteGenerator(cursor, self.static_data, self.history_days, rng).generate_all(),
+                requires=('stations', 'railway_operators', 'service_types', 'trains', 'train_wagons', 'seat_map_templates'),
+                # trip_leg_availability nasce con i viaggi (trigger su trips)
+                writes=('routes', 'route_stations', 'train_services', 'trips', 'trip_leg_availability')
+            ),
+            GenerationPhase(
+                'fares', lambda cursor, rng, state: self._insert_fares(cursor),
+                requires=('countries', 'wagon_categories', 'service_types'),
+                writes=('fares',)
+            ),
+            GenerationPhase(
+                'trip_updates', lambda cursor, rng, state: self._generate_trip_updates(cursor, rng),
+                requires=('trips', 'route_stations'),
+                writes=('trip_station_updates',)
+            ),
+            GenerationPhase(
+                'users', self._phase_users,
+                writes=('users',)
+            ),
+            GenerationPhase(
+                'bookings', self._phase_bookings,
+                requires=('users', 'trips', 'route_stations', 'train_wagons', 'fares'),
+                writes=('passengers', 'bookings', 'booking_segments')
+            ),
+            GenerationPhase(
+                'tickets', lambda cursor, rng, state: BookingGenerator(cursor, self.person_pool, rng).create_tickets(state['batch']),
+                requires=('bookings', 'booking_segments'),
+                writes=('tickets',),
+                same_run=('bookings',)
+            ),
+            GenerationPhase(
+                'payments', self._phase_payments,
+                requires=('bookings',),
+                writes=('payments',)
+            ),
+            GenerationPhase(
+                'seat_reservations', self._phase_seat_reservations,
+                requires=('booking_segments', 'seat_map_seats', 'trip_leg_availability'),
+                writes=('seat_reservations',)
+            ),
+            GenerationPhase(
+                'exceptions', lambda cursor, rng, state: self._generate_service_exceptions(cursor, rng),
+                requires=('train_services',),
+                writes=('service_exceptions',)
+            ),
+            # Backfill dei rollup analitici sui dati generati (seat_reservations: contatori dei posti aggiornati)
+            GenerationPhase(
+                'rollups', self._phase_rollups,
+                requires=('payments', 'tickets', 'booking_segments', 'trip_station_updates', 'seat_reservations'),
+                writes=('rollup_route_revenue_daily', 'rollup_trip_load_factor',
+                        'rollup_operator_punctuality_daily', 'rollup_watermarks'),
+                default=self.rollups
+            ),
+        ])
+    
+    def run_full_generation(self, clear_data=True, only=None, skip=None):
+        """Esegue la generazione completa, o solo le fasi selezionate con only/skip"""
         print("🚄 Starting Raylix data generation...")
+        graph = self.phase_graph()
+        partial = bool(only or skip)
+        # I profili cProfile restano confrontabili solo con le fasi in sequenza
+        jobs = 1 if self.instrumentation.profile else self.jobs
         
         try:
+            selected = graph.select(only, skip)
+            if partial:
+                print(f"🧩 Phases: {', '.join(selected)}")
             self.db_manager.connect()
-            cursor = self.db_manager.get_cursor()
-            
-            if clear_data:
-                DatabaseCleaner(cursor).clear_all_data()
-            
-            # Inserimento dati statici
-            StaticDataInserter(cursor, self.static_data).insert_all()
-            
-            # Generazione strutture dinamiche
-            TrainGenerator(cursor, self.static_data).generate_all()
-            RouteGenerator(cursor, self.static_data).generate_all()
-            
-            # Inserimento tariffe
-            self._insert_fares(cursor)
-            
-            # Generazione trip updates
-            self._generate_trip_updates(cursor)
-            
-            # Generazione prenotazioni
-            BookingGenerator(cursor).generate_users_and_bookings()
+            cursor = self.instrumentation.track(self.db_manager.get_cursor(InstrumentedCursor))
+            
+            if clear_data and not partial:
+                with self.instrumentation.phase('clear'):
+                    DatabaseCleaner(cursor).clear_all_data()
+            elif clear_data:
+                with self.instrumentation.phase('clear'):
+                    self._clear_phases(cursor, graph, selected)
+            else:
+                self._check_upstream(cursor, graph, selected)
             
-            # Eccezioni servizio
-            self._generate_service_exceptions(cursor)
+            scheduler = PhaseScheduler(graph, self._connect_worker, self.instrumentation, jobs, self.seed)
+            try:
+                scheduler.run(selected)
+            finally:
+                self.instrumentation.schedule = scheduler.report()
             
             print("✅ Data generation completed successfully!")
+            self.instrumentation.print_summary()
+            scheduler.print_summary()
             
         except Exception as e:
             print(f"❌ Error during data generation: {e}")
@@ -900,6 +801,69 @@ class RaylixDataGenerator:
         finally:
             self.db_manager.close()
     
+    def _connect_worker(self):
+        """Connessione di un worker dello scheduler, con i trigger dell'outbox disattivati:
+        i dati generati non producono eventi da consegnare"""
+        manager = DatabaseManager(self.db_config)
+        manager.connect()
+        manager.get_cursor().execute("SET raylix.outbox_disabled = on")
+        return manager
+    
+    @staticmethod
+    def _check_upstream(cursor, graph, selected):
+        """Errore se le fasi selezionate leggono tabelle vuote che nessuna fase della run rigenera"""
+        missing = graph.missing_upstream(cursor, selected)
+        if missing:
+            raise RuntimeError(f"missing upstream data: {'; '.join(missing)}")
+    
+    def _clear_phases(self, cursor, graph, selected):
+        """Svuota solo le tabelle delle fasi selezionate (CASCADE: anche i dati che le referenziano)
+        e controlla i dati a monte nella stessa transazione, annullata se ne mancano"""
+        tables = graph.tables(selected)
+        print(f"🗑️ Clearing {', '.join(tables)}...")
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(sql.SQL("TRUNCATE TABLE {} CASCADE").format(
+                sql.SQL(', ').join(sql.Identifier(table) for table in tables)
+            ))
+            self._check_upstream(cursor, graph, selected)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        
+        # TRUNCATE non esegue i trigger: i contatori dei viaggi esistenti vanno riallineati ai posti rimasti
+        if 'routes' not in selected:
+            mismatches, _ = reconcile(cursor, fix=True)
+            print(f"   🔧 {len(mismatches)} seat availability counters realigned")
+    
+    def _phase_users(self, cursor, rng, state):
+        state['user_ids'] = BookingGenerator(cursor, self.person_pool, rng).create_users()
+    
+    def _phase_bookings(self, cursor, rng, state):
+        # Utenti già presenti se la fase users non fa parte della run
+        if 'user_ids' not in state:
+            cursor.execute("SELECT id::text FROM users ORDER BY email")
+            state['user_ids'] = [row[0] for row in cursor.fetchall()]
+        state['batch'] = BookingGenerator(cursor, self.person_pool, rng).create_bookings(state['user_ids'])
+    
+    def _booking_ids(self, cursor, state):
+        """Prenotazioni della run, o tutte quelle presenti se la fase bookings non fa parte della run"""
+        if 'batch' in state:
+            return state['batch'].booking_ids
+        cursor.execute("SELECT id::text FROM bookings ORDER BY booking_reference")
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _phase_payments(self, cursor, rng, state):
+        BookingGenerator(cursor, self.person_pool, rng).create_payments(self._booking_ids(cursor, state))
+    
+    def _phase_seat_reservations(self, cursor, rng, state):
+        BookingGenerator(cursor, self.person_pool, rng).create_seat_reservations(self._booking_ids(cursor, state))
+    
+    def _phase_rollups(self, cursor, rng, state):
+        print("📈 Backfilling analytics rollups...")
+        RollupRefresher(cursor).backfill()
+    
     def _insert_fares(self, cursor):
         """Inserisce tariffe dai dati JSON"""
         print("💰 Inserting fare rules...")
@@ -923,16 +887,19 @@ class RaylixDataGenerator:
                 datetime.now(), datetime.now()
             ))
     
-    def _generate_trip_updates(self, cursor):
-        """Genera aggiornamenti stazioni viaggi"""
+    def _generate_trip_updates(self, cursor, rng):
+        """Genera aggiornamenti stazioni viaggi (solo fermate con orari effettivi)"""
         print("📊 Creating trip station updates...")
         
+        # Gli orari pianificati derivano dagli offset della rotta (vista trip_stop_times):
+        # le righe servono solo ai viaggi partiti, con orari effettivi e ritardi
         cursor.execute("""
             SELECT t.id, t.service_date, t.planned_departure_time, 
                    t.delay_minutes, t.status, ts.route_id
             FROM trips t
             JOIN train_services ts ON t.train_service_id = ts.id
-            ORDER BY t.service_date, t.planned_departure_time
+            WHERE t.status IN ('COMPLETED', 'RUNNING') AND t.service_date <= CURRENT_DATE
+            ORDER BY t.service_date, t.planned_departure_time, ts.route_id, ts.service_type_id
         """)
         
         for trip_id, service_date, planned_dep, delay_minutes, status, route_id in cursor.fetchall():
@@ -942,44 +909,38 @@ class RaylixDataGenerator:
             """, (route_id,))
             
             for route_station_id, station_id, sequence, arrival_offset, departure_offset in cursor.fetchall():
-                # Calcola orari pianificati: NULL solo se offset è effettivamente NULL
-                planned_arrival = planned_dep + timedelta(minutes=arrival_offset) if arrival_offset is not None else None
-                planned_departure = planned_dep + timedelta(minutes=departure_offset) if departure_offset is not None else None
+                base_delay = delay_minutes or 0
+                station_delay = max(0, base_delay + (sequence - 1) * 2 + rng.choice([0, 2, 5]))
                 
-                actual_arrival = actual_departure = station_delay = None
-                
-                if status in ['COMPLETED', 'RUNNING'] and service_date <= date.today():
-                    base_delay = delay_minutes or 0
-                    station_delay = max(0, base_delay + (sequence - 1) * 2 + random.choice([0, 2, 5]))
-                    
-                    # Calcola orari effettivi solo dove ci sono orari pianificati
-                    if planned_arrival is not None:
-                        actual_arrival = planned_arrival + timedelta(minutes=station_delay)
-                    if planned_departure is not None:
-                        actual_departure = planned_departure + timedelta(minutes=station_delay)
+                # Orari effettivi solo dove ci sono orari pianificati (offset non NULL)
+                actual_arrival = (planned_dep + timedelta(minutes=arrival_offset + station_delay)
+                                  if arrival_offset is not None else None)
+                actual_departure = (planned_dep + timedelta(minutes=departure_offset + station_delay)
+                                    if departure_offset is not None else None)
                 
                 cursor.execute("""
                     INSERT INTO trip_station_updates (
-                        id, trip_id, route_station_id, planned_arrival, planned_departure,
-                        actual_arrival, actual_departure, delay_minutes, updated_at, created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        id, trip_id, route_station_id, actual_arrival, actual_departure,
+                        delay_minutes, updated_at, created_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     ON CONFLICT (trip_id, route_station_id) DO UPDATE SET
                         actual_arrival = EXCLUDED.actual_arrival,
                         actual_departure = EXCLUDED.actual_departure,
                         delay_minutes = EXCLUDED.delay_minutes,
                         updated_at = EXCLUDED.updated_at
                 """, (
-                    UniqueValueGenerator.uuid(), trip_id, route_station_id, 
-                    planned_arrival, planned_departure, actual_arrival, actual_departure, 
-                    station_delay, datetime.now(), datetime.now()
+                    UniqueValueGenerator.uuid(), trip_id, route_station_id,
+                    actual_arrival, actual_departure, station_delay, datetime.now(), datetime.now()
                 ))
     
-    def _generate_service_exceptions(self, cursor):
+    def _generate_service_exceptions(self, cursor, rng):
         """Genera eccezioni del servizio"""
         print("⚠️ Creating service exceptions...")
         
-        cursor.execute("SELECT id FROM train_services ORDER BY RANDOM() LIMIT 10")
+        # Servizi in ordine di chiave naturale (rotta, tipo, orario): la scelta è dell'RNG della fase
+        cursor.execute("SELECT id FROM train_services ORDER BY route_id, service_type_id, departure_time")
         service_ids = [row[0] for row in cursor.fetchall()]
+        service_ids = rng.sample(service_ids, min(10, len(service_ids)))
         
         exceptions = [
             ('2025-12-25', 'Giorno di Natale', False),
@@ -1001,23 +962,61 @@ class RaylixDataGenerator:
                     is_running, reason, datetime.now(), datetime.now()
                 ))
 
-def main():
-    """Entry point"""
-    DB_CONFIG = {
+def load_db_config():
+    """Configurazione database da variabili d'ambiente"""
+    return {
         'host': os.getenv('DB_HOST', 'localhost'),
         'database': os.getenv('DB_NAME', 'raylix'),
         'user': os.getenv('DB_USER', 'postgres'), 
         'password': os.getenv('DB_PASSWORD', 'postgres'),
         'port': os.getenv('DB_PORT', '5432')
     }
+
+def _get_arg_value(flag, default):
+    """Valore di un'opzione `--flag value` da riga di comando"""
+    if flag in sys.argv:
+        index = sys.argv.index(flag)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+def _get_arg_list(flag):
+    """Valori separati da virgola di un'opzione `--flag a,b`"""
+    value = _get_arg_value(flag, None)
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+def main():
+    """Entry point"""
+    DB_CONFIG = load_db_config()
     
     print("🚄 Raylix Data Generator")
     print("=" * 40)
     
     clear_data = '--no-clear' not in sys.argv
-    
-    generator = RaylixDataGenerator(DB_CONFIG)
-    generator.run_full_generation(clear_data=clear_data)
+    profile = '--profile' in sys.argv
+    report_path = _get_arg_value('--report', 'generation_report.json')
+    seed = _get_arg_value('--seed', None)
+    history_days = int(_get_arg_value('--history-days', 0))
+    rollups = '--rollups' in sys.argv
+    jobs = int(_get_arg_value('--jobs', 4))
+    only = _get_arg_list('--only')
+    skip = _get_arg_list('--skip')
+    
+    instrumentation = PhaseInstrumentation(profile=profile)
+    generator = RaylixDataGenerator(
+        DB_CONFIG, instrumentation, int(seed) if seed is not None else None, history_days, rollups, jobs
+    )
+    if '--list-phases' in sys.argv:
+        graph = generator.phase_graph()
+        for name, phase in graph.phases.items():
+            after = ', '.join(graph.upstream[name]) or '-'
+            print(f"   {name:<20} after: {after:<45} writes: {', '.join(phase.writes)}")
+        return
+    try:
+        generator.run_full_generation(clear_data=clear_data, only=only, skip=skip)
+    finally:
+        # Il report viene scritto anche se la generazione fallisce a metà
+        instrumentation.write_report(report_path)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,180 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import psycopg2.extensions
+from psycopg2 import sql
+
+# Statement che scrivono righe: il rowcount di questi viene sommato alle righe scritte
+WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'MERGE', 'COPY')
+
+
+class DbStats:
+    """Contatori cumulativi del lato database"""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows_written = 0
+        self.db_time = 0.0
+
+    def record(self, query, elapsed, rowcount):
+        self.statements += 1
+        self.db_time += elapsed
+        if rowcount and rowcount > 0 and _is_write(query):
+            self.rows_written += rowcount
+
+    def snapshot(self):
+        return self.statements, self.rows_written, self.db_time
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor che misura statement eseguiti, righe scritte e tempo di attesa sul DB"""
+
+    stats = None
+
+    def execute(self, query, vars=None):
+        # Query composte con psycopg2.sql: il testo serve a riconoscere le scritture
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            if self.stats is not None:
+                self.stats.record(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            if self.stats is not None:
+                self.stats.record(query, time.perf_counter() - start, self.rowcount)
+
+
+def _is_write(query):
+    if isinstance(query, bytes):
+        query = query[:64].decode('utf-8', 'ignore')
+    return query.lstrip()[:10].upper().startswith(WRITE_KEYWORDS)
+
+
+class PhaseInstrumentation:
+    """Strumentazione per fase: wall/CPU time, statement, righe, attesa DB e profiling opzionale"""
+
+    def __init__(self, enabled=True, profile=False, profile_dir='profiles', top_n=20):
+        self.enabled = enabled
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.top_n = top_n
+        self.stats = DbStats()
+        self.phases = []
+        self.started_at = None
+        self.schedule = None
+        # Contatori del thread corrente: le fasi in parallelo non si sommano a vicenda
+        self._local = threading.local()
+
+    def _stats(self):
+        return getattr(self._local, 'stats', self.stats)
+
+    def bind_thread(self):
+        """Contatori separati per il thread corrente (una connessione per worker)"""
+        self._local.stats = DbStats()
+
+    def track(self, cursor):
+        """Collega un InstrumentedCursor ai contatori del thread corrente"""
+        if self.enabled and isinstance(cursor, InstrumentedCursor):
+            cursor.stats = self._stats()
+        return cursor
+
+    @contextmanager
+    def phase(self, name):
+        """Misura il blocco come fase `name`"""
+        if not self.enabled:
+            yield
+            return
+
+        if self.started_at is None:
+            self.started_at = datetime.now()
+
+        stats = self._stats()
+        statements_0, rows_0, db_time_0 = stats.snapshot()
+        profiler = cProfile.Profile() if self.profile else None
+        wall_0, cpu_0 = time.perf_counter(), time.thread_time()
+        if profiler:
+            profiler.enable()
+
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            wall = time.perf_counter() - wall_0
+            cpu = time.thread_time() - cpu_0
+            statements_1, rows_1, db_time_1 = stats.snapshot()
+
+            record = {
+                'phase': name,
+                'wall_s': round(wall, 4),
+                'cpu_s': round(cpu, 4),
+                'db_wait_s': round(db_time_1 - db_time_0, 4),
+                'statements': statements_1 - statements_0,
+                'rows_written': rows_1 - rows_0,
+                'rows_per_sec': round((rows_1 - rows_0) / wall, 1) if wall > 0 else 0.0
+            }
+            if profiler:
+                record['hot_spots'] = self._dump_profile(name, profiler)
+            self.phases.append(record)
+
+    def _dump_profile(self, name, profiler):
+        """Salva il profilo della fase e restituisce le call site più costose"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        hot_spots = []
+        for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+            hot_spots.append({
+                'call_site': f"{os.path.basename(filename)}:{line}({func})",
+                'calls': ncalls,
+                'self_s': round(tottime, 4),
+                'cumulative_s': round(cumtime, 4)
+            })
+        hot_spots.sort(key=lambda h: h['self_s'], reverse=True)
+        return hot_spots[:self.top_n]
+
+    def report(self):
+        """Report completo come dizionario serializzabile"""
+        totals = {
+            key: round(sum(p[key] for p in self.phases), 4)
+            for key in ('wall_s', 'cpu_s', 'db_wait_s', 'statements', 'rows_written')
+        }
+        report = {
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'profiled': self.profile,
+            'totals': totals,
+            'phases': self.phases
+        }
+        if self.schedule:
+            report['schedule'] = self.schedule
+        return report
+
+    def write_report(self, path):
+        """Scrive il report JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"📝 Generation report written to {path}")
+
+    def print_summary(self):
+        """Stampa una tabella riassuntiva per fase"""
+        if not self.phases:
+            return
+        print("📊 Phase breakdown")
+        print(f"   {'phase':<20}{'wall s':>9}{'cpu s':>9}{'db s':>9}{'stmts':>9}{'rows':>10}{'rows/s':>11}")
+        for p in self.phases:
+            print(f"   {p['phase']:<20}{p['wall_s']:>9.2f}{p['cpu_s']:>9.2f}{p['db_wait_s']:>9.2f}"
+                  f"{p['statements']:>9}{p['rows_written']:>10}{p['rows_per_sec']:>11.1f}")
@@ -0,0 +1,481 @@
+import argparse
+import json
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+from generate_seed_data import DatabaseManager, load_db_config
+
+DEFAULT_RELAY = 'default'
+
+# Righe consegnabili in ordine (txid, id). Le transazioni con txid sotto lo xmin dello snapshot
+# sono tutte concluse: nessuna riga con posizione inferiore al checkpoint può comparire dopo
+FETCH_SQL = """
+    SELECT id, txid::text, aggregate_type, aggregate_id, event_type, payload, created_at
+    FROM outbox_events
+    WHERE (txid, id) > (%(txid)s::xid8, %(id)s)
+      AND txid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY txid, id
+    LIMIT %(limit)s
+"""
+
+# Ciclo di vita usato dal generatore di carico: stato prenotazione -> (prenotazione, biglietti, pagamenti)
+LIFECYCLE = {
+    'PENDING': ('CONFIRMED', 'VALID', 'COMPLETED'),
+    'CONFIRMED': ('CANCELED', 'CANCELED', None),
+    'CANCELED': ('REFUNDED', 'REFUNDED', 'REFUNDED'),
+    'REFUNDED': ('PENDING', 'VALID', 'PENDING'),
+}
+
+
+def envelope(row):
+    """Evento per il sink; la chiave di idempotenza resta uguale a ogni riconsegna"""
+    event_id, txid, aggregate_type, aggregate_id, event_type, payload, created_at = row
+    return {
+        'idempotency_key': f"outbox-{event_id}",
+        'event_id': event_id,
+        'event_type': event_type,
+        'aggregate_type': aggregate_type,
+        'aggregate_id': str(aggregate_id),
+        'occurred_at': created_at.isoformat(),
+        'payload': payload
+    }
+
+
+class FileSink:
+    """Sink su file JSON Lines: un batch è consegnato quando è su disco (fsync)"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def send(self, events):
+        self.file.write(''.join(json.dumps(event) + '\n' for event in events))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class SocketSink:
+    """Sink su socket TCP locale: ogni batch termina con una riga vuota e attende 'ok' dal consumer"""
+
+    def __init__(self, host, port, timeout=10.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.conn = None
+        self.reader = None
+
+    def send(self, events):
+        if self.conn is None:
+            self.conn = socket.create_connection(self.address, timeout=self.timeout)
+            self.reader = self.conn.makefile('r', encoding='utf-8')
+        data = ''.join(json.dumps(event) + '\n' for event in events) + '\n'
+        try:
+            self.conn.sendall(data.encode('utf-8'))
+            ack = self.reader.readline()
+        except OSError:
+            self.close()
+            raise
+        if ack.strip() != 'ok':
+            self.close()
+            raise ConnectionError(f"batch not acknowledged by {self.address[0]}:{self.address[1]}")
+
+    def close(self):
+        if self.conn is not None:
+            self.reader.close()
+            self.conn.close()
+        self.conn = self.reader = None
+
+
+def open_sink(spec):
+    """Sink da specifica 'file:PATH' o 'socket:HOST:PORT'"""
+    kind, _, target = spec.partition(':')
+    if kind == 'file' and target:
+        return FileSink(target)
+    if kind == 'socket' and target:
+        host, _, port = target.rpartition(':')
+        return SocketSink(host or '127.0.0.1', int(port))
+    raise ValueError(f"invalid sink '{spec}', expected file:PATH or socket:HOST:PORT")
+
+
+class RelayMetrics:
+    """Metriche del relay: throughput e lag dalla scrittura dell'evento alla conferma del sink"""
+
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.failures = 0
+        self.lags = []
+        self.started_at = time.perf_counter()
+
+    def record_batch(self, created_at, delivered_at):
+        self.events += len(created_at)
+        self.batches += 1
+        self.lags.extend((delivered_at - c).total_seconds() for c in created_at)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started_at
+        lags = sorted(self.lags)
+
+        def percentile(p):
+            return lags[min(len(lags) - 1, int(len(lags) * p))] * 1000 if lags else 0.0
+
+        return {
+            'events': self.events,
+            'batches': self.batches,
+            'failed_batches': self.failures,
+            'avg_batch': round(self.events / self.batches, 1) if self.batches else 0.0,
+            'elapsed_s': round(elapsed, 3),
+            'events_per_sec': round(self.events / elapsed, 1) if elapsed > 0 else 0.0,
+            'lag_p50_ms': round(percentile(0.50), 1),
+            'lag_p95_ms': round(percentile(0.95), 1),
+            'lag_max_ms': round(lags[-1] * 1000, 1) if lags else 0.0
+        }
+
+
+class OutboxRelay:
+    """Consegna gli eventi dell'outbox al sink a batch ordinati, con checkpoint dopo ogni conferma"""
+
+    def __init__(self, cursor, sink, name=DEFAULT_RELAY, batch_size=500, crash_every=None):
+        self.cursor = cursor
+        self.sink = sink
+        self.name = name
+        self.batch_size = batch_size
+        # Solo test: salta il checkpoint ogni N batch come un relay caduto dopo la consegna
+        self.crash_every = crash_every
+        self.metrics = RelayMetrics()
+        cursor.execute("""
+            INSERT INTO outbox_checkpoints (relay_name, last_txid, last_id, delivered, updated_at)
+            VALUES (%s, '0', 0, 0, now())
+            ON CONFLICT (relay_name) DO NOTHING
+        """, (name,))
+        cursor.execute("SELECT last_txid::text, last_id FROM outbox_checkpoints WHERE relay_name = %s", (name,))
+        self.position = cursor.fetchone()
+
+    def drain_once(self):
+        """Consegna un batch; restituisce il numero di eventi consegnati"""
+        self.cursor.execute(FETCH_SQL, {'txid': self.position[0], 'id': self.position[1], 'limit': self.batch_size})
+        rows = self.cursor.fetchall()
+        if not rows:
+            return 0
+        try:
+            self.sink.send([envelope(row) for row in rows])
+        except (OSError, ConnectionError):
+            # Nessun checkpoint: lo stesso batch viene ritentato al giro successivo
+            self.metrics.failures += 1
+            raise
+        delivered_at = datetime.now(timezone.utc)
+        self.metrics.record_batch([row[6] for row in rows], delivered_at)
+        if self.crash_every and self.metrics.batches % self.crash_every == 0:
+            self.position = self._checkpoint_position()
+            return len(rows)
+        self.position = (rows[-1][1], rows[-1][0])
+        self.cursor.execute("""
+            UPDATE outbox_checkpoints
+            SET last_txid = %s::xid8, last_id = %s, delivered = delivered + %s, updated_at = now()
+            WHERE relay_name = %s
+        """, (self.position[0], self.position[1], len(rows), self.name))
+        return len(rows)
+
+    def _checkpoint_position(self):
+        self.cursor.execute("SELECT last_txid::text, last_id FROM outbox_checkpoints WHERE relay_name = %s",
+                            (self.name,))
+        return self.cursor.fetchone()
+
+    def run(self, poll_interval=0.2, stop=None, once=False):
+        """Consegna fino a esaurimento (once) o finché stop non è impostato e l'outbox è vuota"""
+        while True:
+            try:
+                delivered = self.drain_once()
+            except (OSError, ConnectionError) as e:
+                print(f"⚠️ Sink error, retrying batch: {e}")
+                time.sleep(poll_interval)
+                continue
+            if delivered == self.batch_size:
+                continue
+            if once or (stop is not None and stop.is_set() and delivered == 0):
+                return self.metrics.summary()
+            time.sleep(poll_interval)
+
+
+def purge_delivered(cursor, retention):
+    """Cancella gli eventi consegnati a tutti i relay e più vecchi della retention"""
+    cursor.execute("SELECT last_txid::text, last_id FROM outbox_checkpoints ORDER BY last_txid, last_id LIMIT 1")
+    position = cursor.fetchone()
+    if position is None:
+        return 0
+    cursor.execute("""
+        DELETE FROM outbox_events
+        WHERE (txid, id) <= (%s::xid8, %s) AND created_at < now() - %s
+    """, (position[0], position[1], retention))
+    return cursor.rowcount
+
+
+def print_status(cursor):
+    """Posizione, eventi consegnati e arretrato di ogni relay"""
+    cursor.execute("""
+        SELECT c.relay_name, c.delivered, c.updated_at, COUNT(e.id), MIN(e.created_at)
+        FROM outbox_checkpoints c
+        LEFT JOIN outbox_events e ON (e.txid, e.id) > (c.last_txid, c.last_id)
+        GROUP BY c.relay_name, c.delivered, c.updated_at
+        ORDER BY c.relay_name
+    """)
+    rows = cursor.fetchall()
+    cursor.execute("SELECT COUNT(*) FROM outbox_events")
+    print(f"📬 {cursor.fetchone()[0]} events in the outbox")
+    for name, delivered, updated_at, pending, oldest in rows:
+        age = f", oldest pending {(datetime.now(timezone.utc) - oldest).total_seconds():.1f}s" if oldest else ""
+        print(f"   {name}: {delivered} delivered, {pending} pending{age} (checkpoint {updated_at:%H:%M:%S})")
+
+
+class OutboxReceiver:
+    """Consumer di prova per il sink socket: deduplica per chiave di idempotenza e conferma ogni batch"""
+
+    def __init__(self, host='127.0.0.1', port=0, output=None):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.server.settimeout(0.2)
+        self.address = self.server.getsockname()
+        self.output = open(output, 'a', encoding='utf-8') if output else None
+        self.seen = set()
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.last_event = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(timeout=1)
+        self.server.close()
+        if self.output:
+            self.output.close()
+
+    def _serve(self):
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            # Una connessione alla volta, letta fino alla chiusura da parte del relay
+            with conn, conn.makefile('r', encoding='utf-8') as reader:
+                batch = []
+                for line in reader:
+                    if line.strip():
+                        batch.append(json.loads(line))
+                        continue
+                    self._apply(batch)
+                    conn.sendall(b'ok\n')
+                    batch = []
+
+    def _apply(self, batch):
+        for event in batch:
+            if event['idempotency_key'] in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(event['idempotency_key'])
+            # Ordine per aggregato: gli eventi dello stesso aggregato arrivano nell'ordine di scrittura
+            aggregate = (event['aggregate_type'], event['aggregate_id'])
+            if self.last_event.get(aggregate, 0) > event['event_id']:
+                self.out_of_order += 1
+            self.last_event[aggregate] = event['event_id']
+            if self.output:
+                self.output.write(json.dumps(event) + '\n')
+        if self.output:
+            self.output.flush()
+
+
+def _lifecycle_step(cursor, booking_id, xid_before_lock=False):
+    """Porta una prenotazione allo stato successivo insieme a biglietti e pagamenti, in una transazione.
+    Con xid_before_lock la transazione ottiene il txid prima del lock sulla prenotazione, come chi
+    scrive altro prima di toccarla: l'ordine dei txid può allora differire da quello di commit"""
+    cursor.execute("BEGIN")
+    try:
+        if xid_before_lock:
+            cursor.execute("SELECT pg_current_xact_id()")
+        cursor.execute("SELECT status FROM bookings WHERE id = %s FOR UPDATE", (booking_id,))
+        booking_status, ticket_status, payment_status = LIFECYCLE[cursor.fetchone()[0]]
+        cursor.execute("UPDATE bookings SET status = %s, updated_at = now() WHERE id = %s",
+                       (booking_status, booking_id))
+        cursor.execute("""
+            UPDATE tickets SET status = %s, updated_at = now() WHERE booking_id = %s AND status <> %s
+        """, (ticket_status, booking_id, ticket_status))
+        if payment_status:
+            cursor.execute("""
+                UPDATE payments SET status = %s, updated_at = now() WHERE booking_id = %s AND status <> %s
+            """, (payment_status, booking_id, payment_status))
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+def run_workload(db_config, writers, duration, batch_size, poll_interval, crash_every=None, seed=42,
+                 xid_before_lock=False):
+    """Scrittori concorrenti di cambi di stato mentre il relay consegna a un consumer socket locale"""
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    cursor.execute("SELECT id::text FROM bookings ORDER BY id")
+    booking_ids = [row[0] for row in cursor.fetchall()]
+    if not booking_ids:
+        print("⚠️ No bookings found, run generate_seed_data.py first")
+        db_manager.close()
+        return
+
+    # Il relay di prova parte dallo xmin attuale: le transazioni ancora aperte hanno txid >= xmin
+    # e i loro eventi, non ancora visibili, non vengono saltati
+    name = 'workload'
+    cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+    start_position = (cursor.fetchone()[0], 0)
+    cursor.execute("""
+        INSERT INTO outbox_checkpoints (relay_name, last_txid, last_id, delivered, updated_at)
+        VALUES (%s, %s::xid8, %s, 0, now())
+        ON CONFLICT (relay_name) DO UPDATE SET
+            last_txid = EXCLUDED.last_txid, last_id = EXCLUDED.last_id, delivered = 0, updated_at = now()
+    """, (name, *start_position))
+
+    receiver = OutboxReceiver().start()
+    relay_manager = DatabaseManager(db_config)
+    relay_manager.connect()
+    sink = SocketSink(*receiver.address)
+    relay = OutboxRelay(relay_manager.get_cursor(), sink, name, batch_size, crash_every)
+    stop_relay = threading.Event()
+    relay_result = {}
+    relay_thread = threading.Thread(
+        target=lambda: relay_result.update(relay.run(poll_interval, stop=stop_relay))
+    )
+
+    writer_managers = [DatabaseManager(db_config) for _ in range(writers)]
+    for manager in writer_managers:
+        manager.connect()
+    transactions = [0] * writers
+    errors = [0] * writers
+    deadline = time.perf_counter() + duration
+
+    def writer(index, writer_cursor):
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            try:
+                _lifecycle_step(writer_cursor, rng.choice(booking_ids), xid_before_lock)
+                transactions[index] += 1
+            except psycopg2.Error:
+                errors[index] += 1
+
+    print(f"🏁 {writers} writers for {duration:.0f}s, relay batches of {batch_size}"
+          + (f", simulated relay crash every {crash_every} batches" if crash_every else "")
+          + (", txid taken before the booking lock" if xid_before_lock else ""))
+    relay_thread.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=writer, args=(i, m.get_cursor())) for i, m in enumerate(writer_managers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_elapsed = time.perf_counter() - started
+    stop_relay.set()
+    relay_thread.join()
+    drain_elapsed = time.perf_counter() - started
+    sink.close()
+    receiver.stop()
+
+    cursor.execute("""
+        SELECT id FROM outbox_events WHERE (txid, id) > (%s::xid8, %s)
+    """, start_position)
+    written = {f"outbox-{row[0]}" for row in cursor.fetchall()}
+    cursor.execute("DELETE FROM outbox_checkpoints WHERE relay_name = %s", (name,))
+    for manager in writer_managers + [relay_manager, db_manager]:
+        manager.close()
+
+    total_transactions = sum(transactions)
+    print(f"\n✍️ Writers: {total_transactions} transactions ({total_transactions / write_elapsed:.0f}/s), "
+          f"{len(written)} events ({len(written) / write_elapsed:.0f}/s), {sum(errors)} errors")
+    print(f"📈 Relay (drained {drain_elapsed - write_elapsed:.2f}s after the writers stopped)")
+    for key, value in relay_result.items():
+        print(f"   {key}: {value}")
+    missing = len(written - receiver.seen)
+    # Con il lock preso prima del txid l'ordine per aggregato è garantito; altrimenti le inversioni
+    # sono il limite atteso dell'ordinamento per txid e vengono solo contate
+    status = "✓" if missing == 0 and (xid_before_lock or receiver.out_of_order == 0) else "❌"
+    print(f"{status} Consumer: {len(receiver.seen)} unique events, {receiver.duplicates} duplicates discarded, "
+          f"{missing} missing, {receiver.out_of_order} out of order per aggregate")
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix transactional outbox relay")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--relay', action='store_true', help="deliver outbox events to the sink")
+    mode.add_argument('--receive', metavar='HOST:PORT', help="run a local consumer for the socket sink")
+    mode.add_argument('--workload', type=float, metavar='SECONDS', help="concurrent writers + relay + consumer")
+    mode.add_argument('--status', action='store_true', help="show relay checkpoints and backlog")
+    mode.add_argument('--purge', action='store_true', help="delete events delivered to every relay")
+    parser.add_argument('--sink', default='file:outbox_events.jsonl', help="file:PATH or socket:HOST:PORT")
+    parser.add_argument('--name', default=DEFAULT_RELAY, help="relay name (one checkpoint per relay)")
+    parser.add_argument('--batch-size', type=int, default=500, help="events per batch")
+    parser.add_argument('--poll-interval', type=float, default=0.2, help="seconds to wait when the outbox is empty")
+    parser.add_argument('--once', action='store_true', help="with --relay, exit when the outbox is drained")
+    parser.add_argument('--output', help="with --receive, append received events to this file")
+    parser.add_argument('--writers', type=int, default=8, help="with --workload, concurrent writers")
+    parser.add_argument('--crash-every', type=int, help="with --workload, skip a checkpoint every N batches")
+    parser.add_argument('--xid-before-lock', action='store_true',
+                        help="with --workload, writers take their txid before locking the booking")
+    parser.add_argument('--retention-hours', type=float, default=24, help="with --purge, keep this many hours")
+    args = parser.parse_args()
+
+    if args.workload:
+        run_workload(load_db_config(), args.writers, args.workload, args.batch_size, args.poll_interval,
+                     args.crash_every, xid_before_lock=args.xid_before_lock)
+    elif args.receive:
+        host, _, port = args.receive.rpartition(':')
+        receiver = OutboxReceiver(host or '127.0.0.1', int(port), args.output).start()
+        print(f"🔌 Receiving outbox events on {receiver.address[0]}:{receiver.address[1]}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            receiver.stop()
+            print(f"✅ {len(receiver.seen)} unique events, {receiver.duplicates} duplicates discarded")
+    elif args.relay or args.status or args.purge:
+        db_manager = DatabaseManager(load_db_config())
+        db_manager.connect()
+        cursor = db_manager.get_cursor()
+        try:
+            if args.status:
+                print_status(cursor)
+            elif args.purge:
+                deleted = purge_delivered(cursor, timedelta(hours=args.retention_hours))
+                print(f"🗑️ Purged {deleted} delivered events")
+            else:
+                sink = open_sink(args.sink)
+                relay = OutboxRelay(cursor, sink, args.name, args.batch_size)
+                print(f"📤 Relay '{args.name}' delivering to {args.sink}")
+                try:
+                    summary = relay.run(args.poll_interval, once=args.once)
+                except KeyboardInterrupt:
+                    summary = relay.metrics.summary()
+                finally:
+                    sink.close()
+                print("📈 Relay summary")
+                for key, value in summary.items():
+                    print(f"   {key}: {value}")
+        finally:
+            db_manager.close()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
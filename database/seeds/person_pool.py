@@ -0,0 +1,108 @@
+import argparse
+import base64
+import hashlib
+import random
+import time
+import unicodedata
+from array import array
+from faker.providers.internet.it_IT import Provider as InternetProvider
+from faker.providers.person.it_IT import Provider as PersonProvider
+
+# Numero di hash password precalcolati, assegnati a rotazione agli utenti
+PASSWORD_VARIANTS = 64
+PASSWORD_ITERATIONS = 1000
+
+
+class PersonPool:
+    """Pool di persone sintetiche italiane generate per campionamento di indici"""
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+        # Array compatti costruiti una sola volta (deduplicati, ordine stabile)
+        self.first_names = tuple(dict.fromkeys(PersonProvider.first_names))
+        self.last_names = tuple(dict.fromkeys(PersonProvider.last_names))
+        self.domains = tuple(dict.fromkeys(InternetProvider.free_email_domains))
+
+        # Versioni normalizzate per la parte locale delle email
+        self.first_slugs = tuple(_slug(name) for name in self.first_names)
+        self.last_slugs = tuple(_slug(name) for name in self.last_names)
+
+        self.password_hashes = tuple(_hash_placeholder(seed, i) for i in range(PASSWORD_VARIANTS))
+
+    def _words(self, kind, start, count):
+        """Parole casuali a 64 bit deterministiche per (seed, tipo, offset): batch riproducibili e indipendenti"""
+        rng = random.Random(f"{self.seed}:{kind}:{start}")
+        return array('Q', rng.randbytes(8 * count))
+
+    def users(self, count, start=0):
+        """Batch di utenti: colonne (first_name, last_name, email, password)"""
+        return self._compose('u', count, start, with_password=True)
+
+    def passengers(self, count, start=0):
+        """Batch di passeggeri: colonne (first_name, last_name, email)"""
+        return self._compose('p', count, start, with_password=False)
+
+    def _compose(self, kind, count, start, with_password):
+        # Una sola parola casuale per persona, suddivisa in tre campi di bit indipendenti
+        words = self._words(kind, start, count)
+        nf, nl, nd = len(self.first_names), len(self.last_names), len(self.domains)
+        first_idx = [w % nf for w in words]
+        last_idx = [(w >> 21) % nl for w in words]
+        domain_idx = [(w >> 42) % nd for w in words]
+
+        first_names = [self.first_names[i] for i in first_idx]
+        last_names = [self.last_names[i] for i in last_idx]
+
+        # Unicità per costruzione: il suffisso codifica l'indice globale della persona
+        # e gli slug non contengono punti, quindi la parte locale è sempre distinta
+        first_slugs, last_slugs, domains = self.first_slugs, self.last_slugs, self.domains
+        emails = [
+            f"{first_slugs[f]}.{last_slugs[l]}.{kind}{n:x}@{domains[d]}"
+            for n, f, l, d in zip(range(start, start + count), first_idx, last_idx, domain_idx)
+        ]
+
+        if not with_password:
+            return first_names, last_names, emails
+
+        hashes = self.password_hashes
+        passwords = [hashes[(start + n) % PASSWORD_VARIANTS] for n in range(count)]
+        return first_names, last_names, emails, passwords
+
+
+def _slug(name):
+    """Nome senza accenti, apostrofi e spazi, in minuscolo"""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return ''.join(c for c in ascii_name.lower() if c.isalnum())
+
+
+def _hash_placeholder(seed, variant):
+    """Hash PBKDF2 di una password segnaposto, nel formato algoritmo$iterazioni$salt$hash"""
+    salt = hashlib.sha256(f"raylix:{seed}:{variant}".encode()).hexdigest()[:16]
+    digest = hashlib.pbkdf2_hmac('sha256', f"password{variant}".encode(), salt.encode(), PASSWORD_ITERATIONS)
+    return f"pbkdf2_sha256${PASSWORD_ITERATIONS}${salt}${base64.b64encode(digest).decode()}"
+
+
+def main():
+    """Benchmark del pool"""
+    parser = argparse.ArgumentParser(description="Raylix synthetic person pool benchmark")
+    parser.add_argument('--benchmark', type=int, default=1000000, metavar='N', help="persons to generate")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pool = PersonPool(args.seed)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, _, emails, _ = pool.users(args.benchmark)
+    elapsed = time.perf_counter() - start
+
+    print(f"🧑 Pool built in {build_time * 1000:.1f} ms "
+          f"({len(pool.first_names)} first names, {len(pool.last_names)} last names, {len(pool.domains)} domains)")
+    print(f"⏱️ {args.benchmark} users in {elapsed:.2f}s ({args.benchmark / elapsed:,.0f} persons/sec)")
+    print(f"✓ Unique emails: {len(set(emails)) == len(emails)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from psycopg2 import sql
+
+from instrumentation import InstrumentedCursor
+
+
+class GenerationPhase:
+    """Fase della generazione con le tabelle che legge (requires) e che scrive (writes).
+    `run(cursor, rng, state)` riceve la connessione del worker, un RNG proprio della fase e lo stato
+    condiviso della run; `same_run` elenca le fasi che le passano dati in memoria"""
+
+    def __init__(self, name, run, requires=(), writes=(), same_run=(), default=True):
+        self.name = name
+        self.run = run
+        self.requires = tuple(requires)
+        self.writes = tuple(writes)
+        self.same_run = tuple(same_run)
+        self.default = default
+
+
+class PhaseGraph:
+    """DAG delle fasi: una fase dipende da quelle che scrivono le tabelle che legge"""
+
+    def __init__(self, phases):
+        self.phases = {phase.name: phase for phase in phases}
+        self.writers = {table: phase.name for phase in phases for table in phase.writes}
+        self.upstream = {}
+        for phase in phases:
+            upstream = {self.writers[t] for t in phase.requires if t in self.writers} | set(phase.same_run)
+            upstream.discard(phase.name)
+            self.upstream[phase.name] = [name for name in self.phases if name in upstream]
+
+    def select(self, only=None, skip=None):
+        """Fasi da eseguire in ordine di dichiarazione. Con `only` si aggiungono le fasi a valle,
+        i cui dati verrebbero cancellati insieme a quelli rigenerati; `skip` le toglie comunque"""
+        unknown = [name for name in (only or []) + (skip or []) if name not in self.phases]
+        if unknown:
+            raise ValueError(f"unknown phases: {', '.join(unknown)} (available: {', '.join(self.phases)})")
+
+        if only:
+            selected = set(only)
+            changed = True
+            while changed:
+                changed = False
+                for name, phase in self.phases.items():
+                    if name not in selected and phase.default and selected & set(self.upstream[name]):
+                        selected.add(name)
+                        changed = True
+        else:
+            selected = {name for name, phase in self.phases.items() if phase.default}
+        selected -= set(skip or [])
+
+        for name in selected:
+            for dependency in self.phases[name].same_run:
+                if dependency not in selected:
+                    raise ValueError(f"phase '{name}' needs '{dependency}' in the same run (data passed in memory)")
+        return [name for name in self.phases if name in selected]
+
+    def tables(self, selected):
+        """Tabelle scritte dalle fasi selezionate"""
+        return [table for name in selected for table in self.phases[name].writes]
+
+    def missing_upstream(self, cursor, selected):
+        """Tabelle lette dalle fasi selezionate, non rigenerate nella run e vuote"""
+        written = set(self.tables(selected))
+        needed = {}
+        for name in selected:
+            for table in self.phases[name].requires:
+                if table not in written:
+                    needed.setdefault(table, []).append(name)
+
+        missing = []
+        for table, phases in needed.items():
+            cursor.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(sql.Identifier(table)))
+            if not cursor.fetchone()[0]:
+                missing.append(f"{table} (read by {', '.join(phases)}, written by {self.writers.get(table, '?')})")
+        return missing
+
+    def critical_path(self, timings):
+        """Catena che ha determinato la durata: dalla fase finita per ultima si risale ogni volta
+        alla fase a monte finita per ultima"""
+        name = max(timings, key=lambda n: timings[n][1])
+        path = [name]
+        while True:
+            upstream = [u for u in self.upstream[name] if u in timings]
+            if not upstream:
+                return path[::-1]
+            name = max(upstream, key=lambda u: timings[u][1])
+            path.append(name)
+
+
+class PhaseScheduler:
+    """Esegue le fasi appena quelle a monte sono concluse, fino a `jobs` in parallelo,
+    ognuna sulla connessione del proprio worker"""
+
+    def __init__(self, graph, connect, instrumentation, jobs=4, seed=None):
+        self.graph = graph
+        self.connect = connect
+        self.instrumentation = instrumentation
+        self.jobs = jobs
+        self.seed = seed
+        self.timings = {}
+        self.elapsed = 0.0
+        self._local = threading.local()
+        self._managers = []
+        self._lock = threading.Lock()
+
+    def run(self, selected, state=None):
+        """Esegue le fasi selezionate; un errore ferma l'avvio di nuove fasi e viene rilanciato"""
+        state = {} if state is None else state
+        pending = {name: {u for u in self.graph.upstream[name] if u in selected} for name in selected}
+        done, running = set(), {}
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='phase') as pool:
+                while pending or running:
+                    for name in [n for n in selected if n in pending and pending[n] <= done]:
+                        del pending[name]
+                        running[pool.submit(self._run_phase, name, state, started)] = name
+                    if not running:
+                        raise RuntimeError(f"dependency cycle between phases: {', '.join(pending)}")
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        self.timings[name] = future.result()
+                        done.add(name)
+        finally:
+            self.elapsed = time.perf_counter() - started
+            for manager in self._managers:
+                manager.close()
+        return state
+
+    def _run_phase(self, name, state, started):
+        cursor = self._cursor()
+        # RNG per fase: con un seed la generazione resta riproducibile anche con fasi in parallelo
+        rng = random.Random(f"{self.seed}:{name}") if self.seed is not None else random.Random()
+        start = time.perf_counter() - started
+        with self.instrumentation.phase(name):
+            self.graph.phases[name].run(cursor, rng, state)
+        return start, time.perf_counter() - started
+
+    def _cursor(self):
+        """Cursor del worker corrente, con connessione e contatori propri"""
+        if not hasattr(self._local, 'cursor'):
+            manager = self.connect()
+            with self._lock:
+                self._managers.append(manager)
+            self.instrumentation.bind_thread()
+            self._local.cursor = self.instrumentation.track(manager.get_cursor(InstrumentedCursor))
+        return self._local.cursor
+
+    def report(self):
+        """Tempi di inizio e fine per fase e cammino critico, come dizionario serializzabile"""
+        if not self.timings:
+            return None
+        return {
+            'jobs': self.jobs,
+            'elapsed_s': round(self.elapsed, 4),
+            'critical_path': self.graph.critical_path(self.timings),
+            'phases': {
+                name: {'start_s': round(start, 4), 'end_s': round(end, 4)}
+                for name, (start, end) in self.timings.items()
+            }
+        }
+
+    def print_summary(self):
+        """Stampa la timeline delle fasi (★ = cammino critico) e il riepilogo del cammino critico"""
+        if not self.timings:
+            return
+        path = self.graph.critical_path(self.timings)
+        busy = sum(end - start for start, end in self.timings.values())
+        print(f"🧭 Schedule ({self.jobs} jobs): {self.elapsed:.2f}s elapsed, {busy:.2f}s of phase time "
+              f"({busy / self.elapsed:.1f}× parallel)")
+        print(f"     {'phase':<20}{'start s':>9}{'end s':>9}{'wall s':>9}")
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1]):
+            marker = '★' if name in path else ' '
+            print(f"   {marker} {name:<20}{start:>9.2f}{end:>9.2f}{end - start:>9.2f}")
+
+        # Attesa sul cammino critico: fase pronta ma senza worker libero
+        work = sum(self.timings[n][1] - self.timings[n][0] for n in path)
+        print(f"   critical path: {' → '.join(path)}")
+        print(f"   {work:.2f}s of work, {self.timings[path[-1]][1] - work:.2f}s waiting for a free worker or startup")
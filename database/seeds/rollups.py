@@ -0,0 +1,410 @@
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+
+# Una fermata è puntuale con ritardo fino a 5 minuti
+PUNCTUALITY_THRESHOLD_MIN = 5
+# I refresh rileggono le modifiche degli ultimi minuti prima del watermark: copre le transazioni
+# ancora aperte al refresh precedente e gli updated_at impostati dall'orologio dei client.
+# Il ricalcolo di un gruppo è idempotente, rileggerlo non cambia il risultato
+DEFAULT_OVERLAP = timedelta(minutes=5)
+
+
+class Rollup:
+    """Definizione di un aggregato: tabella, chiave di gruppo, query di ricalcolo e di modifica
+
+    recompute_sql calcola le righe della tabella per i gruppi che soddisfano {scope};
+    changes_sql restituisce i gruppi toccati da righe sorgente con updated_at > %(since)s.
+    """
+
+    def __init__(self, name, table, columns, primary_key, group_key, key_types, scope_columns,
+                 recompute_sql, changes_sql, sources, complete_history=True):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.primary_key = primary_key
+        self.group_key = group_key
+        self.key_types = key_types
+        self.scope_columns = scope_columns
+        self.recompute_sql = recompute_sql
+        self.changes_sql = changes_sql
+        self.sources = sources
+        # Le sorgenti includono lo storico archiviato: un backfill può riscrivere l'intera tabella
+        self.complete_history = complete_history
+
+    def key_params(self, keys):
+        """Chiavi di gruppo come array paralleli, uno per colonna"""
+        return {f'key{i}': list(column) for i, column in enumerate(zip(*keys))}
+
+    def key_set(self):
+        """Sottoquery con l'insieme di chiavi passate come array paralleli"""
+        arrays = ', '.join(f'%(key{i})s::{key_type}[]' for i, key_type in enumerate(self.key_types))
+        return f"SELECT * FROM unnest({arrays})"
+
+    def recompute(self, scope='TRUE'):
+        return self.recompute_sql.format(scope=scope)
+
+    def scoped_recompute(self):
+        return self.recompute(f"({self.scope_columns}) IN ({self.key_set()})")
+
+
+ROUTE_REVENUE = Rollup(
+    name='route_revenue_daily',
+    table='rollup_route_revenue_daily',
+    columns=['route_id', 'service_date', 'currency', 'paid_segments', 'revenue', 'refunded_amount',
+             'tickets_issued', 'tickets_canceled', 'updated_at'],
+    primary_key=['route_id', 'service_date', 'currency'],
+    group_key=['route_id', 'service_date'],
+    key_types=['uuid', 'date'],
+    scope_columns='ts.route_id, t.service_date',
+    recompute_sql="""
+        SELECT ts.route_id, t.service_date, b.currency,
+               COUNT(*) FILTER (WHERE pay.paid),
+               COALESCE(SUM(bs.segment_amount) FILTER (WHERE pay.paid), 0),
+               COALESCE(SUM(bs.segment_amount) FILTER (WHERE pay.refunded), 0),
+               COUNT(tk.id) FILTER (WHERE tk.status IN ('VALID', 'USED')),
+               COUNT(tk.id) FILTER (WHERE tk.status IN ('CANCELED', 'REFUNDED')),
+               now()
+        FROM all_trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN all_booking_segments bs ON bs.trip_id = t.id
+        JOIN all_bookings b ON bs.booking_id = b.id
+        LEFT JOIN all_tickets tk ON tk.booking_segment_id = bs.id
+        LEFT JOIN LATERAL (
+            SELECT bool_or(p.status = 'COMPLETED') AS paid, bool_or(p.status = 'REFUNDED') AS refunded
+            FROM all_payments p
+            WHERE p.booking_id = b.id
+        ) pay ON true
+        WHERE {scope}
+        GROUP BY ts.route_id, t.service_date, b.currency
+    """,
+    changes_sql="""
+        SELECT DISTINCT ts.route_id, t.service_date
+        FROM (
+            SELECT bs.trip_id FROM payments p
+            JOIN booking_segments bs ON bs.booking_id = p.booking_id
+            WHERE p.updated_at > %(since)s
+            UNION
+            SELECT trip_id FROM tickets WHERE updated_at > %(since)s
+        ) changed
+        JOIN trips t ON t.id = changed.trip_id
+        JOIN train_services ts ON t.train_service_id = ts.id
+    """,
+    sources=['payments', 'tickets'],
+)
+
+# Calcolato dai contatori per leg (trip_leg_availability), che esistono solo per i viaggi
+# non archiviati: le righe dei viaggi archiviati restano quelle dell'ultimo refresh
+TRIP_LOAD_FACTOR = Rollup(
+    name='trip_load_factor',
+    table='rollup_trip_load_factor',
+    columns=['trip_id', 'wagon_category_id', 'service_date', 'route_id', 'operator_id',
+             'seat_legs_total', 'seat_legs_reserved', 'tickets_valid', 'updated_at'],
+    primary_key=['trip_id', 'wagon_category_id'],
+    group_key=['trip_id'],
+    key_types=['uuid'],
+    scope_columns='a.trip_id',
+    recompute_sql="""
+        SELECT a.trip_id, a.wagon_category_id, t.service_date, ts.route_id, ts.operator_id,
+               SUM(a.total_seats), SUM(a.total_seats - a.available_seats),
+               (SELECT COUNT(*) FROM tickets tk
+                WHERE tk.trip_id = a.trip_id AND tk.wagon_category_id = a.wagon_category_id
+                  AND tk.status IN ('VALID', 'USED')),
+               now()
+        FROM trip_leg_availability a
+        JOIN trips t ON a.trip_id = t.id
+        JOIN train_services ts ON t.train_service_id = ts.id
+        WHERE {scope}
+        GROUP BY a.trip_id, a.wagon_category_id, t.service_date, ts.route_id, ts.operator_id
+    """,
+    changes_sql="""
+        SELECT changed.trip_id
+        FROM (
+            SELECT trip_id FROM trip_leg_availability WHERE updated_at > %(since)s
+            UNION
+            SELECT trip_id FROM tickets WHERE updated_at > %(since)s
+        ) changed
+        WHERE EXISTS (SELECT 1 FROM trip_leg_availability a WHERE a.trip_id = changed.trip_id)
+    """,
+    sources=['trip_leg_availability', 'tickets'],
+    complete_history=False,
+)
+
+OPERATOR_PUNCTUALITY = Rollup(
+    name='operator_punctuality_daily',
+    table='rollup_operator_punctuality_daily',
+    columns=['operator_id', 'service_date', 'trips_observed', 'stops_observed', 'stops_on_time',
+             'total_delay_minutes', 'max_delay_minutes', 'updated_at'],
+    primary_key=['operator_id', 'service_date'],
+    group_key=['operator_id', 'service_date'],
+    key_types=['uuid', 'date'],
+    scope_columns='ts.operator_id, t.service_date',
+    recompute_sql=f"""
+        SELECT ts.operator_id, t.service_date,
+               COUNT(DISTINCT u.trip_id), COUNT(*),
+               COUNT(*) FILTER (WHERE COALESCE(u.delay_minutes, 0) <= {PUNCTUALITY_THRESHOLD_MIN}),
+               COALESCE(SUM(GREATEST(u.delay_minutes, 0)), 0),
+               COALESCE(MAX(GREATEST(u.delay_minutes, 0)), 0),
+               now()
+        FROM all_trip_station_updates u
+        JOIN all_trips t ON u.trip_id = t.id
+        JOIN train_services ts ON t.train_service_id = ts.id
+        WHERE (u.actual_arrival IS NOT NULL OR u.actual_departure IS NOT NULL)
+          AND ts.operator_id IS NOT NULL AND {{scope}}
+        GROUP BY ts.operator_id, t.service_date
+    """,
+    changes_sql="""
+        SELECT DISTINCT ts.operator_id, t.service_date
+        FROM trip_station_updates u
+        JOIN trips t ON u.trip_id = t.id
+        JOIN train_services ts ON t.train_service_id = ts.id
+        WHERE u.updated_at > %(since)s AND ts.operator_id IS NOT NULL
+    """,
+    sources=['trip_station_updates'],
+)
+
+ROLLUPS = [ROUTE_REVENUE, TRIP_LOAD_FACTOR, OPERATOR_PUNCTUALITY]
+
+
+class RollupRefresher:
+    """Mantiene i rollup ricalcolando solo i gruppi modificati dopo il watermark"""
+
+    def __init__(self, cursor, rollups=ROLLUPS, overlap=DEFAULT_OVERLAP):
+        self.cursor = cursor
+        self.rollups = rollups
+        self.overlap = overlap
+
+    def _watermark(self, rollup):
+        self.cursor.execute("SELECT high_water FROM rollup_watermarks WHERE rollup_name = %s", (rollup.name,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def _high_water(self, rollup):
+        """Ultimo updated_at delle sorgenti, letto prima delle modifiche così nessuna va persa"""
+        maxima = ', '.join(f"(SELECT MAX(updated_at) FROM {source})" for source in rollup.sources)
+        self.cursor.execute(f"SELECT GREATEST({maxima})")
+        return self.cursor.fetchone()[0]
+
+    def _save_watermark(self, rollup, high_water, groups):
+        self.cursor.execute("""
+            INSERT INTO rollup_watermarks (rollup_name, high_water, groups_refreshed, refreshed_at)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (rollup_name) DO UPDATE SET
+                high_water = GREATEST(rollup_watermarks.high_water, EXCLUDED.high_water),
+                groups_refreshed = EXCLUDED.groups_refreshed,
+                refreshed_at = EXCLUDED.refreshed_at
+        """, (rollup.name, high_water, groups))
+
+    def refresh(self):
+        """Refresh incrementale di tutti i rollup; senza watermark esegue il backfill"""
+        return {rollup.name: self.refresh_rollup(rollup) for rollup in self.rollups}
+
+    def refresh_rollup(self, rollup):
+        """Ricalcola i gruppi toccati dal watermark in poi; restituisce il numero di gruppi"""
+        watermark = self._watermark(rollup)
+        if watermark is None:
+            return self.backfill_rollup(rollup)
+
+        high_water = self._high_water(rollup)
+        self.cursor.execute(rollup.changes_sql, {'since': watermark - self.overlap})
+        keys = self.cursor.fetchall()
+        key_columns = ', '.join(rollup.group_key)
+        self.cursor.execute("BEGIN")
+        try:
+            if keys:
+                params = rollup.key_params(keys)
+                self.cursor.execute(f"DELETE FROM {rollup.table} WHERE ({key_columns}) IN ({rollup.key_set()})", params)
+                self.cursor.execute(
+                    f"INSERT INTO {rollup.table} ({', '.join(rollup.columns)}) {rollup.scoped_recompute()}", params
+                )
+            self._save_watermark(rollup, high_water or watermark, len(keys))
+            self.cursor.execute("COMMIT")
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+        return len(keys)
+
+    def backfill(self):
+        """Ricostruisce tutti i rollup dai dati sorgente (anche archiviati) e imposta i watermark"""
+        return {rollup.name: self.backfill_rollup(rollup) for rollup in self.rollups}
+
+    def backfill_rollup(self, rollup):
+        high_water = self._high_water(rollup)
+        key_columns = ', '.join(rollup.group_key)
+        value_columns = [column for column in rollup.columns if column not in rollup.primary_key]
+        self.cursor.execute("BEGIN")
+        try:
+            if rollup.complete_history:
+                self.cursor.execute(f"DELETE FROM {rollup.table}")
+            self.cursor.execute(f"""
+                INSERT INTO {rollup.table} ({', '.join(rollup.columns)}) {rollup.recompute()}
+                ON CONFLICT ({', '.join(rollup.primary_key)}) DO UPDATE SET
+                    {', '.join(f'{column} = EXCLUDED.{column}' for column in value_columns)}
+            """)
+            self.cursor.execute(f"SELECT COUNT(DISTINCT ({key_columns})) FROM {rollup.table}")
+            groups = self.cursor.fetchone()[0]
+            if high_water is not None:
+                self._save_watermark(rollup, high_water, groups)
+            self.cursor.execute("COMMIT")
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+        return groups
+
+    def verify(self):
+        """Righe dei rollup diverse da un ricalcolo completo (per rollup)"""
+        results = {}
+        for rollup in self.rollups:
+            columns = ', '.join(column for column in rollup.columns if column != 'updated_at')
+            stored = f"SELECT {columns} FROM {rollup.table}"
+            if not rollup.complete_history:
+                stored += " r WHERE EXISTS (SELECT 1 FROM trip_leg_availability a WHERE a.trip_id = r.trip_id)"
+            expected = f"SELECT {columns} FROM ({rollup.recompute()}) r ({', '.join(rollup.columns)})"
+            self.cursor.execute(f"""
+                SELECT COUNT(*) FROM (
+                    ({expected} EXCEPT ALL {stored})
+                    UNION ALL
+                    ({stored} EXCEPT ALL {expected})
+                ) diff
+            """)
+            results[rollup.name] = self.cursor.fetchone()[0]
+        return results
+
+
+def route_revenue(cursor, date_from, date_to, limit=20):
+    """Ricavi per rotta nel periodo, ordinati per ricavo"""
+    cursor.execute("""
+        SELECT r.name, rr.currency, SUM(rr.revenue), SUM(rr.refunded_amount),
+               SUM(rr.paid_segments), SUM(rr.tickets_issued), SUM(rr.tickets_canceled)
+        FROM rollup_route_revenue_daily rr
+        LEFT JOIN routes r ON r.id = rr.route_id
+        WHERE rr.service_date BETWEEN %s AND %s
+        GROUP BY r.name, rr.currency
+        ORDER BY SUM(rr.revenue) DESC
+        LIMIT %s
+    """, (date_from, date_to, limit))
+    return cursor.fetchall()
+
+
+def trip_load_factors(cursor, service_date, route_id=None):
+    """Riempimento per viaggio e categoria vagone in un giorno di servizio"""
+    cursor.execute("""
+        SELECT lf.trip_id, lf.route_id, wc.name, lf.seat_legs_reserved::NUMERIC / NULLIF(lf.seat_legs_total, 0),
+               lf.tickets_valid
+        FROM rollup_trip_load_factor lf
+        LEFT JOIN wagon_categories wc ON wc.id = lf.wagon_category_id
+        WHERE lf.service_date = %s AND (%s::uuid IS NULL OR lf.route_id = %s::uuid)
+        ORDER BY 4 DESC NULLS LAST
+    """, (service_date, route_id, route_id))
+    return cursor.fetchall()
+
+
+def operator_punctuality(cursor, date_from, date_to):
+    """Puntualità per operatore nel periodo: quota fermate puntuali, ritardo medio e massimo"""
+    cursor.execute("""
+        SELECT o.name, SUM(p.trips_observed),
+               SUM(p.stops_on_time)::NUMERIC / NULLIF(SUM(p.stops_observed), 0),
+               SUM(p.total_delay_minutes)::NUMERIC / NULLIF(SUM(p.stops_observed), 0),
+               MAX(p.max_delay_minutes)
+        FROM rollup_operator_punctuality_daily p
+        LEFT JOIN railway_operators o ON o.id = p.operator_id
+        WHERE p.service_date BETWEEN %s AND %s
+        GROUP BY o.name
+        ORDER BY 3 DESC NULLS LAST
+    """, (date_from, date_to))
+    return cursor.fetchall()
+
+
+def _timed(samples, label, function, *args):
+    start = time.perf_counter()
+    function(*args)
+    samples.setdefault(label, []).append(time.perf_counter() - start)
+
+
+def _ad_hoc(cursor, rollup, scope, params):
+    """Lo stesso aggregato calcolato al volo dai dati sorgente, come farebbe una dashboard senza rollup"""
+    cursor.execute(rollup.recompute(scope), params)
+    cursor.fetchall()
+
+
+def run_benchmark(cursor, rounds):
+    """Latenza delle query dashboard: rollup contro calcolo al volo sulle tabelle OLTP"""
+    today = date.today()
+    date_from, date_to = today - timedelta(days=30), today + timedelta(days=30)
+    period = {'date_from': date_from, 'date_to': date_to}
+    samples = {}
+    for _ in range(rounds):
+        _timed(samples, 'revenue (rollup)', route_revenue, cursor, date_from, date_to)
+        _timed(samples, 'revenue (ad hoc)', _ad_hoc, cursor, ROUTE_REVENUE,
+               "t.service_date BETWEEN %(date_from)s AND %(date_to)s", period)
+        _timed(samples, 'load factor (rollup)', trip_load_factors, cursor, today + timedelta(days=1))
+        _timed(samples, 'load factor (ad hoc)', _ad_hoc, cursor, TRIP_LOAD_FACTOR,
+               "t.service_date = %(service_date)s", {'service_date': today + timedelta(days=1)})
+        _timed(samples, 'punctuality (rollup)', operator_punctuality, cursor, date_from, today)
+        _timed(samples, 'punctuality (ad hoc)', _ad_hoc, cursor, OPERATOR_PUNCTUALITY,
+               "t.service_date BETWEEN %(date_from)s AND %(date_to)s", period)
+    print(f"⏱️ {rounds} rounds, period {date_from} → {date_to}")
+    for label, values in samples.items():
+        print(f"   {label:<22} p50: {statistics.median(values) * 1000:8.2f} ms  max: {max(values) * 1000:8.2f} ms")
+
+
+def simulate_changes(cursor, count):
+    """Applica `count` modifiche per tipo come il traffico OLTP: pagamenti completati o rimborsati,
+    ticket cancellati, ritardi aggiornati. Altera i dati: solo per dataset di test"""
+    cursor.execute("""
+        UPDATE payments SET status = (CASE WHEN status = 'COMPLETED' THEN 'REFUNDED' ELSE 'COMPLETED' END)::payment_status,
+                            updated_at = now()
+        WHERE id IN (SELECT id FROM payments ORDER BY random() LIMIT %s)
+    """, (count,))
+    cursor.execute("""
+        UPDATE tickets SET status = 'CANCELED', updated_at = now()
+        WHERE id IN (SELECT id FROM tickets WHERE status = 'VALID' ORDER BY random() LIMIT %s)
+    """, (count,))
+    cursor.execute("""
+        UPDATE trip_station_updates SET delay_minutes = COALESCE(delay_minutes, 0) + 3, updated_at = now()
+        WHERE id IN (SELECT id FROM trip_station_updates WHERE actual_arrival IS NOT NULL ORDER BY random() LIMIT %s)
+    """, (count,))
+
+
+def main():
+    """Entry point"""
+    # Import locale: generate_seed_data importa questo modulo per il backfill dopo la generazione
+    from generate_seed_data import DatabaseManager, load_db_config
+
+    parser = argparse.ArgumentParser(description="Raylix incremental analytics rollups")
+    parser.add_argument('--backfill', action='store_true', help="rebuild all rollups from the source tables")
+    parser.add_argument('--verify', action='store_true', help="compare rollups with a full recompute")
+    parser.add_argument('--simulate', type=int, metavar='N', help="apply N changes per kind before refreshing")
+    parser.add_argument('--benchmark', type=int, metavar='ROUNDS', help="time dashboard queries")
+    parser.add_argument('--overlap-minutes', type=float, default=DEFAULT_OVERLAP.total_seconds() / 60,
+                        help="re-read window before the watermark")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(load_db_config())
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    refresher = RollupRefresher(cursor, overlap=timedelta(minutes=args.overlap_minutes))
+    try:
+        if args.simulate:
+            simulate_changes(cursor, args.simulate)
+            print(f"🔧 Applied {args.simulate} payment, ticket and delay changes")
+
+        start = time.perf_counter()
+        groups = refresher.backfill() if args.backfill else refresher.refresh()
+        mode = "Backfilled" if args.backfill else "Refreshed"
+        print(f"📈 {mode} rollups in {time.perf_counter() - start:.2f}s")
+        for name, count in groups.items():
+            print(f"   {name:<28} {count} groups")
+
+        if args.verify:
+            for name, diff in refresher.verify().items():
+                print(f"   {'✓' if diff == 0 else '❌'} {name}: {diff} rows differ from a full recompute")
+        if args.benchmark:
+            run_benchmark(cursor, args.benchmark)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+import argparse
+import json
+import random
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from generate_seed_data import DatabaseManager, load_db_config
+
+INVALIDATION_CHANNEL = 'trip_search_invalidation'
+
+# Versione parametrica di database/queries/find_direct_trips.sql
+DIRECT_TRIPS_SQL = """
+    SELECT
+        t.id AS trip_id,
+        planned.departure_time,
+        planned.arrival_time,
+        st_from.name AS origin_station,
+        st_to.name AS destination_station,
+        ts.service_name,
+        ro.name AS operator,
+        stype.name AS service_type,
+        t.status
+    FROM trips t
+    JOIN train_services ts ON t.train_service_id = ts.id
+    JOIN railway_operators ro ON ts.operator_id = ro.id
+    JOIN service_types stype ON ts.service_type_id = stype.id
+    JOIN route_stations rs_from ON ts.route_id = rs_from.route_id
+    JOIN route_stations rs_to ON ts.route_id = rs_to.route_id
+        AND rs_from.sequence < rs_to.sequence
+    JOIN stations st_from ON rs_from.station_id = st_from.id
+    JOIN stations st_to ON rs_to.station_id = st_to.id
+    LEFT JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id AND tsu_from.route_station_id = rs_from.id
+    LEFT JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id AND tsu_to.route_station_id = rs_to.id
+    CROSS JOIN LATERAL (SELECT
+        COALESCE(tsu_from.planned_departure, t.planned_departure_time + rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+        COALESCE(tsu_to.planned_arrival, t.planned_departure_time + rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+    ) planned
+    WHERE
+        rs_from.station_id = %(origin)s
+        AND rs_to.station_id = %(destination)s
+        AND t.service_date = %(service_date)s
+        AND t.status IN ('SCHEDULED', 'RUNNING')
+    ORDER BY departure_time ASC
+"""
+
+# Versione parametrica di database/queries/find_trip_paths.sql (max_changes cambi)
+TRIP_PATHS_SQL = """
+    WITH RECURSIVE trip_paths AS (
+        SELECT
+            ARRAY[t.id] AS trip_ids,
+            ARRAY[rs_to.station_id] AS visited_station_ids,
+            rs_to.station_id AS last_station_id,
+            planned.arrival_time AS last_arrival_time,
+            0 AS changes,
+            ARRAY[st_from.name] AS segment_origins,
+            ARRAY[st_to.name] AS segment_destinations,
+            ARRAY[planned.departure_time] AS segment_departures,
+            ARRAY[planned.arrival_time] AS segment_arrivals,
+            ARRAY[ro.name] AS segment_operators,
+            ARRAY[stype.name] AS segment_service_types
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN railway_operators ro ON ts.operator_id = ro.id
+        JOIN service_types stype ON ts.service_type_id = stype.id
+        JOIN route_stations rs_from ON ts.route_id = rs_from.route_id
+        JOIN route_stations rs_to ON ts.route_id = rs_to.route_id AND rs_from.sequence < rs_to.sequence
+        JOIN stations st_from ON rs_from.station_id = st_from.id
+        JOIN stations st_to ON rs_to.station_id = st_to.id
+        LEFT JOIN trip_station_updates tsu_from ON tsu_from.trip_id = t.id AND tsu_from.route_station_id = rs_from.id
+        LEFT JOIN trip_station_updates tsu_to ON tsu_to.trip_id = t.id AND tsu_to.route_station_id = rs_to.id
+        CROSS JOIN LATERAL (SELECT
+            COALESCE(tsu_from.planned_departure, t.planned_departure_time + rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+            COALESCE(tsu_to.planned_arrival, t.planned_departure_time + rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+        ) planned
+        WHERE
+            rs_from.station_id = %(origin)s
+            AND t.service_date = %(service_date)s
+            AND t.status IN ('SCHEDULED', 'RUNNING')
+
+        UNION ALL
+
+        SELECT
+            tp.trip_ids || next_trip.id,
+            tp.visited_station_ids || next_rs_to.station_id,
+            next_rs_to.station_id,
+            next_planned.arrival_time,
+            tp.changes + 1,
+            tp.segment_origins || next_st_from.name,
+            tp.segment_destinations || next_st_to.name,
+            tp.segment_departures || next_planned.departure_time,
+            tp.segment_arrivals || next_planned.arrival_time,
+            tp.segment_operators || next_ro.name,
+            tp.segment_service_types || next_stype.name
+        FROM trip_paths tp
+        JOIN trips next_trip ON next_trip.service_date = %(service_date)s AND next_trip.status IN ('SCHEDULED', 'RUNNING')
+        JOIN train_services next_ts ON next_trip.train_service_id = next_ts.id
+        JOIN railway_operators next_ro ON next_ts.operator_id = next_ro.id
+        JOIN service_types next_stype ON next_ts.service_type_id = next_stype.id
+        JOIN route_stations next_rs_from ON next_ts.route_id = next_rs_from.route_id
+        JOIN route_stations next_rs_to ON next_ts.route_id = next_rs_to.route_id AND next_rs_from.sequence < next_rs_to.sequence
+        JOIN stations next_st_from ON next_rs_from.station_id = next_st_from.id
+        JOIN stations next_st_to ON next_rs_to.station_id = next_st_to.id
+        LEFT JOIN trip_station_updates next_tsu_from ON next_tsu_from.trip_id = next_trip.id AND next_tsu_from.route_station_id = next_rs_from.id
+        LEFT JOIN trip_station_updates next_tsu_to ON next_tsu_to.trip_id = next_trip.id AND next_tsu_to.route_station_id = next_rs_to.id
+        CROSS JOIN LATERAL (SELECT
+            COALESCE(next_tsu_from.planned_departure, next_trip.planned_departure_time + next_rs_from.departure_offset_min * INTERVAL '1 minute') AS departure_time,
+            COALESCE(next_tsu_to.planned_arrival, next_trip.planned_departure_time + next_rs_to.arrival_offset_min * INTERVAL '1 minute') AS arrival_time
+        ) next_planned
+        WHERE
+            next_rs_from.station_id = tp.last_station_id
+            AND next_planned.departure_time > tp.last_arrival_time + INTERVAL '20 minutes'
+            AND tp.changes < %(max_changes)s
+            AND NOT (next_rs_to.station_id = ANY(tp.visited_station_ids))
+            AND next_planned.departure_time < tp.segment_departures[1] + INTERVAL '6 hours'
+    )
+    SELECT
+        trip_ids, segment_origins, segment_destinations, segment_departures, segment_arrivals,
+        segment_operators, segment_service_types, changes, ARRAY_LENGTH(trip_ids, 1) AS segments
+    FROM trip_paths
+    WHERE last_station_id = %(destination)s
+    ORDER BY segment_departures[1] ASC, changes ASC, segment_arrivals[array_length(segment_arrivals, 1)] ASC
+    LIMIT 50
+"""
+
+
+def run_search(cursor, origin, destination, service_date, max_changes=0):
+    """Esegue la ricerca sul database: diretti se max_changes = 0, altrimenti itinerari con cambi"""
+    params = {
+        'origin': origin, 'destination': destination,
+        'service_date': service_date, 'max_changes': max_changes
+    }
+    cursor.execute(DIRECT_TRIPS_SQL if max_changes == 0 else TRIP_PATHS_SQL, params)
+    return cursor.fetchall()
+
+
+class RouteGraph:
+    """Grafo statico stazioni-rotte per calcolare quali ricerche può toccare un viaggio"""
+
+    def __init__(self, cursor):
+        cursor.execute("SELECT route_id, station_id FROM route_stations")
+        self.route_stations = {}
+        self.station_routes = {}
+        for route_id, station_id in cursor.fetchall():
+            route_id, station_id = str(route_id), str(station_id)
+            self.route_stations.setdefault(route_id, set()).add(station_id)
+            self.station_routes.setdefault(station_id, set()).add(route_id)
+
+    def reach(self, station_id, hops):
+        """Stazioni raggiungibili con al massimo `hops` corse (in entrambe le direzioni: soprainsieme)"""
+        reached = {station_id}
+        frontier = {station_id}
+        for _ in range(hops):
+            routes = set().union(*(self.station_routes.get(s, ()) for s in frontier))
+            stations = set().union(*(self.route_stations[r] for r in routes)) if routes else set()
+            frontier = stations - reached
+            reached |= frontier
+            if not frontier:
+                break
+        return reached
+
+
+class SearchCacheMetrics:
+    """Hit ratio, invalidazioni e staleness della cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lru_evictions = 0
+        self.notifications = 0
+        self.invalidated_keys = 0
+        self.discarded_results = 0
+        self.hit_ages = []
+        self.notification_lags = []
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        ages = sorted(self.hit_ages)
+        lags = sorted(self.notification_lags)
+        return {
+            'lookups': lookups,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'lru_evictions': self.lru_evictions,
+            'notifications': self.notifications,
+            'invalidated_keys': self.invalidated_keys,
+            'discarded_results': self.discarded_results,
+            'hit_age_p50_s': round(ages[len(ages) // 2], 3) if ages else 0.0,
+            'hit_age_max_s': round(ages[-1], 3) if ages else 0.0,
+            'notification_lag_p50_ms': round(lags[len(lags) // 2] * 1000, 1) if lags else 0.0,
+            'notification_lag_max_ms': round(lags[-1] * 1000, 1) if lags else 0.0
+        }
+
+
+class SearchCache:
+    """Cache LRU dei risultati di ricerca con invalidazione puntuale via LISTEN/NOTIFY
+
+    Una chiave (origine, destinazione, data, max_changes) viene invalidata da un viaggio
+    della stessa data solo se la sua rotta tocca sia le stazioni raggiungibili dall'origine
+    sia quelle che raggiungono la destinazione entro max_changes corse: per le ricerche
+    dirette significa che la rotta contiene entrambe le stazioni.
+    In modalità strict ogni lookup fa un round trip sulla connessione in ascolto, così tutte
+    le notifiche delle transazioni già committate sono applicate prima di rispondere.
+    """
+
+    def __init__(self, db_config, max_entries=10000, max_rows=500000, strict=True):
+        self.db_manager = DatabaseManager(db_config)
+        self.listener = DatabaseManager(db_config)
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.strict = strict
+        self.entries = OrderedDict()
+        self.total_rows = 0
+        # Indici (stazione, data) -> chiavi, lato origine e lato destinazione
+        self.front_index = {}
+        self.back_index = {}
+        # Contatore invalidazioni per data: scarta risultati calcolati durante un'invalidazione
+        self.date_generations = {}
+        self.metrics = SearchCacheMetrics()
+
+    def __enter__(self):
+        self.db_manager.connect()
+        self.listener.connect()
+        self.cursor = self.db_manager.get_cursor()
+        self.listen_cursor = self.listener.get_cursor()
+        self.listen_cursor.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+        self.graph = RouteGraph(self.cursor)
+        return self
+
+    def __exit__(self, *exc):
+        self.listener.close()
+        self.db_manager.close()
+
+    def search(self, origin, destination, service_date, max_changes=0):
+        """Risultati della ricerca, dalla cache se validi; service_date come date o stringa ISO"""
+        # Le invalidazioni arrivano come date: le chiavi devono usare lo stesso tipo
+        if isinstance(service_date, datetime):
+            service_date = service_date.date()
+        elif isinstance(service_date, str):
+            service_date = date.fromisoformat(service_date)
+        self.process_notifications()
+        key = (str(origin), str(destination), service_date, max_changes)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.metrics.hits += 1
+            self.metrics.hit_ages.append(time.perf_counter() - entry['stored_at'])
+            return entry['rows']
+
+        self.metrics.misses += 1
+        generation = self.date_generations.get(service_date, 0)
+        rows = run_search(self.cursor, origin, destination, service_date, max_changes)
+
+        # Se nel frattempo è arrivata un'invalidazione per la stessa data il risultato
+        # potrebbe essere già vecchio: lo restituiamo ma non lo mettiamo in cache
+        self.process_notifications()
+        if self.date_generations.get(service_date, 0) != generation:
+            self.metrics.discarded_results += 1
+            return rows
+
+        self._store(key, rows)
+        return rows
+
+    def _store(self, key, rows):
+        origin, destination, service_date, max_changes = key
+        front = self.graph.reach(origin, max_changes)
+        back = self.graph.reach(destination, max_changes)
+        self.entries[key] = {'rows': rows, 'stored_at': time.perf_counter(), 'front': front, 'back': back}
+        self.total_rows += len(rows)
+        for station_id in front:
+            self.front_index.setdefault((station_id, service_date), set()).add(key)
+        for station_id in back:
+            self.back_index.setdefault((station_id, service_date), set()).add(key)
+
+        while self.entries and (len(self.entries) > self.max_entries or self.total_rows > self.max_rows):
+            oldest = next(iter(self.entries))
+            self._evict(oldest)
+            self.metrics.lru_evictions += 1
+
+    def _evict(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_rows -= len(entry['rows'])
+        service_date = key[2]
+        for index, stations in ((self.front_index, entry['front']), (self.back_index, entry['back'])):
+            for station_id in stations:
+                keys = index.get((station_id, service_date))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[(station_id, service_date)]
+
+    def process_notifications(self):
+        """Applica le notifiche di invalidazione in coda"""
+        conn = self.listener.conn
+        if self.strict:
+            self.listen_cursor.execute("SELECT 1")
+        else:
+            conn.poll()
+
+        received_at = datetime.now().astimezone()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            payload = json.loads(notify.payload)
+            self.metrics.notifications += 1
+            changed_at = datetime.fromisoformat(payload['changed_at'])
+            self.metrics.notification_lags.append(max(0.0, (received_at - changed_at).total_seconds()))
+            self.invalidate_trip(payload['route_id'], date.fromisoformat(payload['service_date']))
+
+    def invalidate_trip(self, route_id, service_date):
+        """Evicta le sole chiavi della data che il viaggio sulla rotta può influenzare"""
+        self.date_generations[service_date] = self.date_generations.get(service_date, 0) + 1
+
+        stations = self.graph.route_stations.get(str(route_id))
+        if stations is None:
+            # Rotta nuova: ricarica il grafo e invalida tutta la data
+            self.graph = RouteGraph(self.cursor)
+            affected = {key for key in self.entries if key[2] == service_date}
+        else:
+            front = set().union(*(self.front_index.get((s, service_date), ()) for s in stations))
+            back = set().union(*(self.back_index.get((s, service_date), ()) for s in stations))
+            affected = front & back
+
+        for key in affected:
+            self._evict(key)
+        self.metrics.invalidated_keys += len(affected)
+
+
+def _popular_searches(cursor, count, seed):
+    """Ricerche campione (coppie di fermate sulla stessa rotta, date con viaggi) con popolarità Zipf"""
+    cursor.execute("""
+        SELECT DISTINCT rs_from.station_id, rs_to.station_id, t.service_date
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations rs_from ON rs_from.route_id = ts.route_id
+        JOIN route_stations rs_to ON rs_to.route_id = ts.route_id AND rs_from.sequence < rs_to.sequence
+        WHERE t.service_date BETWEEN CURRENT_DATE AND CURRENT_DATE + 6
+        ORDER BY 1, 2, 3
+    """)
+    candidates = cursor.fetchall()
+    rng = random.Random(seed)
+    rng.shuffle(candidates)
+    weights = [1.0 / rank for rank in range(1, len(candidates) + 1)]
+    return [tuple(str(v) if i < 2 else v for i, v in enumerate(c))
+            for c in rng.choices(candidates, weights=weights, k=count)]
+
+
+def run_benchmark(db_config, num_searches, max_changes, seed=42):
+    """Latenza e hit ratio su ricerche ripetute con distribuzione Zipf"""
+    with SearchCache(db_config) as cache:
+        searches = _popular_searches(cache.cursor, num_searches, seed)
+        if not searches:
+            print("⚠️ No trips in the next 7 days, run generate_seed_data.py first")
+            return
+
+        uncached = []
+        for origin, destination, service_date in searches[:200]:
+            start = time.perf_counter()
+            run_search(cache.cursor, origin, destination, service_date, max_changes)
+            uncached.append(time.perf_counter() - start)
+
+        latencies = []
+        for origin, destination, service_date in searches:
+            start = time.perf_counter()
+            cache.search(origin, destination, service_date, max_changes)
+            latencies.append(time.perf_counter() - start)
+
+        latencies.sort()
+        uncached.sort()
+        print(f"⏱️ {num_searches} searches (max_changes={max_changes})")
+        print(f"   database p50: {uncached[len(uncached) // 2] * 1000:.2f} ms")
+        print(f"   cached   p50: {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p95: {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms")
+        for key, value in cache.metrics.summary().items():
+            print(f"   {key}: {value}")
+
+
+def run_self_check(db_config):
+    """Verifica che dopo un aggiornamento committato la cache non restituisca risultati vecchi"""
+    writer = DatabaseManager(db_config)
+    writer.connect()
+    writer_cursor = writer.get_cursor()
+
+    writer_cursor.execute("""
+        SELECT rs_from.station_id, rs_to.station_id, t.service_date, t.id, rs_from.id, tsu.id, tsu.planned_departure
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations rs_from ON rs_from.route_id = ts.route_id AND rs_from.departure_offset_min IS NOT NULL
+        JOIN route_stations rs_to ON rs_to.route_id = ts.route_id AND rs_from.sequence < rs_to.sequence
+        LEFT JOIN trip_station_updates tsu ON tsu.trip_id = t.id AND tsu.route_station_id = rs_from.id
+        WHERE t.status IN ('SCHEDULED', 'RUNNING')
+        LIMIT 1
+    """)
+    row = writer_cursor.fetchone()
+    if not row:
+        print("⚠️ No searchable trip found, run generate_seed_data.py first")
+        writer.close()
+        return False
+    origin, destination, service_date, trip_id, route_station_id = [str(v) if i != 2 else v for i, v in enumerate(row[:5])]
+    tsu_id, old_planned_departure = row[5:]
+
+    failures = []
+    with SearchCache(db_config) as cache:
+        for max_changes in (0, 1):
+            cache.search(origin, destination, service_date, max_changes)
+
+        # 1. Variazione di un orario pianificato: la ricerca deve vedere il nuovo orario
+        writer_cursor.execute("""
+            INSERT INTO trip_station_updates (trip_id, route_station_id, planned_departure, updated_at, created_at)
+            SELECT trip_id, route_station_id, planned_departure + INTERVAL '1 minute', now(), now()
+            FROM trip_stop_times WHERE trip_id = %s AND route_station_id = %s
+            ON CONFLICT (trip_id, route_station_id) DO UPDATE SET
+                planned_departure = EXCLUDED.planned_departure, updated_at = EXCLUDED.updated_at
+        """, (trip_id, route_station_id))
+        for max_changes in (0, 1):
+            cached = cache.search(origin, destination, service_date, max_changes)
+            fresh = run_search(cache.cursor, origin, destination, service_date, max_changes)
+            if cached != fresh:
+                failures.append(f"stale result after stop update (max_changes={max_changes})")
+
+        # 2. Cancellazione del viaggio: deve sparire dai risultati
+        writer_cursor.execute("SELECT status FROM trips WHERE id = %s", (trip_id,))
+        old_status = writer_cursor.fetchone()[0]
+        writer_cursor.execute("UPDATE trips SET status = 'CANCELED' WHERE id = %s", (trip_id,))
+        cached = cache.search(origin, destination, service_date, 0)
+        if any(str(r[0]) == trip_id for r in cached):
+            failures.append("canceled trip still served from cache")
+
+        # Ripristino dei dati originali
+        writer_cursor.execute("UPDATE trips SET status = %s WHERE id = %s", (old_status, trip_id))
+        if tsu_id is None:
+            writer_cursor.execute("""
+                DELETE FROM trip_station_updates WHERE trip_id = %s AND route_station_id = %s
+            """, (trip_id, route_station_id))
+        else:
+            writer_cursor.execute("""
+                UPDATE trip_station_updates SET planned_departure = %s WHERE id = %s
+            """, (old_planned_departure, tsu_id))
+
+        # 3. Una modifica su un'altra data (stessa rotta se possibile) deve notificare
+        #    senza invalidare le chiavi della data in cache
+        writer_cursor.execute("""
+            SELECT t.id, t.status
+            FROM trips t
+            JOIN train_services ts ON t.train_service_id = ts.id
+            WHERE t.service_date <> %s
+            ORDER BY ts.route_id = (SELECT route_id FROM train_services WHERE id =
+                (SELECT train_service_id FROM trips WHERE id = %s)) DESC, t.service_date, t.planned_departure_time
+            LIMIT 1
+        """, (service_date, trip_id))
+        other = writer_cursor.fetchone()
+        if other is None:
+            print("⚠️ No trip on another date, skipping the unrelated update check")
+        else:
+            other_id, other_status = other
+            for max_changes in (0, 1):
+                cache.search(origin, destination, service_date, max_changes)
+            hits_before = cache.metrics.hits
+            notifications_before = cache.metrics.notifications
+            flipped = 'CANCELED' if other_status != 'CANCELED' else 'SCHEDULED'
+            writer_cursor.execute("UPDATE trips SET status = %s WHERE id = %s", (flipped, other_id))
+            writer_cursor.execute("UPDATE trips SET status = %s WHERE id = %s", (other_status, other_id))
+            for max_changes in (0, 1):
+                cache.search(origin, destination, service_date, max_changes)
+            if cache.metrics.notifications < notifications_before + 2:
+                failures.append("status change on another date sent no notification")
+            if cache.metrics.hits != hits_before + 2:
+                failures.append("unrelated update evicted the key")
+
+    writer.close()
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Search cache self-check passed: no stale results after updates")
+    return not failures
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix trip search cache")
+    parser.add_argument('--benchmark', type=int, metavar='N', help="run N Zipf-distributed searches")
+    parser.add_argument('--max-changes', type=int, default=0)
+    parser.add_argument('--self-check', action='store_true', help="verify no stale result is served after updates")
+    args = parser.parse_args()
+
+    if args.self_check:
+        raise SystemExit(0 if run_self_check(load_db_config()) else 1)
+    run_benchmark(load_db_config(), args.benchmark or 5000, args.max_changes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import argparse
+import random
+import statistics
+import time
+
+# Disponibilità per categoria di una lista di tratte (viaggio, stazione origine, stazione destinazione):
+# un solo statement che usa la chiave primaria (trip_id, leg_sequence, ...) dei contatori
+AVAILABILITY_SQL = """
+    WITH requested AS (
+        SELECT * FROM unnest($1::uuid[], $2::uuid[], $3::uuid[])
+            WITH ORDINALITY AS r(trip_id, origin_station_id, destination_station_id, position)
+    )
+    SELECT r.position, a.wagon_category_id, MIN(a.available_seats), MIN(a.total_seats)
+    FROM requested r
+    JOIN trips t ON t.id = r.trip_id
+    JOIN train_services ts ON t.train_service_id = ts.id
+    JOIN route_stations o ON o.route_id = ts.route_id AND o.station_id = r.origin_station_id
+    JOIN route_stations d ON d.route_id = ts.route_id AND d.station_id = r.destination_station_id
+    JOIN trip_leg_availability a ON a.trip_id = r.trip_id
+        AND a.leg_sequence >= o.sequence AND a.leg_sequence < d.sequence
+    GROUP BY r.position, a.wagon_category_id
+"""
+
+# Stessa informazione calcolata dai dati reali (posti dei vagoni e prenotazioni attive sovrapposte)
+GROUND_TRUTH_SQL = """
+    WITH requested AS (
+        SELECT * FROM unnest($1::uuid[], $2::uuid[], $3::uuid[])
+            WITH ORDINALITY AS r(trip_id, origin_station_id, destination_station_id, position)
+    ),
+    legs AS (
+        SELECT r.position, r.trip_id, ts.train_id, o.sequence AS origin_seq, d.sequence AS destination_seq
+        FROM requested r
+        JOIN trips t ON t.id = r.trip_id
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations o ON o.route_id = ts.route_id AND o.station_id = r.origin_station_id
+        JOIN route_stations d ON d.route_id = ts.route_id AND d.station_id = r.destination_station_id
+    )
+    SELECT l.position, w.category_id, COUNT(*) - COUNT(occupied.seat_row), COUNT(*)
+    FROM legs l
+    JOIN train_wagons tw ON tw.train_id = l.train_id
+    JOIN wagons w ON tw.wagon_id = w.id
+    JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
+    LEFT JOIN LATERAL (
+        SELECT sr.seat_row
+        FROM seat_reservations sr
+        WHERE sr.trip_id = l.trip_id AND sr.wagon_id = w.id
+          AND sr.seat_row = s.seat_row AND sr.seat_column = s.seat_column
+          AND sr.released_at IS NULL AND sr.expires_at > now()
+          AND sr.leg_range && int4range(l.origin_seq, l.destination_seq)
+        LIMIT 1
+    ) occupied ON true
+    WHERE w.category_id IS NOT NULL
+    GROUP BY l.position, w.category_id
+"""
+
+# Contatori attesi per ogni (viaggio, leg, categoria) ricalcolati da zero
+EXPECTED_COUNTERS_SQL = """
+    WITH leg_seats AS (
+        SELECT t.id AS trip_id, rs.sequence AS leg_sequence, w.category_id, COUNT(*)::INTEGER AS total_seats
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations rs ON rs.route_id = ts.route_id
+        JOIN train_wagons tw ON tw.train_id = ts.train_id
+        JOIN wagons w ON tw.wagon_id = w.id
+        JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
+        WHERE w.category_id IS NOT NULL
+          AND rs.sequence < (SELECT MAX(sequence) FROM route_stations WHERE route_id = ts.route_id)
+        GROUP BY t.id, rs.sequence, w.category_id
+    ),
+    leg_reserved AS (
+        SELECT sr.trip_id, rs.sequence AS leg_sequence, w.category_id, COUNT(*)::INTEGER AS reserved
+        FROM seat_reservations sr
+        JOIN trips t ON sr.trip_id = t.id
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations sr_o ON sr.origin_route_station_id = sr_o.id
+        JOIN route_stations sr_d ON sr.destination_route_station_id = sr_d.id
+        JOIN route_stations rs ON rs.route_id = ts.route_id
+            AND rs.sequence >= sr_o.sequence AND rs.sequence < sr_d.sequence
+        JOIN wagons w ON sr.wagon_id = w.id
+        WHERE sr.released_at IS NULL
+        GROUP BY sr.trip_id, rs.sequence, w.category_id
+    )
+    SELECT s.trip_id, s.leg_sequence, s.category_id, s.total_seats,
+           s.total_seats - COALESCE(r.reserved, 0) AS available_seats
+    FROM leg_seats s
+    LEFT JOIN leg_reserved r USING (trip_id, leg_sequence, category_id)
+"""
+
+
+class AvailabilityLookup:
+    """Posti liberi per categoria di una lista di tratte con un solo lookup indicizzato
+
+    La query è preparata una volta per connessione con piano generico: con poche decine di
+    risultati il costo di pianificazione dei join supererebbe di molto quello di esecuzione.
+    close() (o l'uscita dal blocco with) rimuove lo statement e ripristina plan_cache_mode
+    della sessione del chiamante.
+    """
+
+    def __init__(self, cursor, query=AVAILABILITY_SQL, name='seat_availability_lookup'):
+        self.cursor = cursor
+        self.name = name
+        cursor.execute("SHOW plan_cache_mode")
+        self.previous_plan_cache_mode = cursor.fetchone()[0]
+        # Vale solo per gli statement preparati, che psycopg2 non usa altrimenti
+        cursor.execute("SET plan_cache_mode = force_generic_plan")
+        cursor.execute(f"PREPARE {name}(uuid[], uuid[], uuid[]) AS {query}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.cursor.execute(f"DEALLOCATE {self.name}")
+        self.cursor.execute("SELECT set_config('plan_cache_mode', %s, false)", (self.previous_plan_cache_mode,))
+
+    def __call__(self, requests):
+        """requests: lista di (trip_id, origin_station_id, destination_station_id), ad esempio i risultati
+        di find_direct_trips.sql. Restituisce per ogni tratta {wagon_category_id: (liberi, totali)}."""
+        if not requests:
+            return []
+        trip_ids, origins, destinations = (list(map(str, column)) for column in zip(*requests))
+        self.cursor.execute(f"EXECUTE {self.name}(%s::uuid[], %s::uuid[], %s::uuid[])", (trip_ids, origins, destinations))
+        results = [{} for _ in requests]
+        for position, category_id, available, total in self.cursor.fetchall():
+            results[position - 1][str(category_id)] = (available, total)
+        return results
+
+
+def expire_reservations(cursor, batch_size=5000):
+    """Rilascia le prenotazioni posto scadute: i trigger restituiscono i posti ai contatori"""
+    released = 0
+    while True:
+        cursor.execute("""
+            UPDATE seat_reservations SET released_at = now(), updated_at = now()
+            WHERE id IN (
+                SELECT id FROM seat_reservations
+                WHERE released_at IS NULL AND expires_at <= now()
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (batch_size,))
+        released += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return released
+
+
+def reconcile(cursor, fix=False):
+    """Confronta i contatori con i valori ricalcolati dai dati reali; con fix li riallinea"""
+    expire_reservations(cursor)
+
+    cursor.execute(f"""
+        WITH expected AS ({EXPECTED_COUNTERS_SQL})
+        SELECT COALESCE(e.trip_id, a.trip_id), COALESCE(e.leg_sequence, a.leg_sequence),
+               COALESCE(e.category_id, a.wagon_category_id),
+               e.total_seats, e.available_seats, a.total_seats, a.available_seats
+        FROM expected e
+        FULL JOIN trip_leg_availability a
+            ON a.trip_id = e.trip_id AND a.leg_sequence = e.leg_sequence AND a.wagon_category_id = e.category_id
+        WHERE e.trip_id IS NULL OR a.trip_id IS NULL
+           OR e.total_seats <> a.total_seats OR e.available_seats <> a.available_seats
+    """)
+    mismatches = cursor.fetchall()
+
+    # Doppie prenotazioni: stesso posto su leg sovrapposti (i contatori le sottraggono due volte)
+    cursor.execute("""
+        SELECT COUNT(*) FROM seat_reservations a
+        JOIN seat_reservations b ON a.trip_id = b.trip_id AND a.wagon_id = b.wagon_id
+            AND a.seat_row = b.seat_row AND a.seat_column = b.seat_column AND a.id < b.id
+        WHERE a.released_at IS NULL AND b.released_at IS NULL AND a.leg_range && b.leg_range
+    """)
+    double_bookings = cursor.fetchone()[0]
+
+    if fix and mismatches:
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("LOCK TABLE trip_leg_availability IN EXCLUSIVE MODE")
+            cursor.execute(f"""
+                WITH expected AS ({EXPECTED_COUNTERS_SQL}),
+                removed AS (
+                    DELETE FROM trip_leg_availability a
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM expected e
+                        WHERE e.trip_id = a.trip_id AND e.leg_sequence = a.leg_sequence
+                          AND e.category_id = a.wagon_category_id
+                    )
+                )
+                INSERT INTO trip_leg_availability (trip_id, leg_sequence, wagon_category_id,
+                                                   total_seats, available_seats, updated_at)
+                SELECT trip_id, leg_sequence, category_id, total_seats, GREATEST(available_seats, 0), now()
+                FROM expected
+                ON CONFLICT (trip_id, leg_sequence, wagon_category_id) DO UPDATE SET
+                    total_seats = EXCLUDED.total_seats,
+                    available_seats = EXCLUDED.available_seats,
+                    updated_at = EXCLUDED.updated_at
+                WHERE trip_leg_availability.total_seats <> EXCLUDED.total_seats
+                   OR trip_leg_availability.available_seats <> EXCLUDED.available_seats
+            """)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    return mismatches, double_bookings
+
+
+def _sample_requests(cursor, count, seed):
+    """Tratte campione su viaggi futuri (coppie di fermate della stessa rotta)"""
+    cursor.execute("""
+        SELECT t.id, o.station_id, d.station_id
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations o ON o.route_id = ts.route_id
+        JOIN route_stations d ON d.route_id = ts.route_id AND o.sequence < d.sequence
+        WHERE t.service_date >= CURRENT_DATE AND t.status IN ('SCHEDULED', 'RUNNING')
+        ORDER BY t.id, o.sequence, d.sequence
+    """)
+    rows = cursor.fetchall()
+    return random.Random(seed).sample(rows, min(count, len(rows)))
+
+
+def run_benchmark(db_config, rounds, results_per_search=50, seed=42):
+    """Latenza dell'aggiunta di disponibilità a `results_per_search` risultati: contatori vs dati reali"""
+    # Import locale: generate_seed_data importa questo modulo per riallineare i contatori
+    from generate_seed_data import DatabaseManager
+
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    requests = _sample_requests(cursor, rounds * results_per_search, seed)
+    if not requests:
+        print("⚠️ No future trips found, run generate_seed_data.py first")
+        db_manager.close()
+        return
+
+    timings = {'counters': [], 'ground_truth': []}
+    mismatched = 0
+    with AvailabilityLookup(cursor) as counters_lookup, \
+            AvailabilityLookup(cursor, GROUND_TRUTH_SQL, 'seat_availability_truth') as truth_lookup:
+        for start_index in range(0, len(requests), results_per_search):
+            page = requests[start_index:start_index + results_per_search]
+            start = time.perf_counter()
+            counters = counters_lookup(page)
+            timings['counters'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            truth = truth_lookup(page)
+            timings['ground_truth'].append(time.perf_counter() - start)
+            mismatched += sum(c != t for c, t in zip(counters, truth))
+    db_manager.close()
+
+    print(f"⏱️ {len(timings['counters'])} searches × {results_per_search} results")
+    for label, samples in timings.items():
+        print(f"   {label:<13} p50: {statistics.median(samples) * 1000:.2f} ms  "
+              f"max: {max(samples) * 1000:.2f} ms")
+    print(f"✓ Segments differing from ground truth: {mismatched}/{len(requests)}")
+
+
+def main():
+    """Entry point"""
+    from generate_seed_data import DatabaseManager, load_db_config
+
+    parser = argparse.ArgumentParser(description="Raylix per-leg seat availability counters")
+    parser.add_argument('--expire', action='store_true', help="release expired seat reservations")
+    parser.add_argument('--reconcile', action='store_true', help="check counters against the ground truth")
+    parser.add_argument('--fix', action='store_true', help="with --reconcile, rewrite drifted counters")
+    parser.add_argument('--benchmark', type=int, metavar='SEARCHES', help="time availability for N searches")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(load_db_config(), args.benchmark)
+        return
+
+    db_manager = DatabaseManager(load_db_config())
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    try:
+        if args.expire:
+            print(f"⏳ Released {expire_reservations(cursor)} expired seat reservations")
+        if args.reconcile:
+            start = time.perf_counter()
+            mismatches, double_bookings = reconcile(cursor, fix=args.fix)
+            print(f"🔎 Reconciled in {time.perf_counter() - start:.2f}s: {len(mismatches)} drifted counters, "
+                  f"{double_bookings} double bookings")
+            for trip_id, leg, category_id, exp_total, exp_free, total, free in mismatches[:10]:
+                print(f"   trip {trip_id} leg {leg} category {category_id}: "
+                      f"expected {exp_free}/{exp_total}, counter {free}/{total}")
+            if args.fix and mismatches:
+                print("✅ Counters realigned")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from generate_seed_data import DatabaseManager, load_db_config
+from seat_availability import EXPECTED_COUNTERS_SQL
+
+# Scelta e occupazione del posto in un solo statement (funzione allocate_seat in database.sql)
+ALLOCATE_SQL = "SELECT id, wagon_id, seat_row, seat_column FROM allocate_seat(%s, %s, %s, %s, %s, %s, %s)"
+
+# Percorso check-then-insert: posto libero a caso come fa il generatore di seed, poi INSERT separato.
+# Entrambi gli statement sono preparati, come il corpo di allocate_seat che PL/pgSQL pianifica una volta sola
+FREE_SEAT_SQL = """
+    SELECT tw.wagon_id, s.seat_row, s.seat_column
+    FROM trips t
+    JOIN train_services ts ON t.train_service_id = ts.id
+    JOIN train_wagons tw ON tw.train_id = ts.train_id
+    JOIN wagons w ON tw.wagon_id = w.id
+    JOIN seat_map_seats s ON s.template_id = w.seat_map_template_id
+    JOIN route_stations o ON o.id = $2
+    JOIN route_stations d ON d.id = $3
+    WHERE t.id = $1
+      AND NOT EXISTS (
+          SELECT 1 FROM seat_reservations sr
+          WHERE sr.trip_id = t.id AND sr.wagon_id = tw.wagon_id
+            AND sr.seat_row = s.seat_row AND sr.seat_column = s.seat_column
+            AND sr.released_at IS NULL AND sr.expires_at > now()
+            AND sr.leg_range && int4range(o.sequence, d.sequence)
+      )
+    ORDER BY RANDOM()
+    LIMIT 1
+"""
+
+INSERT_SQL = """
+    INSERT INTO seat_reservations (trip_id, wagon_id, seat_row, seat_column,
+                                   origin_route_station_id, destination_route_station_id, expires_at, created_at, updated_at)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, now(), now())
+    RETURNING id
+"""
+
+HOLD_MINUTES = 15
+
+
+class SeatAllocator:
+    """Prenotazione posti sicura con venditori concorrenti: un round trip per posto"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def allocate(self, trip_id, origin_rs, destination_rs, expires_at=None,
+                 wagon_category_id=None, passenger_id=None, booking_segment_id=None):
+        """Occupa un posto libero sulla tratta, cercato a partire da una posizione casuale; restituisce (seat_reservation_id, (wagon_id, riga, colonna))
+        oppure None se la tratta è esaurita"""
+        expires_at = expires_at or datetime.now() + timedelta(minutes=HOLD_MINUTES)
+        self.cursor.execute(ALLOCATE_SQL, (
+            trip_id, origin_rs, destination_rs, expires_at, wagon_category_id, passenger_id, booking_segment_id
+        ))
+        reservation_id, wagon_id, seat_row, seat_column = self.cursor.fetchone()
+        return (reservation_id, (wagon_id, seat_row, seat_column)) if reservation_id else None
+
+
+class _CheckThenInsert:
+    """Percorso di confronto in due round trip; le collisioni sono respinte dal vincolo di esclusione"""
+
+    def __init__(self, cursor, max_attempts=3):
+        self.cursor = cursor
+        self.max_attempts = max_attempts
+        cursor.execute("SET plan_cache_mode = force_generic_plan")
+        cursor.execute(f"PREPARE free_seat(uuid, uuid, uuid) AS {FREE_SEAT_SQL}")
+        cursor.execute(
+            f"PREPARE insert_seat_reservation(uuid, uuid, smallint, smallint, uuid, uuid, timestamptz) AS {INSERT_SQL}"
+        )
+
+    def __call__(self, trip_id, origin_rs, destination_rs):
+        """Restituisce ((seat_reservation_id, (wagon_id, riga, colonna)) oppure None, collisioni ritentate)"""
+        expires_at = datetime.now() + timedelta(minutes=HOLD_MINUTES)
+        conflicts = 0
+        for _ in range(self.max_attempts):
+            self.cursor.execute("EXECUTE free_seat(%s, %s, %s)", (trip_id, origin_rs, destination_rs))
+            row = self.cursor.fetchone()
+            if not row:
+                return None, conflicts
+            try:
+                self.cursor.execute("EXECUTE insert_seat_reservation(%s, %s, %s, %s, %s, %s, %s)",
+                                    (trip_id, *row, origin_rs, destination_rs, expires_at))
+                return (self.cursor.fetchone()[0], row), conflicts
+            except psycopg2.errors.ExclusionViolation:
+                conflicts += 1
+        return None, conflicts
+
+
+def _stress_trips(cursor, count):
+    """Viaggi futuri con più fermate e i relativi route_station in ordine di sequence"""
+    cursor.execute("""
+        SELECT t.id, array_agg(rs.id::text ORDER BY rs.sequence)
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations rs ON rs.route_id = ts.route_id
+        WHERE t.service_date > CURRENT_DATE AND t.status = 'SCHEDULED'
+        GROUP BY t.id
+        ORDER BY COUNT(*) DESC, t.id
+        LIMIT %s
+    """, (count,))
+    return cursor.fetchall()
+
+
+def _verify(cursor, trip_ids):
+    """Doppie prenotazioni e contatori di disponibilità divergenti sui viaggi del test"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM seat_reservations a
+        JOIN seat_reservations b ON a.trip_id = b.trip_id AND a.wagon_id = b.wagon_id
+            AND a.seat_row = b.seat_row AND a.seat_column = b.seat_column AND a.id < b.id
+        WHERE a.trip_id = ANY(%s::uuid[]) AND a.released_at IS NULL AND b.released_at IS NULL
+          AND a.leg_range && b.leg_range
+    """, (trip_ids,))
+    double_bookings = cursor.fetchone()[0]
+    cursor.execute(f"""
+        WITH expected AS ({EXPECTED_COUNTERS_SQL})
+        SELECT COUNT(*) FROM expected e
+        JOIN trip_leg_availability a
+            ON a.trip_id = e.trip_id AND a.leg_sequence = e.leg_sequence AND a.wagon_category_id = e.category_id
+        WHERE e.trip_id = ANY(%s::uuid[]) AND e.available_seats <> a.available_seats
+    """, (trip_ids,))
+    return double_bookings, cursor.fetchone()[0]
+
+
+def _run_mode(mode, cursors, trips, bookings_per_worker, seed):
+    """Esegue i venditori in parallelo; restituisce esiti, latenze, durata e id creati"""
+    outcomes = Counter()
+    latencies = []
+    created = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(cursors) + 1)
+
+    def worker(index, cursor):
+        rng = random.Random(seed * 1000 + index)
+        allocator = SeatAllocator(cursor) if mode == 'allocate' else _CheckThenInsert(cursor)
+        local_outcomes, local_latencies, local_created = Counter(), [], []
+        barrier.wait()
+        for _ in range(bookings_per_worker):
+            trip_id, stops = rng.choice(trips)
+            origin_index, destination_index = sorted(rng.sample(range(len(stops)), 2))
+            start = time.perf_counter()
+            try:
+                if mode == 'allocate':
+                    result = allocator.allocate(trip_id, stops[origin_index], stops[destination_index])
+                else:
+                    result, conflicts = allocator(trip_id, stops[origin_index], stops[destination_index])
+                    local_outcomes['conflicts'] += conflicts
+            except psycopg2.Error as e:
+                local_outcomes[f"error: {type(e).__name__}"] += 1
+                continue
+            local_latencies.append(time.perf_counter() - start)
+            if result:
+                local_outcomes['booked'] += 1
+                local_created.append(result[0])
+            else:
+                local_outcomes['sold_out'] += 1
+        with lock:
+            outcomes.update(local_outcomes)
+            latencies.extend(local_latencies)
+            created.extend(local_created)
+
+    threads = [threading.Thread(target=worker, args=(i, c)) for i, c in enumerate(cursors)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return outcomes, latencies, time.perf_counter() - start, created
+
+
+def run_stress(db_config, workers, bookings_per_worker, trip_count, keep=False, seed=42, rounds=2):
+    """Stress test: venditori paralleli sugli stessi viaggi, allocate_seat contro check-then-insert.
+    Ogni round esegue entrambe le modalità in ordine alternato, ognuna su connessioni nuove"""
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = 'seat_reservations_no_overlap'")
+    if not cursor.fetchone():
+        print("⚠️ Exclusion constraint seat_reservations_no_overlap missing: double bookings are possible")
+    trips = _stress_trips(cursor, trip_count)
+    if not trips:
+        print("⚠️ No future trips found, run generate_seed_data.py first")
+        db_manager.close()
+        return
+    trip_ids = [str(trip_id) for trip_id, _ in trips]
+    print(f"🏁 {workers} workers × {bookings_per_worker} bookings on {len(trips)} trips "
+          f"({', '.join(str(len(stops)) for _, stops in trips)} stops), {rounds} rounds")
+
+    modes = ('check_then_insert', 'allocate')
+    results = {mode: [Counter(), [], 0.0, 0, 0] for mode in modes}
+    try:
+        for round_index in range(rounds):
+            for mode in (modes if round_index % 2 == 0 else modes[::-1]):
+                # Connessioni nuove per ogni esecuzione: impostazioni di sessione e statement
+                # preparati di una modalità non influenzano l'altra
+                worker_managers = [DatabaseManager(db_config) for _ in range(workers)]
+                try:
+                    for manager in worker_managers:
+                        manager.connect()
+                    cursors = [manager.get_cursor() for manager in worker_managers]
+                    outcomes, latencies, elapsed, created = _run_mode(
+                        mode, cursors, trips, bookings_per_worker, seed + round_index)
+                finally:
+                    for manager in worker_managers:
+                        manager.close()
+                double_bookings, drifted = _verify(cursor, trip_ids)
+                total = results[mode]
+                total[0].update(outcomes)
+                total[1].extend(latencies)
+                total[2] += elapsed
+                total[3] += double_bookings
+                total[4] += drifted
+                if not keep:
+                    cursor.execute("DELETE FROM seat_reservations WHERE id = ANY(%s::uuid[])",
+                                   ([str(i) for i in created],))
+                    cursor.execute("VACUUM ANALYZE seat_reservations")
+    finally:
+        db_manager.close()
+
+    for mode, (outcomes, latencies, elapsed, double_bookings, drifted) in results.items():
+        attempts = outcomes['booked'] + outcomes['sold_out']
+        print(f"\n📊 {mode}")
+        print(f"   booked: {outcomes['booked']}  sold out: {outcomes['sold_out']}  "
+              f"conflicts retried: {outcomes['conflicts']}")
+        for label, count in outcomes.items():
+            if label.startswith('error'):
+                print(f"   ❌ {label}: {count}")
+        print(f"   throughput: {outcomes['booked'] / elapsed:.0f} bookings/s, {attempts / elapsed:.0f} requests/s")
+        if latencies:
+            latencies.sort()
+            print(f"   latency p50: {statistics.median(latencies) * 1000:.2f} ms  "
+                  f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+        status = "✓" if double_bookings == 0 and drifted == 0 else "❌"
+        print(f"   {status} double bookings: {double_bookings}  drifted counters: {drifted}")
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix concurrency-safe seat booking")
+    parser.add_argument('--stress', action='store_true', help="compare allocate_seat with check-then-insert")
+    parser.add_argument('--workers', type=int, default=16, help="parallel sellers (one connection each)")
+    parser.add_argument('--bookings', type=int, default=200, help="booking requests per worker")
+    parser.add_argument('--trips', type=int, default=2, help="trips shared by all workers")
+    parser.add_argument('--rounds', type=int, default=2, help="rounds, alternating which mode runs first")
+    parser.add_argument('--keep', action='store_true', help="keep the reservations created by the test")
+    args = parser.parse_args()
+
+    if args.stress:
+        run_stress(load_db_config(), args.workers, args.bookings, args.trips, keep=args.keep, rounds=args.rounds)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import statistics
+import time
+
+from generate_seed_data import DatabaseManager, load_db_config
+
+# Mappa posti di un viaggio su una tratta: ogni posto dei vagoni del treno con lo stato di occupazione.
+# {seats} è la sorgente dei posti (vista wagon_seats sui template oppure tabella materializzata)
+TRIP_SEAT_MAP_SQL = """
+    SELECT tw.position, s.seat_number, s.seat_type,
+           EXISTS (
+               SELECT 1 FROM seat_reservations sr
+               WHERE sr.trip_id = t.id AND sr.wagon_id = s.wagon_id
+                 AND sr.seat_row = s.seat_row AND sr.seat_column = s.seat_column
+                 AND sr.released_at IS NULL AND sr.expires_at > now()
+                 AND sr.leg_range && int4range(o.sequence, d.sequence)
+           ) AS occupied
+    FROM trips t
+    JOIN train_services ts ON t.train_service_id = ts.id
+    JOIN train_wagons tw ON tw.train_id = ts.train_id
+    JOIN {seats} s ON s.wagon_id = tw.wagon_id
+    JOIN route_stations o ON o.id = %s
+    JOIN route_stations d ON d.id = %s
+    WHERE t.id = %s
+"""
+
+# Capacità della flotta per categoria e tipo posto: tocca tutti i posti
+FLEET_CAPACITY_SQL = """
+    SELECT w.category_id, s.seat_type, COUNT(*)
+    FROM {seats} s
+    JOIN fleet_wagons w ON w.id = s.wagon_id
+    GROUP BY w.category_id, s.seat_type
+"""
+
+# Flotta di confronto: i vagoni reali replicati `scale` volte (la prima copia mantiene l'id reale)
+FLEET_TABLE_SQL = """
+    CREATE TEMP TABLE fleet_wagons AS
+    SELECT CASE WHEN copy = 1 THEN w.id ELSE gen_random_uuid() END AS id, w.id AS source_id,
+           w.category_id, w.seat_map_template_id
+    FROM wagons w
+    CROSS JOIN generate_series(1, %s) AS copy
+"""
+
+# Tabella con lo schema precedente (una riga per posto fisico con UUID e timestamp) per la flotta
+# di confronto. seat_row/seat_column servono solo al join con seat_reservations, che prima usava wagon_seat_id
+LEGACY_TABLE_SQL = """
+    CREATE TEMP TABLE legacy_wagon_seats AS
+    SELECT gen_random_uuid() AS id, fw.id AS wagon_id, ws.cabin_id, ws.seat_number, ws.seat_type,
+           ws.seat_orientation, ws.row_number, ws.column_letter, ws.is_accessible,
+           now() AS created_at, now() AS updated_at, ws.seat_row, ws.seat_column
+    FROM fleet_wagons fw
+    JOIN wagon_seats ws ON ws.wagon_id = fw.source_id
+"""
+
+# Posti della flotta di confronto ricavati dai template, come fa la vista wagon_seats
+TEMPLATE_SEATS_SQL = """(
+    SELECT fw.id AS wagon_id, s.seat_row, s.seat_column, s.seat_number, s.seat_type
+    FROM fleet_wagons fw
+    JOIN seat_map_seats s ON s.template_id = fw.seat_map_template_id
+)"""
+
+LEGACY_INDEXES = [
+    "ALTER TABLE legacy_wagon_seats ADD PRIMARY KEY (id)",
+    "ALTER TABLE legacy_wagon_seats ADD UNIQUE (wagon_id, seat_number)",
+    "CREATE INDEX ON legacy_wagon_seats (wagon_id, seat_type)",
+    "CREATE INDEX ON legacy_wagon_seats (cabin_id)",
+    "CREATE INDEX ON legacy_wagon_seats (wagon_id, seat_row, seat_column)",
+]
+
+
+def seat_map(cursor, trip_id, origin_rs, destination_rs):
+    """Posti dei vagoni di un viaggio come (posizione vagone, numero, tipo, occupato) per la tratta richiesta"""
+    cursor.execute(TRIP_SEAT_MAP_SQL.format(seats='wagon_seats') + " ORDER BY tw.position, s.seat_row, s.seat_column",
+                   (origin_rs, destination_rs, trip_id))
+    return cursor.fetchall()
+
+
+def _relation_sizes(cursor, relations):
+    """Righe e byte (tabella + indici) per ogni relazione"""
+    sizes = {}
+    for relation in relations:
+        cursor.execute(f"SELECT COUNT(*), pg_total_relation_size('{relation}') FROM {relation}")
+        sizes[relation] = cursor.fetchone()
+    return sizes
+
+
+def _sample_legs(cursor, count):
+    """Coppie di fermate su viaggi futuri per la mappa posti"""
+    cursor.execute("""
+        SELECT t.id, o.id, d.id
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations o ON o.route_id = ts.route_id
+        JOIN route_stations d ON d.route_id = ts.route_id AND o.sequence < d.sequence
+        WHERE t.service_date >= CURRENT_DATE
+        ORDER BY t.service_date, t.id, o.sequence, d.sequence
+        LIMIT %s
+    """, (count,))
+    return cursor.fetchall()
+
+
+def _time(cursor, sql, params_list):
+    """Latenze in ms e righe restituite per ogni esecuzione"""
+    timings, rows = [], []
+    for params in params_list:
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        rows.append(sorted(cursor.fetchall(), key=str))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, rows
+
+
+def run_report(db_config, scale=1, rounds=50):
+    """Confronto di spazio e costo dei join: template di mappa posti contro posti materializzati per vagone"""
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    legs = _sample_legs(cursor, rounds)
+    if not legs:
+        print("⚠️ No future trips found, run generate_seed_data.py first")
+        db_manager.close()
+        return
+
+    cursor.execute(FLEET_TABLE_SQL, (scale,))
+    cursor.execute("ALTER TABLE fleet_wagons ADD PRIMARY KEY (id)")
+    cursor.execute(LEGACY_TABLE_SQL)
+    for statement in LEGACY_INDEXES:
+        cursor.execute(statement)
+    cursor.execute("ANALYZE fleet_wagons")
+    cursor.execute("ANALYZE legacy_wagon_seats")
+
+    sizes = _relation_sizes(cursor, ['seat_map_templates', 'seat_map_seats', 'legacy_wagon_seats'])
+    cursor.execute("SELECT COUNT(*), COUNT(DISTINCT seat_map_template_id) FROM fleet_wagons")
+    wagons, templates = cursor.fetchone()
+    template_rows = sizes['seat_map_templates'][0] + sizes['seat_map_seats'][0]
+    template_bytes = sizes['seat_map_templates'][1] + sizes['seat_map_seats'][1]
+    legacy_rows, legacy_bytes = sizes['legacy_wagon_seats']
+
+    print(f"🪑 {wagons} wagons (scale {scale}) sharing {templates} layouts")
+    print(f"   {'storage':<22} {'rows':>10} {'bytes':>12}")
+    print(f"   {'materialized seats':<22} {legacy_rows:>10} {legacy_bytes:>12}")
+    print(f"   {'seat-map templates':<22} {template_rows:>10} {template_bytes:>12}")
+    print(f"   ✓ {legacy_bytes / template_bytes:.1f}× smaller, "
+          f"{legacy_rows - template_rows} fewer rows")
+
+    seat_map_params = [(origin, destination, trip_id) for trip_id, origin, destination in legs]
+    checks = [
+        ('trip seat map', TRIP_SEAT_MAP_SQL, seat_map_params),
+        ('fleet capacity', FLEET_CAPACITY_SQL, [()] * max(1, rounds // 5)),
+    ]
+    print(f"\n⏱️ Join cost ({len(legs)} trip legs)")
+    for label, sql, params_list in checks:
+        legacy_timings, legacy_result = _time(cursor, sql.format(seats='legacy_wagon_seats'), params_list)
+        template_timings, template_result = _time(cursor, sql.format(seats=TEMPLATE_SEATS_SQL), params_list)
+        print(f"   {label:<15} materialized p50: {statistics.median(legacy_timings):.2f} ms  "
+              f"templates p50: {statistics.median(template_timings):.2f} ms")
+        if scale == 1:
+            status = "✓" if legacy_result == template_result else "❌"
+            print(f"   {status} same rows: {legacy_result == template_result}")
+
+    cursor.execute("DROP TABLE legacy_wagon_seats, fleet_wagons")
+    db_manager.close()
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix seat-map templates")
+    parser.add_argument('--report', action='store_true', help="compare templates with materialized seat rows")
+    parser.add_argument('--scale', type=int, default=1, help="with --report, multiply the fleet by N")
+    parser.add_argument('--rounds', type=int, default=50, help="with --report, trip legs to time")
+    args = parser.parse_args()
+
+    if args.report:
+        run_report(load_db_config(), args.scale, args.rounds)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
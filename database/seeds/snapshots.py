@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from psycopg2 import sql
+
+from generate_seed_data import DatabaseManager, load_db_config
+
+# Prefisso dei database snapshot: <db>_snap_<nome>
+SNAPSHOT_INFIX = '_snap_'
+SNAPSHOT_NAME_PATTERN = re.compile(r'^[a-z0-9_]{1,40}$')
+
+
+def schema_hash(cursor):
+    """Hash della struttura dello schema public (tabelle, colonne, tipi, indici e vincoli)"""
+    cursor.execute("""
+        SELECT md5(string_agg(item, E'\\n' ORDER BY item)) FROM (
+            SELECT format('col %s.%s %s %s', c.relname, a.attname,
+                          format_type(a.atttypid, a.atttypmod), a.attnotnull) AS item
+            FROM pg_attribute a
+            JOIN pg_class c ON a.attrelid = c.oid
+            JOIN pg_namespace n ON c.relnamespace = n.oid
+            WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm')
+              AND a.attnum > 0 AND NOT a.attisdropped
+            UNION ALL
+            SELECT 'idx ' || indexdef FROM pg_indexes WHERE schemaname = 'public'
+            UNION ALL
+            SELECT format('con %s %s', conrelid::regclass, pg_get_constraintdef(oid))
+            FROM pg_constraint WHERE connamespace = 'public'::regnamespace
+        ) items
+    """)
+    return cursor.fetchone()[0]
+
+
+class SnapshotManager:
+    """Snapshot del database come template PostgreSQL (CREATE DATABASE ... TEMPLATE)"""
+
+    def __init__(self, db_config):
+        self.database = db_config['database']
+        # Le operazioni su database interi richiedono una connessione al database di manutenzione
+        self.admin = DatabaseManager(dict(db_config, database=os.getenv('DB_MAINTENANCE_NAME', 'postgres')))
+        self.source = DatabaseManager(db_config)
+
+    def __enter__(self):
+        self.admin.connect()
+        self.cursor = self.admin.get_cursor()
+        return self
+
+    def __exit__(self, *exc):
+        self.admin.close()
+
+    def _snapshot_db(self, name):
+        if not SNAPSHOT_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid snapshot name '{name}': use [a-z0-9_], max 40 chars")
+        return f"{self.database}{SNAPSHOT_INFIX}{name}"
+
+    def _terminate_connections(self, database):
+        self.cursor.execute("""
+            SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+            WHERE datname = %s AND pid <> pg_backend_pid()
+        """, (database,))
+
+    def _source_metadata(self):
+        """Hash schema e conteggi principali del database sorgente"""
+        self.source.connect()
+        try:
+            cursor = self.source.get_cursor()
+            counts = {}
+            for table in ('trips', 'bookings', 'tickets', 'seat_reservations'):
+                cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table)))
+                counts[table] = cursor.fetchone()[0]
+            return schema_hash(cursor), counts
+        finally:
+            self.source.close()
+
+    def save(self, name, scale_factor=1, seed=None):
+        """Salva il database corrente come snapshot template"""
+        snapshot_db = self._snapshot_db(name)
+        schema, counts = self._source_metadata()
+        metadata = {
+            'snapshot': name,
+            'source': self.database,
+            'scale_factor': scale_factor,
+            'seed': seed,
+            'schema_hash': schema,
+            'row_counts': counts,
+            'created_at': datetime.now().isoformat(timespec='seconds')
+        }
+
+        print(f"📸 Saving snapshot {name} from {self.database}...")
+        start = time.perf_counter()
+        self._drop_database(snapshot_db)
+        self._terminate_connections(self.database)
+        self.cursor.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+            sql.Identifier(snapshot_db), sql.Identifier(self.database)
+        ))
+        # Template non connettibile: nessuno può modificare lo snapshot per errore
+        self.cursor.execute(sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false").format(
+            sql.Identifier(snapshot_db)
+        ))
+        self.cursor.execute(sql.SQL("COMMENT ON DATABASE {} IS {}").format(
+            sql.Identifier(snapshot_db), sql.Literal(json.dumps(metadata))
+        ))
+        print(f"✅ Snapshot {name} saved in {time.perf_counter() - start:.2f}s")
+        return metadata
+
+    def restore(self, name, target=None):
+        """Ricrea il database target (default: quello configurato) dallo snapshot"""
+        snapshot_db = self._snapshot_db(name)
+        target = target or self.database
+        metadata = self.get(name)
+        if metadata is None:
+            raise ValueError(f"Snapshot {name} not found")
+
+        print(f"♻️ Restoring snapshot {name} into {target}...")
+        start = time.perf_counter()
+        self._drop_database(target)
+        self.cursor.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+            sql.Identifier(target), sql.Identifier(snapshot_db)
+        ))
+        print(f"✅ Restored in {time.perf_counter() - start:.2f}s")
+        return metadata
+
+    def get(self, name):
+        for metadata in self.list():
+            if metadata['snapshot'] == name:
+                return metadata
+        return None
+
+    def list(self):
+        """Snapshot disponibili per il database configurato, dal più recente"""
+        self.cursor.execute("""
+            SELECT datname, shobj_description(oid, 'pg_database'), pg_database_size(oid)
+            FROM pg_database
+            WHERE datname LIKE %s
+        """, (self.database.replace('_', r'\_') + r'\_snap\_%',))
+
+        snapshots = []
+        for datname, comment, size in self.cursor.fetchall():
+            try:
+                metadata = json.loads(comment) if comment else {}
+            except ValueError:
+                metadata = {}
+            metadata.setdefault('snapshot', datname[len(self.database) + len(SNAPSHOT_INFIX):])
+            metadata['database'] = datname
+            metadata['size_bytes'] = size
+            snapshots.append(metadata)
+        return sorted(snapshots, key=lambda m: m.get('created_at', ''), reverse=True)
+
+    def drop(self, name):
+        """Elimina uno snapshot"""
+        if not self._drop_database(self._snapshot_db(name)):
+            raise ValueError(f"Snapshot {name} not found")
+        print(f"🗑️ Snapshot {name} dropped")
+
+    def expire(self, older_than_days=None, keep=None):
+        """Elimina gli snapshot più vecchi di N giorni e/o oltre i `keep` più recenti"""
+        snapshots = self.list()
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat() if older_than_days is not None else None
+        expired = []
+        for position, metadata in enumerate(snapshots):
+            too_old = cutoff is not None and metadata.get('created_at', '') < cutoff
+            too_many = keep is not None and position >= keep
+            if too_old or too_many:
+                self.drop(metadata['snapshot'])
+                expired.append(metadata['snapshot'])
+        return expired
+
+    def _drop_database(self, database):
+        self.cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (database,))
+        if not self.cursor.fetchone():
+            return False
+        # Un template deve tornare database normale prima di poter essere eliminato
+        self.cursor.execute(sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE false").format(sql.Identifier(database)))
+        self._terminate_connections(database)
+        self.cursor.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(database)))
+        return True
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix dataset snapshots (PostgreSQL templates)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    save = commands.add_parser('save', help="save the current database as a snapshot")
+    save.add_argument('name')
+    save.add_argument('--scale', type=float, default=1, help="scale factor tag")
+    save.add_argument('--seed', type=int, help="generator seed tag")
+
+    restore = commands.add_parser('restore', help="recreate the database from a snapshot")
+    restore.add_argument('name')
+    restore.add_argument('--target', help="target database (default: DB_NAME)")
+
+    commands.add_parser('list', help="list snapshots")
+
+    drop = commands.add_parser('drop', help="drop a snapshot")
+    drop.add_argument('name')
+
+    expire = commands.add_parser('expire', help="drop old snapshots")
+    expire.add_argument('--older-than', type=float, metavar='DAYS')
+    expire.add_argument('--keep', type=int, help="keep only the N most recent snapshots")
+
+    args = parser.parse_args()
+
+    with SnapshotManager(load_db_config()) as manager:
+        if args.command == 'save':
+            manager.save(args.name, args.scale, args.seed)
+        elif args.command == 'restore':
+            metadata = manager.restore(args.name, args.target)
+            print(f"   scale={metadata.get('scale_factor')} seed={metadata.get('seed')} "
+                  f"schema={metadata.get('schema_hash')}")
+        elif args.command == 'drop':
+            manager.drop(args.name)
+        elif args.command == 'expire':
+            expired = manager.expire(args.older_than, args.keep)
+            print(f"✅ {len(expired)} snapshot(s) expired")
+        else:
+            print(f"{'snapshot':<24}{'created_at':<21}{'scale':>7}{'seed':>8}{'size MB':>10}  schema")
+            for m in manager.list():
+                seed = m.get('seed') if m.get('seed') is not None else '-'
+                print(f"{m['snapshot']:<24}{m.get('created_at', '-'):<21}{str(m.get('scale_factor', '-')):>7}"
+                      f"{str(seed):>8}{m['size_bytes'] / 1024 ** 2:>10.1f}  {m.get('schema_hash', '-')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import heapq
+import math
+import random
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+
+from psycopg2.extras import execute_values
+
+from generate_seed_data import DatabaseManager, load_db_config
+
+EARTH_RADIUS_KM = 6371.0
+# Quota minima di trigrammi della query presenti nel nome per i risultati fuzzy
+FUZZY_THRESHOLD = 0.4
+# Foglie del KD-tree: sotto questa dimensione la scansione lineare è più veloce
+KD_LEAF_SIZE = 8
+
+
+def normalize(text):
+    """Testo senza accenti, in minuscolo, con la punteggiatura sostituita da spazi"""
+    ascii_text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in ascii_text.casefold()).split())
+
+
+def trigrams(text):
+    """Trigrammi di ogni parola con padding, come pg_trgm"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def _chord_to_km(chord):
+    """Distanza sulla sfera dalla corda tra due versori"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class KDTree:
+    """KD-tree sui versori 3D delle coordinate: la distanza euclidea (corda) è monotona con quella
+    sulla sfera, quindi la ricerca dei k più vicini è esatta anche vicino all'antimeridiano"""
+
+    def __init__(self, points):
+        # points: lista di (x, y, z, payload)
+        self.root = self._build(list(points), 0)
+
+    def _build(self, points, depth):
+        if len(points) <= KD_LEAF_SIZE:
+            return ('leaf', points)
+        axis = depth % 3
+        points.sort(key=lambda p: p[axis])
+        middle = len(points) // 2
+        return ('node', axis, points[middle][axis],
+                self._build(points[:middle], depth + 1), self._build(points[middle:], depth + 1))
+
+    def nearest(self, target, k):
+        """I k punti più vicini al versore target come lista di (distanza corda², payload)"""
+        heap = []  # max-heap sulla distanza: (-d², contatore, payload)
+        counter = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node[0] == 'leaf':
+                for x, y, z, payload in node[1]:
+                    d2 = (x - target[0]) ** 2 + (y - target[1]) ** 2 + (z - target[2]) ** 2
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d2, counter, payload))
+                    elif d2 < -heap[0][0]:
+                        heapq.heapreplace(heap, (-d2, counter, payload))
+                    counter += 1
+                continue
+
+            _, axis, split, left, right = node
+            diff = target[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Il ramo lontano si visita solo se l'iperpiano è più vicino del k-esimo risultato
+            if len(heap) < k or diff * diff < -heap[0][0]:
+                stack.append(far)
+            stack.append(near)
+
+        return sorted((-d2, payload) for d2, _, payload in heap)
+
+
+class PrefixIndex:
+    """Chiavi ordinate con l'indice della stazione: le chiavi con un prefisso sono un intervallo contiguo"""
+
+    def __init__(self, entries):
+        entries = sorted(entries)
+        self.keys = [key for key, _ in entries]
+        self.ids = [idx for _, idx in entries]
+
+    def matches(self, prefix):
+        """Indici delle stazioni con una chiave che inizia per `prefix`"""
+        start = bisect_left(self.keys, prefix)
+        # Tutte le chiavi con il prefisso sono < prefix + il carattere massimo
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        return self.ids[start:end]
+
+
+class StationLookup:
+    """Autocomplete di stazioni e città (prefisso e fuzzy) e stazioni più vicine, in memoria"""
+
+    def __init__(self, stations):
+        # stations: dict con id, name, city, country, latitude, longitude, routes
+        self.stations = stations
+        self.normalized = [normalize(s['name']) for s in stations]
+        self.normalized_cities = [normalize(s['city'] or '') for s in stations]
+
+        # Rango statico: più rotte servite prima, poi ordine alfabetico
+        order = sorted(range(len(stations)), key=lambda idx: (-stations[idx]['routes'], self.normalized[idx]))
+        self.static_rank = [0] * len(stations)
+        for rank, idx in enumerate(order):
+            self.static_rank[idx] = rank
+
+        # Indici prefissi (chiavi normalizzate ordinate, ricerca con bisect): nome completo,
+        # città e singole parole di entrambi
+        self.name_index = PrefixIndex((name, idx) for idx, name in enumerate(self.normalized))
+        self.city_index = PrefixIndex((city, idx) for idx, city in enumerate(self.normalized_cities) if city)
+        self.word_index = PrefixIndex(
+            (word, idx)
+            for idx, (name, city) in enumerate(zip(self.normalized, self.normalized_cities))
+            for word in set(name.split()) | set(city.split())
+        )
+
+        # Indice trigrammi per la ricerca fuzzy
+        self.station_trigrams = [
+            trigrams(f"{name} {city}") for name, city in zip(self.normalized, self.normalized_cities)
+        ]
+        self.trigram_index = {}
+        for idx, grams in enumerate(self.station_trigrams):
+            for gram in grams:
+                self.trigram_index.setdefault(gram, []).append(idx)
+
+        self.kdtree = KDTree(
+            (*_unit_vector(s['latitude'], s['longitude']), idx)
+            for idx, s in enumerate(stations)
+            if s['latitude'] is not None and s['longitude'] is not None
+        )
+
+    @classmethod
+    def load(cls, cursor):
+        """Carica stazioni, città, paese e numero di rotte servite (popolarità)"""
+        cursor.execute("""
+            SELECT s.id, s.name, c.name, co.name, s.latitude, s.longitude, COUNT(DISTINCT rs.route_id)
+            FROM stations s
+            LEFT JOIN cities c ON s.city_id = c.id
+            LEFT JOIN countries co ON c.country_id = co.id
+            LEFT JOIN route_stations rs ON rs.station_id = s.id
+            GROUP BY s.id, s.name, c.name, co.name, s.latitude, s.longitude
+            ORDER BY s.name, s.id
+        """)
+        return cls([
+            {
+                'id': str(station_id), 'name': name, 'city': city, 'country': country,
+                'latitude': latitude, 'longitude': longitude, 'routes': routes
+            }
+            for station_id, name, city, country, latitude, longitude, routes in cursor.fetchall()
+        ])
+
+    def autocomplete(self, query, limit=10, fuzzy=True):
+        """Stazioni per prefisso, completate da risultati fuzzy per trigrammi se non bastano
+
+        Ordine: nome che inizia con la query, poi città che inizia con la query, poi stazioni in cui
+        ogni parola della query è prefisso di una parola del nome o della città; a parità vince la
+        stazione servita da più rotte.
+        """
+        text = normalize(query)
+        if not text:
+            return []
+
+        rank = self.static_rank.__getitem__
+        ranked, seen = [], set()
+        for tier in (lambda: self.name_index.matches(text),
+                     lambda: self.city_index.matches(text),
+                     lambda: self._word_matches(text.split())):
+            if len(ranked) >= limit:
+                break
+            # Si chiedono `len(seen)` elementi in più per compensare quelli già presi dai livelli precedenti
+            for idx in heapq.nsmallest(limit + len(seen), tier(), key=rank):
+                if len(ranked) < limit and idx not in seen:
+                    ranked.append(idx)
+                    seen.add(idx)
+        results = [dict(self.stations[idx], score=1.0) for idx in ranked]
+
+        if fuzzy and len(results) < limit:
+            for score, idx in self._fuzzy(text, limit - len(results), seen):
+                results.append(dict(self.stations[idx], score=round(score, 3)))
+        return results
+
+    def _word_matches(self, words):
+        """Stazioni in cui ogni parola è prefisso di una parola del nome o della città"""
+        candidates = set(self.word_index.matches(words[0]))
+        for word in words[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(self.word_index.matches(word))
+        return candidates
+
+    def _fuzzy(self, text, limit, exclude=()):
+        """Le `limit` stazioni con la quota più alta di trigrammi della query presenti in nome o città
+        (come word_similarity di pg_trgm), sopra soglia"""
+        query_grams = trigrams(text)
+        if not query_grams:
+            return []
+
+        # Filtro per prefisso: chi condivide almeno `required` trigrammi ne ha per forza uno
+        # tra i len - required + 1 più rari, quindi le liste lunghe non vengono mai scorse
+        required = max(1, math.ceil(FUZZY_THRESHOLD * len(query_grams)))
+        by_rarity = sorted(query_grams, key=lambda gram: len(self.trigram_index.get(gram, ())))
+        rare, frequent = by_rarity[:len(query_grams) - required + 1], set(by_rarity[len(query_grams) - required + 1:])
+        counts = Counter()
+        for gram in rare:
+            counts.update(self.trigram_index.get(gram, ()))
+
+        # Verifica dei candidati dal più promettente: ci si ferma quando nemmeno contando tutti i
+        # trigrammi frequenti un candidato può entrare tra i migliori `limit`
+        best = []  # min-heap di (comuni, -rango, idx)
+        for idx, rare_common in counts.most_common():
+            needed = best[0][0] if len(best) >= limit else required
+            if rare_common + len(frequent) < needed:
+                break
+            if idx in exclude:
+                continue
+            common = rare_common + len(frequent & self.station_trigrams[idx])
+            entry = (common, -self.static_rank[idx], idx)
+            if common < required:
+                continue
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+        return [(common / len(query_grams), idx) for common, _, idx in sorted(best, reverse=True)]
+
+    def nearest(self, latitude, longitude, k=5, max_km=None):
+        """Le k stazioni più vicine alle coordinate, con distanza in km"""
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        results = []
+        for chord2, idx in self.kdtree.nearest(_unit_vector(latitude, longitude), k):
+            distance = _chord_to_km(math.sqrt(chord2))
+            if max_km is not None and distance > max_km:
+                break
+            results.append(dict(self.stations[idx], distance_km=round(distance, 3)))
+        return results
+
+
+def _synthetic_network(stations, size, seed):
+    """Rete di `size` stazioni ottenuta replicando quelle reali con coordinate e nomi perturbati"""
+    rng = random.Random(seed)
+    suffixes = ('Centrale', 'Nord', 'Sud', 'Est', 'Ovest', 'Porta', 'Borgo', 'San Pietro', 'Scalo', 'Marittima')
+    network = list(stations)
+    while len(network) < size:
+        base = stations[rng.randrange(len(stations))]
+        n = len(network)
+        network.append(dict(
+            base, id=f"synthetic-{n}",
+            name=f"{base['city'] or base['name']} {suffixes[n % len(suffixes)]} {n}",
+            latitude=(base['latitude'] or 45.0) + rng.uniform(-1.5, 1.5),
+            longitude=(base['longitude'] or 10.0) + rng.uniform(-1.5, 1.5),
+            routes=rng.randrange(1, 6)
+        ))
+    return network
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+
+def run_benchmark(db_config, size, queries, seed=42):
+    """Latenza di autocomplete e nearest su una rete di `size` stazioni, confrontata con SQL"""
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    base = StationLookup.load(cursor).stations
+    if not base:
+        print("⚠️ No stations found, run generate_seed_data.py first")
+        db_manager.close()
+        return
+
+    network = _synthetic_network(base, max(size, len(base)), seed)
+    start = time.perf_counter()
+    lookup = StationLookup(network)
+    build_time = time.perf_counter() - start
+    print(f"🚉 Index built over {len(network)} stations in {build_time:.2f}s")
+
+    rng = random.Random(seed)
+    prefixes, typos, points = [], [], []
+    for _ in range(queries):
+        name = normalize(network[rng.randrange(len(network))]['name'])
+        prefixes.append(name[:rng.randint(2, 6)])
+        position = rng.randrange(len(name))
+        typos.append(name[:position] + name[position + 1:])
+        station = network[rng.randrange(len(network))]
+        points.append((station['latitude'] + rng.uniform(-0.2, 0.2), station['longitude'] + rng.uniform(-0.2, 0.2)))
+
+    timings = {'prefix': [], 'fuzzy': [], 'nearest': []}
+    for prefix, typo, (lat, lon) in zip(prefixes, typos, points):
+        for label, call in (('prefix', lambda: lookup.autocomplete(prefix, fuzzy=False)),
+                            ('fuzzy', lambda: lookup.autocomplete(typo)),
+                            ('nearest', lambda: lookup.nearest(lat, lon, 5))):
+            start = time.perf_counter()
+            call()
+            timings[label].append(time.perf_counter() - start)
+
+    # Verifica di correttezza dei k più vicini contro la scansione completa
+    exact = 0
+    for lat, lon in points[:100]:
+        target = _unit_vector(lat, lon)
+        brute = sorted(
+            (sum((a - b) ** 2 for a, b in zip(target, _unit_vector(s['latitude'], s['longitude']))), s['id'])
+            for s in network
+        )[:5]
+        exact += [s['id'] for s in lookup.nearest(lat, lon, 5)] == [sid for _, sid in brute]
+
+    # Riferimento: le stesse ricerche in SQL su una copia temporanea della rete con gli indici B-tree
+    # dello schema (nome e latitudine/longitudine)
+    cursor.execute("""
+        CREATE TEMP TABLE bench_stations (id TEXT, name TEXT, city TEXT, latitude DOUBLE PRECISION,
+                                          longitude DOUBLE PRECISION)
+    """)
+    execute_values(cursor, "INSERT INTO bench_stations VALUES %s",
+                   [(s['id'], s['name'], s['city'], s['latitude'], s['longitude']) for s in network],
+                   page_size=1000)
+    cursor.execute("CREATE INDEX ON bench_stations(name)")
+    cursor.execute("CREATE INDEX ON bench_stations(latitude, longitude)")
+    cursor.execute("ANALYZE bench_stations")
+
+    sql_timings = {'prefix': [], 'nearest': []}
+    for prefix, (lat, lon) in list(zip(prefixes, points))[:200]:
+        start = time.perf_counter()
+        cursor.execute("""
+            SELECT id FROM bench_stations
+            WHERE lower(name) LIKE %(p)s OR lower(city) LIKE %(p)s
+            LIMIT 10
+        """, {'p': f"{prefix}%"})
+        cursor.fetchall()
+        sql_timings['prefix'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cursor.execute("""
+            SELECT id FROM bench_stations
+            ORDER BY (latitude - %s) ^ 2 + ((longitude - %s) * cos(radians(%s))) ^ 2 LIMIT 5
+        """, (lat, lon, lat))
+        cursor.fetchall()
+        sql_timings['nearest'].append(time.perf_counter() - start)
+    db_manager.close()
+
+    print(f"⏱️ {queries} queries per kind")
+    for label, samples in timings.items():
+        p50, p99 = _percentiles(samples)
+        print(f"   {label:<8} p50: {p50:.3f} ms  p99: {p99:.3f} ms")
+    for label, samples in sql_timings.items():
+        p50, p99 = _percentiles(samples)
+        print(f"   sql {label:<4} p50: {p50:.3f} ms  p99: {p99:.3f} ms")
+    print(f"✓ Nearest matches full scan: {exact}/{min(100, len(points))}")
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix station autocomplete and nearest-station lookup")
+    parser.add_argument('query', nargs='?', help="station or city name (prefix, accents and typos allowed)")
+    parser.add_argument('--near', nargs=2, type=float, metavar=('LAT', 'LON'), help="find nearest stations")
+    parser.add_argument('-k', type=int, default=5, help="number of results")
+    parser.add_argument('--benchmark', type=int, metavar='STATIONS', help="benchmark on a synthetic network")
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+    if args.k < 1:
+        parser.error("-k must be at least 1")
+
+    if args.benchmark:
+        run_benchmark(load_db_config(), args.benchmark, args.queries)
+        return
+
+    db_manager = DatabaseManager(load_db_config())
+    db_manager.connect()
+    lookup = StationLookup.load(db_manager.get_cursor())
+    db_manager.close()
+
+    if args.near:
+        for s in lookup.nearest(args.near[0], args.near[1], args.k):
+            print(f"   {s['distance_km']:>9.1f} km  {s['name']} ({s['city']}, {s['country']})")
+    if args.query:
+        for s in lookup.autocomplete(args.query, args.k):
+            print(f"   {s['score']:.2f}  {s['name']} ({s['city']}, {s['country']})")
+
+
+if __name__ == "__main__":
+    main()
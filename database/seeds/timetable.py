@@ -0,0 +1,250 @@
+import argparse
+import re
+import statistics
+import time
+
+from psycopg2 import sql
+
+from archival import QUERY_DIRS, UUID_LITERAL
+from generate_seed_data import DatabaseManager, load_db_config
+
+DATE_LITERAL = re.compile(r"'\d{4}-\d{2}-\d{2}'")
+
+# Query del repository con i valori di esempio (UUID e date, in ordine) da sostituire con parametri
+QUERIES = {
+    'find_direct_trips': (['origin', 'destination'], ['service_date']),
+    'find_trip_paths': (['origin', 'destination'], ['service_date', 'service_date']),
+    'calculate_fare': (['trip_id', 'origin', 'destination'], []),
+}
+
+# Tabelle con aggiornamenti fermate e relativi viaggi (attivi e archiviati)
+TABLES = (('public', 'trips'), ('archive', 'trips'))
+
+# Orari pianificati ricavati dagli offset della rotta, come nella vista trip_stop_times
+PLANNED_SQL = """
+    SELECT u.id,
+           t.planned_departure_time + rs.arrival_offset_min * INTERVAL '1 minute' AS planned_arrival,
+           t.planned_departure_time + rs.departure_offset_min * INTERVAL '1 minute' AS planned_departure
+    FROM {updates} u
+    JOIN {trips} t ON t.id = u.trip_id
+    JOIN route_stations rs ON rs.id = u.route_station_id
+    WHERE u.trip_id = ANY(%(ids)s::uuid[])
+"""
+
+# Layout precedente: una riga per fermata di ogni viaggio con gli orari pianificati materializzati
+LEGACY_TABLE_SQL = """
+    CREATE TEMP TABLE legacy_trip_station_updates AS
+    SELECT COALESCE(u.id, gen_random_uuid()) AS id, st.trip_id, st.route_station_id,
+           st.planned_arrival, st.planned_departure, st.actual_arrival, st.actual_departure,
+           st.delay_minutes, COALESCE(u.updated_at, now()) AS updated_at, COALESCE(u.created_at, now()) AS created_at
+    FROM trip_stop_times st
+    LEFT JOIN trip_station_updates u ON u.trip_id = st.trip_id AND u.route_station_id = st.route_station_id
+"""
+
+# Copia compatta della tabella attuale, misurata senza il bloat lasciato da aggiornamenti e archiviazione
+DELTA_TABLE_SQL = "CREATE TEMP TABLE delta_trip_station_updates AS SELECT * FROM trip_station_updates"
+
+# Indici di trip_station_updates, ricreati sulle copie temporanee
+INDEXES = [
+    "ALTER TABLE {table} ADD PRIMARY KEY (id)",
+    "ALTER TABLE {table} ADD UNIQUE (trip_id, route_station_id)",
+    "CREATE INDEX ON {table} (trip_id)",
+    "CREATE INDEX ON {table} (updated_at)",
+    "CREATE INDEX ON {table} (trip_id, updated_at)",
+    "CREATE INDEX ON {table} (delay_minutes, updated_at)",
+]
+
+
+def load_query(name, legacy=False):
+    """Query di database/queries con UUID e date di esempio sostituiti da parametri nominali;
+    con legacy la versione precedente agli orari derivati (database/queries/legacy)"""
+    dirs = [d / 'legacy' for d in QUERY_DIRS] if legacy else QUERY_DIRS
+    path = next(d / f"{name}.sql" for d in dirs if (d / f"{name}.sql").exists())
+    uuids, dates = QUERIES[name]
+    text = path.read_text(encoding='utf-8')
+    uuid_params, date_params = iter(uuids), iter(dates)
+    text = UUID_LITERAL.sub(lambda m: f"%({next(uuid_params)})s", text, count=len(uuids))
+    return DATE_LITERAL.sub(lambda m: f"%({next(date_params)})s", text, count=len(dates))
+
+
+class TimetableCompactor:
+    """Migrazione al layout delta: toglie gli orari pianificati uguali a quelli calcolati dagli offset
+    e cancella le righe senza orari effettivi, ritardi o variazioni, a batch di viaggi"""
+
+    def __init__(self, cursor, batch_size=500):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.cleared = 0
+        self.deleted = 0
+        self.batches = 0
+
+    def compact(self, schema, trips):
+        updates = sql.Identifier(schema, 'trip_station_updates')
+        trips = sql.Identifier(schema, trips)
+        last_trip_id = None
+        while True:
+            self.cursor.execute(sql.SQL("""
+                SELECT DISTINCT trip_id FROM {updates}
+                WHERE %(last)s::uuid IS NULL OR trip_id > %(last)s::uuid
+                ORDER BY trip_id LIMIT %(limit)s
+            """).format(updates=updates), {'last': last_trip_id, 'limit': self.batch_size})
+            ids = [str(row[0]) for row in self.cursor.fetchall()]
+            if not ids:
+                return
+            self.cursor.execute("BEGIN")
+            try:
+                # Le variazioni tolte notificano l'invalidazione della cache di ricerca, una volta per viaggio e batch
+                self.cursor.execute(sql.SQL("""
+                    UPDATE {updates} u SET
+                        planned_arrival = CASE WHEN u.planned_arrival = p.planned_arrival
+                                               THEN NULL ELSE u.planned_arrival END,
+                        planned_departure = CASE WHEN u.planned_departure = p.planned_departure
+                                                 THEN NULL ELSE u.planned_departure END
+                    FROM ({planned}) p
+                    WHERE u.id = p.id
+                      AND (u.planned_arrival = p.planned_arrival OR u.planned_departure = p.planned_departure)
+                """).format(updates=updates, planned=sql.SQL(PLANNED_SQL).format(updates=updates, trips=trips)),
+                    {'ids': ids})
+                self.cleared += self.cursor.rowcount
+                self.cursor.execute(sql.SQL("""
+                    DELETE FROM {updates}
+                    WHERE trip_id = ANY(%(ids)s::uuid[])
+                      AND planned_arrival IS NULL AND planned_departure IS NULL
+                      AND actual_arrival IS NULL AND actual_departure IS NULL
+                      AND COALESCE(delay_minutes, 0) = 0
+                """).format(updates=updates), {'ids': ids})
+                self.deleted += self.cursor.rowcount
+                self.cursor.execute("COMMIT")
+            except Exception:
+                self.cursor.execute("ROLLBACK")
+                raise
+            self.batches += 1
+            last_trip_id = ids[-1]
+
+
+def run_compaction(db_config, batch_size):
+    """Migrazione al layout delta delle tabelle attive e archiviate, con spazio prima e dopo"""
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    compactor = TimetableCompactor(cursor, batch_size)
+    start = time.perf_counter()
+    for schema, trips in TABLES:
+        before = _table_size(cursor, schema)
+        compactor.compact(schema, trips)
+        cursor.execute(sql.SQL("VACUUM ANALYZE {}").format(sql.Identifier(schema, 'trip_station_updates')))
+        after = _table_size(cursor, schema)
+        print(f"   {schema}.trip_station_updates: {before[0]} → {after[0]} rows, "
+              f"{before[1] / 1024 ** 2:.2f} → {after[1] / 1024 ** 2:.2f} MB")
+    db_manager.close()
+    print(f"✅ {compactor.batches} batches in {time.perf_counter() - start:.2f}s: "
+          f"{compactor.cleared} rows with redundant planned times cleared, {compactor.deleted} rows deleted")
+    print("   VACUUM makes the space reusable; VACUUM FULL (locks the table) returns it to the system")
+
+
+def _table_size(cursor, schema):
+    cursor.execute(sql.SQL("SELECT COUNT(*), pg_total_relation_size(%s) FROM {}").format(
+        sql.Identifier(schema, 'trip_station_updates')
+    ), (f"{schema}.trip_station_updates",))
+    return cursor.fetchone()
+
+
+def _sample_params(cursor, count):
+    """Parametri delle query: tratte di viaggi futuri con la relativa data"""
+    cursor.execute("""
+        SELECT t.id, o.station_id, d.station_id, t.service_date
+        FROM trips t
+        JOIN train_services ts ON t.train_service_id = ts.id
+        JOIN route_stations o ON o.route_id = ts.route_id
+        JOIN route_stations d ON d.route_id = ts.route_id AND o.sequence < d.sequence
+        WHERE t.service_date >= CURRENT_DATE AND t.status IN ('SCHEDULED', 'RUNNING')
+        ORDER BY t.service_date, t.id, o.sequence, d.sequence
+        LIMIT %s
+    """, (count,))
+    return [{'trip_id': str(trip_id), 'origin': str(origin), 'destination': str(destination),
+             'service_date': service_date}
+            for trip_id, origin, destination, service_date in cursor.fetchall()]
+
+
+def _on_table(query, table):
+    """Stessa query su una copia di trip_station_updates"""
+    return re.sub(r'\btrip_station_updates\b', table, query)
+
+
+def _time(cursor, query, params_list):
+    """Latenze in ms e righe restituite per ogni esecuzione"""
+    timings, rows = [], []
+    for params in params_list:
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        rows.append(cursor.fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, rows
+
+
+def run_report(db_config, rounds=30):
+    """Spazio e latenza delle query di ricerca e tariffa: query precedenti sul layout completo
+    (una riga per fermata) contro query attuali sul layout delta"""
+    db_manager = DatabaseManager(db_config)
+    db_manager.connect()
+    cursor = db_manager.get_cursor()
+    params_list = _sample_params(cursor, rounds)
+    if not params_list:
+        print("⚠️ No future trips found, run generate_seed_data.py first")
+        db_manager.close()
+        return
+
+    sizes = {}
+    for table, create_sql in (('legacy_trip_station_updates', LEGACY_TABLE_SQL),
+                              ('delta_trip_station_updates', DELTA_TABLE_SQL)):
+        cursor.execute(create_sql)
+        for statement in INDEXES:
+            cursor.execute(statement.format(table=table))
+        cursor.execute(f"ANALYZE {table}")
+        cursor.execute(f"SELECT COUNT(*), pg_total_relation_size('{table}') FROM {table}")
+        sizes[table] = cursor.fetchone()
+    legacy_rows, legacy_bytes = sizes['legacy_trip_station_updates']
+    delta_rows, delta_bytes = sizes['delta_trip_station_updates']
+    print("🕒 trip_station_updates")
+    print(f"   {'layout':<22} {'rows':>10} {'bytes':>12}")
+    print(f"   {'one row per stop':<22} {legacy_rows:>10} {legacy_bytes:>12}")
+    print(f"   {'delta only':<22} {delta_rows:>10} {delta_bytes:>12}")
+    print(f"   ✓ {legacy_bytes / delta_bytes:.1f}× smaller, {legacy_rows - delta_rows} fewer rows")
+
+    print(f"\n⏱️ Query latency ({len(params_list)} runs each)")
+    for name in QUERIES:
+        # Prima: INNER JOIN sugli orari materializzati; dopo: LEFT JOIN sulle variazioni e orari calcolati
+        legacy_query = _on_table(load_query(name, legacy=True), 'legacy_trip_station_updates')
+        delta_query = _on_table(load_query(name), 'delta_trip_station_updates')
+        legacy_timings, legacy_result = _time(cursor, legacy_query, params_list)
+        delta_timings, delta_result = _time(cursor, delta_query, params_list)
+        # Le due versioni possono restituire in ordine diverso le righe a pari chiave di ordinamento
+        same = all(sorted(map(repr, a)) == sorted(map(repr, b)) for a, b in zip(legacy_result, delta_result))
+        status = "✓" if same else "❌"
+        print(f"   {name:<18} before p50: {statistics.median(legacy_timings):.2f} ms  "
+              f"after p50: {statistics.median(delta_timings):.2f} ms  {status} same rows")
+
+    cursor.execute("DROP TABLE legacy_trip_station_updates, delta_trip_station_updates")
+    db_manager.close()
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Raylix delta-only timetable storage")
+    parser.add_argument('--compact', action='store_true', help="migrate trip_station_updates to delta rows")
+    parser.add_argument('--batch-size', type=int, default=500, help="with --compact, trips per transaction")
+    parser.add_argument('--report', action='store_true', help="compare full and delta layouts (size, latency)")
+    parser.add_argument('--rounds', type=int, default=30, help="with --report, runs per query")
+    args = parser.parse_args()
+
+    if not (args.compact or args.report):
+        parser.print_help()
+        return
+    if args.compact:
+        run_compaction(load_db_config(), args.batch_size)
+    if args.report:
+        run_report(load_db_config(), args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+# Ore di punta usate per ordinare gli orari di partenza per popolarità
+PEAK_HOURS_MIN = (8 * 60, 18 * 60)
+# Fattore di tortuosità: distanza ferroviaria rispetto alla linea d'aria
+RAIL_DETOUR_FACTOR = 1.2
+
+
+class FareTable:
+    """Regole tariffarie in memoria: vince la regola più specifica, a parità la più economica"""
+
+    def __init__(self, fares):
+        self.fares = fares
+        self.cache = {}
+
+    @classmethod
+    def load(cls, cursor):
+        cursor.execute("""
+            SELECT id, origin_country_id, destination_country_id, service_type_id, wagon_category_id,
+                   distance_min_km, distance_max_km, base_fare, fare_per_km, international_supplement
+            FROM fares
+            ORDER BY id
+        """)
+        return cls([
+            {
+                'id': str(row[0]),
+                'origin_country_id': _str_or_none(row[1]),
+                'destination_country_id': _str_or_none(row[2]),
+                'service_type_id': _str_or_none(row[3]),
+                'wagon_category_id': _str_or_none(row[4]),
+                'distance_min_km': row[5],
+                'distance_max_km': row[6],
+                'base_fare': float(row[7]),
+                'fare_per_km': float(row[8]),
+                'international_supplement': float(row[9] or 0)
+            }
+            for row in cursor.fetchall()
+        ])
+
+    def calculate(self, origin_country, dest_country, distance_km, service_type_id, wagon_category_id):
+        """Restituisce [fare_id, importo] per la tratta"""
+        key = (origin_country, dest_country, distance_km, service_type_id, wagon_category_id)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._calculate(*key)
+            self.cache[key] = result
+        return result
+
+    def _calculate(self, origin_country, dest_country, distance_km, service_type_id, wagon_category_id):
+        best, best_key = None, None
+        for f in self.fares:
+            if not f['distance_min_km'] <= distance_km <= f['distance_max_km']:
+                continue
+            score = _fare_priority(f, origin_country, dest_country, service_type_id, wagon_category_id)
+            if score is None:
+                continue
+            key = (-score, f['base_fare'])
+            if best_key is None or key < best_key:
+                best, best_key = f, key
+
+        if best is None:
+            # Fallback
+            return [None, Decimal(str(round(15.00 + (0.15 * distance_km), 2)))]
+        total = best['base_fare'] + best['fare_per_km'] * distance_km + best['international_supplement']
+        return [best['id'], Decimal(str(round(total, 2)))]
+
+
+def _fare_priority(f, origin_country, dest_country, service_type_id, wagon_category_id):
+    """Punteggio di priorità della regola, None se la regola non è applicabile"""
+    same_countries = f['origin_country_id'] == origin_country and f['destination_country_id'] == dest_country
+    no_countries = f['origin_country_id'] is None
+    generic = (no_countries and f['destination_country_id'] is None
+               and f['service_type_id'] is None and f['wagon_category_id'] is None)
+
+    if not (same_countries or generic or
+            (no_countries and (f['service_type_id'] == service_type_id or
+                               f['wagon_category_id'] == wagon_category_id))):
+        return None
+
+    if same_countries and f['service_type_id'] == service_type_id and f['wagon_category_id'] == wagon_category_id:
+        return 100
+    if same_countries and f['service_type_id'] == service_type_id:
+        return 80
+    if same_countries and f['wagon_category_id'] == wagon_category_id:
+        return 75
+    if same_countries:
+        return 60
+    if no_countries and f['service_type_id'] == service_type_id:
+        return 40
+    if no_countries and f['wagon_category_id'] == wagon_category_id:
+        return 35
+    if generic:
+        return 10
+    return 0
+
+
+class TripCatalog:
+    """Catalogo in memoria di viaggi, fermate, paesi e categorie vagone per la generazione prenotazioni"""
+
+    def __init__(self, trips, route_stops, train_categories, seed=0, route_skew=1.1, time_skew=0.8):
+        self.trips = trips
+        self.route_stops = route_stops
+        self.train_categories = train_categories
+        self.random = random.Random(seed)
+
+        # Popolarità Zipf delle rotte: il rango è una permutazione deterministica dal seed
+        routes = sorted({trip['route_id'] for trip in trips if trip['route_id'] in route_stops})
+        self.random.shuffle(routes)
+        self.routes = routes
+        self.route_cum_weights = _zipf_cum_weights(len(routes), route_skew)
+
+        # Per ogni rotta: orari di partenza ordinati per vicinanza alle ore di punta, poi viaggi per orario
+        by_slot = {}
+        for trip in trips:
+            by_slot.setdefault(trip['route_id'], {}).setdefault(trip['departure_slot'], []).append(trip)
+
+        self.route_slots = {}
+        for route_id in routes:
+            slots = sorted(by_slot[route_id], key=lambda slot: (_peak_distance(slot), slot))
+            self.route_slots[route_id] = (
+                [by_slot[route_id][slot] for slot in slots],
+                _zipf_cum_weights(len(slots), time_skew)
+            )
+
+    @classmethod
+    def load(cls, cursor, **kwargs):
+        """Carica viaggi, fermate (con paese e coordinate) e categorie vagone con tre query"""
+        cursor.execute("""
+            SELECT t.id, ts.route_id, ts.service_type_id, ts.train_id, t.service_date,
+                   t.planned_departure_time, ts.departure_time
+            FROM trips t
+            JOIN train_services ts ON t.train_service_id = ts.id
+            WHERE t.status <> 'CANCELED'
+            ORDER BY t.service_date, t.planned_departure_time, ts.route_id, ts.service_type_id
+        """)
+        trips = [
+            {
+                'id': str(trip_id), 'route_id': str(route_id), 'service_type_id': str(service_type_id),
+                'train_id': str(train_id), 'service_date': service_date, 'planned_departure': planned_dep,
+                'departure_slot': dep_time.hour * 60 + dep_time.minute
+            }
+            for trip_id, route_id, service_type_id, train_id, service_date, planned_dep, dep_time
+            in cursor.fetchall()
+        ]
+
+        cursor.execute("""
+            SELECT rs.route_id, rs.id, rs.station_id, rs.sequence, rs.arrival_offset_min,
+                   rs.departure_offset_min, c.country_id, s.latitude, s.longitude
+            FROM route_stations rs
+            JOIN stations s ON rs.station_id = s.id
+            JOIN cities c ON s.city_id = c.id
+            ORDER BY rs.route_id, rs.sequence
+        """)
+        route_stops = {}
+        for route_id, rs_id, station_id, sequence, arr_off, dep_off, country_id, lat, lon in cursor.fetchall():
+            stops = route_stops.setdefault(str(route_id), [])
+            km = stops[-1]['km'] + _rail_km(stops[-1], lat, lon) if stops else 0.0
+            stops.append({
+                'route_station_id': str(rs_id), 'station_id': str(station_id), 'sequence': sequence,
+                'arrival_offset_min': arr_off, 'departure_offset_min': dep_off,
+                'country_id': _str_or_none(country_id), 'latitude': lat, 'longitude': lon, 'km': km
+            })
+
+        cursor.execute("""
+            SELECT tw.train_id, w.category_id
+            FROM train_wagons tw
+            JOIN wagons w ON tw.wagon_id = w.id
+            WHERE w.category_id IS NOT NULL
+            ORDER BY tw.train_id, tw.position
+        """)
+        train_categories = {}
+        for train_id, category_id in cursor.fetchall():
+            train_categories.setdefault(str(train_id), []).append(str(category_id))
+
+        # Le rotte con meno di due fermate non sono prenotabili
+        route_stops = {route_id: stops for route_id, stops in route_stops.items() if len(stops) >= 2}
+        trips = [trip for trip in trips if trip['route_id'] in route_stops and trip['train_id'] in train_categories]
+        return cls(trips, route_stops, train_categories, **kwargs)
+
+    def sample(self):
+        """Campiona (viaggio, fermata origine, fermata destinazione), anche su tratte intermedie"""
+        rng = self.random
+        route_id = rng.choices(self.routes, cum_weights=self.route_cum_weights)[0]
+        slot_trips, slot_weights = self.route_slots[route_id]
+        trips = rng.choices(slot_trips, cum_weights=slot_weights)[0]
+        trip = trips[rng.randrange(len(trips))]
+
+        stops = self.route_stops[route_id]
+        origin_idx, dest_idx = sorted(rng.sample(range(len(stops)), 2))
+        return trip, stops[origin_idx], stops[dest_idx]
+
+    def sample_category(self, trip):
+        """Categoria vagone del treno, pesata per numero di vagoni"""
+        categories = self.train_categories[trip['train_id']]
+        return categories[self.random.randrange(len(categories))]
+
+
+class BookingBatch:
+    """Righe di passeggeri, prenotazioni, segmenti e ticket pronte per la scrittura bulk"""
+
+    def __init__(self):
+        self.passengers = []
+        self.bookings = []
+        self.segments = []
+        self.tickets = []
+        self.booking_ids = []
+
+
+def unused_run_tag(cursor):
+    """Prefisso esadecimale per riferimenti e ticket non ancora usato da alcuna prenotazione.
+    Non viene dal generatore del catalogo: due run con lo stesso seed non devono collidere"""
+    while True:
+        run_tag = uuid.uuid4().hex[:6].upper()
+        cursor.execute("SELECT 1 FROM bookings WHERE booking_reference LIKE %s LIMIT 1", (f"BK{run_tag}%",))
+        if cursor.fetchone() is None:
+            return run_tag
+
+
+def build_booking_batch(catalog, fares, user_ids, passengers, count, run_tag=None):
+    """Genera in memoria `count` prenotazioni a segmento singolo con ticket"""
+    rng = catalog.random
+    run_tag = run_tag or uuid.uuid4().hex[:6].upper()
+    first_names, last_names, emails = passengers
+    batch = BookingBatch()
+    now = datetime.now()
+
+    for i in range(count):
+        trip, origin, dest = catalog.sample()
+        wagon_category_id = catalog.sample_category(trip)
+
+        departure = trip['planned_departure'] + timedelta(minutes=origin['departure_offset_min'])
+        arrival = trip['planned_departure'] + timedelta(minutes=dest['arrival_offset_min'])
+        distance = max(1, int(round(dest['km'] - origin['km'])))
+        fare_id, fare = fares.calculate(
+            origin['country_id'], dest['country_id'], distance, trip['service_type_id'], wagon_category_id
+        )
+
+        user_id = user_ids[rng.randrange(len(user_ids))]
+        passenger_id, booking_id, segment_id = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+
+        batch.passengers.append((passenger_id, user_id, first_names[i], last_names[i], emails[i], now, now))
+        batch.bookings.append((
+            booking_id, f"BK{run_tag}{i:08d}", user_id, passenger_id,
+            origin['station_id'], dest['station_id'], departure.date(),
+            fare, 'EUR', 'CONFIRMED', now, now
+        ))
+        batch.segments.append((
+            segment_id, booking_id, trip['id'], 1,
+            origin['station_id'], dest['station_id'], origin['route_station_id'], dest['route_station_id'],
+            departure, arrival, distance, fare, fare_id, now, now
+        ))
+        batch.tickets.append((
+            str(uuid.uuid4()), f"TK{run_tag}{i:08d}", booking_id, segment_id,
+            passenger_id, trip['id'], origin['station_id'], dest['station_id'],
+            wagon_category_id, fare, 'EUR', 'VALID', now, trip['service_date'], now, now
+        ))
+        batch.booking_ids.append(booking_id)
+
+    return batch
+
+
+def _zipf_cum_weights(n, skew):
+    return list(accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def _peak_distance(slot):
+    return min(abs(slot - peak) for peak in PEAK_HOURS_MIN)
+
+
+def _rail_km(previous, lat, lon):
+    """Distanza ferroviaria stimata dalla fermata precedente (haversine × fattore di tortuosità)"""
+    if None in (previous['latitude'], previous['longitude'], lat, lon):
+        return 25.0
+    lat1, lon1, lat2, lon2 = map(math.radians, (previous['latitude'], previous['longitude'], lat, lon))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a)) * RAIL_DETOUR_FACTOR
+
+
+def _str_or_none(value):
+    return str(value) if value is not None else None